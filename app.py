@@ -1,184 +1,265 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import dash_table
 import dash_auth
 import dash_cytoscape as cyto
+import dash_table
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+import numpy as np
 import pandas as pd
-import plotly.plotly as py
-import plotly.graph_objs as go
-import plotly.figure_factory as ff
-import re
-import copy
+import flask
 import os
-import ast
-
-def col_name(short):
-    lookup = {
-        'pid': 'Project-id',
-        'project': 'Project',
-        'desc': 'Description',
-        'grouping': 'Grouping',
-        'scale': 'Resource Requirement (Low/Medium/High)',
-        'status': 'Status (Potential/Committed/In progress/Completed/Rejected/Duplicate)',
-        'p_theme': 'Primary Library Strategy Theme',
-        's_themes': 'Secondary Strategy Theme(s)',
-        'all_themes': 'all_themes',
-        'teams': 'Library Teams involved',
-        'external': 'External Parties involved',
-        'start': 'Start Semester',
-        'end': 'End Semester'
-    }
-    if short in lookup:
-        return lookup[short]
-    else:
-        return short
+import threading
+import time
+import functools
+import inspect
+from urllib.parse import parse_qs, urlparse
+from columns import col_name
+from datasource import DataSource
+from datasets import Dataset, DatasetRegistry, parse_datasets
+from snapshot_store import SnapshotStore
+from semesters import snapshot_semesters, semester_index
+from tokens import cooccurrence_edges
+from figure_cache import FigureCache
+from coalesce import LatestRequests, Superseded
+from cube import AggregateCube, column_codes
+from filters import FILTER_DIMENSIONS, row_masks
+from graph_layouts import LAYOUTS, DEFAULT_LAYOUT, COUNT_LAYOUTS, graph_layouts
+from payload import compact
+from compression import configure_compression
+from metrics import Metrics
+from profiling import RequestProfiler
+from table import TABLE_COLUMNS, project_table
+from export import EXPORT_MIMETYPES, export_chunks
 
 if 'dash-it-all-url' in os.environ:
     url = os.environ['dash-it-all-url']
-    df = pd.read_excel(url, 'Projects')
 else:
     url = 'lmt_projects.csv'
-    df = pd.read_csv(url)
-
-df[col_name('s_themes')] = df[col_name('s_themes')].fillna('')
-df["all_themes"] = df[col_name('p_theme')].map(str) + ', ' + df[col_name('s_themes')]
-df[col_name('scale')] = df[col_name('scale')].str.strip()
-df[col_name('status')] = df[col_name('status')].str.strip()
-df[col_name('status')] = df[col_name('status')].str.capitalize()
-df[col_name('teams')] = df[col_name('teams')].fillna('')
-df[col_name('external')] = df[col_name('external')].fillna('') 
-df[col_name('start')] = df[col_name('start')].fillna('')  
-df[col_name('end')] = df[col_name('end')].fillna('') 
-valid_status = df[col_name('status')].value_counts().axes[0].tolist()
-valid_scales = df[col_name('scale')].value_counts().axes[0].tolist()
-valid_pthemes = df[col_name('p_theme')].value_counts().axes[0].sort_values().tolist()
+
+# Several sheets can be served as named datasets, configured as
+# 'dash-it-all-datasets' = name=url;name=url (see datasets.parse_datasets) and
+# picked with ?dataset=name. Without it the one sheet above is the dataset
+# 'default'. Datasets are loaded on first use; with 'dash-it-all-memory-mb'
+# set, the least recently used ones are dropped to stay within that budget.
+if 'dash-it-all-datasets' in os.environ:
+    dataset_urls = parse_datasets(os.environ['dash-it-all-datasets'])
+else:
+    dataset_urls = {'default': url}
+
+# A dataset's directory under a shared one; the single default dataset uses
+# the directory itself
+def dataset_directory(directory, name):
+    if directory is None or 'dash-it-all-datasets' not in os.environ:
+        return directory
+    return os.path.join(directory, name)
+
+# Each sheet is loaded into versioned snapshots and re-checked in the
+# background every 'dash-it-all-refresh' seconds (0 disables background
+# refreshes). With 'dash-it-all-snapshot-dir' set, every loaded sheet is also
+# written there in a binary format that later workers memory-map instead of
+# parsing the sheet. Figures are cached per dataset and data version;
+# 'dash-it-all-cache-dir' adds an on-disk copy of the cache shared by all
+# workers on the machine.
+def open_dataset(name, url):
+    store_dir = dataset_directory(os.environ.get('dash-it-all-snapshot-dir'), name)
+    source = DataSource(url, 'Projects',
+        interval=float(os.environ.get('dash-it-all-refresh', 300)),
+        timeout=float(os.environ.get('dash-it-all-timeout', 30)),
+        compact='dash-it-all-compact' in os.environ,
+        store=SnapshotStore(store_dir) if store_dir else None)
+    figure_cache = FigureCache(int(os.environ.get('dash-it-all-cache-size', 256)),
+        dataset_directory(os.environ.get('dash-it-all-cache-dir'), name))
+    return Dataset(name, source, figure_cache)
+
+datasets = DatasetRegistry(dataset_urls, open_dataset,
+    budget=float(os.environ.get('dash-it-all-memory-mb', 0)) * 1024 * 1024 or None)
+
+# The dataset named by the request's ?dataset= parameter or, for callback
+# and layout requests, by the page's (the referrer); None for the default
+def requested_dataset():
+    if not flask.has_request_context():
+        return None
+    name = flask.request.args.get('dataset')
+    if name is None and flask.request.referrer:
+        name = parse_qs(urlparse(flask.request.referrer).query).get('dataset', [None])[0]
+    if name is not None and name not in datasets:
+        flask.abort(404)
+    return name
+
+# Callbacks pin the dataset and snapshot they started with (see callback
+# below), so a refresh landing mid-request never mixes two versions in one
+# response
+pinned = threading.local()
+
+def current_dataset():
+    dataset = getattr(pinned, 'dataset', None)
+    if dataset is None:
+        dataset = datasets.get(requested_dataset())
+    return dataset
+
+def current_snapshot():
+    snapshot = getattr(pinned, 'snapshot', None)
+    if snapshot is None:
+        snapshot = current_dataset().source.snapshot
+    return snapshot
+
+def data_version():
+    return current_snapshot().digest
+
+# Callback requests carry the browser tab they came from and a sequence
+# number (see assets/request_sequence.js). A request superseded by a later
+# one for the same output stops at its next checkpoint and is answered with
+# 204 No Content; dash-renderer would have ignored its response anyway.
+latest_requests = LatestRequests()
+
+def request_ticket():
+    if not flask.has_request_context():
+        return None
+    try:
+        headers = flask.request.headers
+        return (headers['X-Dash-Tab'], flask.request.get_json()['output'], int(headers['X-Dash-Sequence']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def checkpoint():
+    latest_requests.check()
+
+# Per-callback latency, phase, payload and cache metrics, served on /metrics
+# when 'dash-it-all-metrics' is set
+metrics = Metrics('dash-it-all-metrics' in os.environ)
+
+# Cached values are stored in their compact form (see payload.compact), so
+# the cache and every response hold plain, rounded JSON values. Each dataset
+# has its own cache.
+def cached(func):
+    @functools.wraps(func)
+    def compacted(*args, **kwargs):
+        return compact(func(*args, **kwargs))
+    observer = metrics.cache_lookup if metrics.enabled else None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return current_dataset().figure_cache.call(data_version(), compacted, args, kwargs, observer, checkpoint)
+    return wrapper
+
 scale_colors = {'Low': 'rgb(39, 119, 180)', 
     'Medium': 'rgb(225, 127, 14)', 
     'High': 'rgb(44, 160, 44)' }
-# Methods to deal with multi-value columns
-def col_groups(col_series):
-    val_list = []
-    for row in col_series:
-        row_list = [x.strip() for x in row.split(',')]
-        row_list = [x.capitalize() for x in row_list]
-        val_list.append(row_list)
-    return val_list
-
-def col_value_counts(col_series, split=False):
-    if split == False:
-        return col_series.value_counts()
-    else:
-        val_list = []
-        for row in col_series:
-            row_list = [x.strip() for x in row.split(',')]
-            row_list = [x.capitalize() for x in row_list]
-            row_list = filter(None, row_list)
-            val_list.extend(row_list)
-        return pd.Series(val_list).value_counts()
 
 # Bar chart data
 # takes the column of interest, a boolean to indicate whether to break down by scale 
 # an array of statuses for filtering, and a boolean to indicate whether the column,
 # has multiple comma-separated values which must be handled
 # returns an array of 1 or more dicts for bar chart
-def column_bar_data(column, scales, statuses=[], teams=[], ptheme='', split=False):
-    dfbar = df
-    if len(statuses) > 0:
-        dfbar = dfbar[dfbar[col_name('status')].isin(statuses)]
-
-    teams = [re.escape(m) for m in teams]
-    if len(teams) > 0:
-        dfbar  = dfbar[dfbar[col_name('teams')].str.contains('|'.join(teams))]
-
-    if ptheme:
-        dfbar = dfbar[dfbar[col_name('p_theme')].isin([ptheme])]
+def column_bar_data(column, scales, statuses=[], teams=[], ptheme='', split=False, window=None):
+    snapshot = current_snapshot()
+    cube = bar_cube(snapshot, column, split)
+    cell_mask = cube.cell_mask(statuses, teams, ptheme, semester_index(snapshot).window(window))
 
     data = []
     if scales == []:
-        scales = valid_scales
+        scales = snapshot.valid_scales
+    else:
+        # the figure cache ignores the order and repeats of the chosen
+        # levels, so traces always come in the order of scale_colors
+        scales = sorted(set(scales), key=list(scale_colors).index)
 
     for scale in scales:
         color = scale_colors[scale]
-        dfscale = dfbar[dfbar[col_name('scale')] == scale]
-        col_vals = col_value_counts(dfscale[column], split)
+        col_vals = cube.value_counts(scale, cell_mask)
         if len(col_vals) > 0:
-            data.append({'x': col_vals.axes[0], 'y': col_vals.values, 'type': 'bar', 'name': scale, 'marker':{'color': color}}) 
+            data.append({'x': col_vals.index.tolist(), 'y': col_vals.values.tolist(), 'type': 'bar', 'name': scale, 'marker':{'color': color}})
     return data
 
-def bar_return_dict(scale, status, mode, column, title, teams=[], ptheme='', split=False, margin_dict={'b':25}):
-    data = column_bar_data(column, scale, status, teams, ptheme, split)
+# Aggregate cubes for every column a bar chart can show, built once per
+# snapshot. After a refresh that changed a few projects, they are updated
+# from the previous snapshot's cubes (see AggregateCube.update).
+bar_columns = [('status', False), ('grouping', False), ('p_theme', False), ('s_themes', True),
+    ('all_themes', True), ('teams', True), ('external', True)]
+
+def bar_cube(snapshot, column, split):
+    key = ('cube', column, split)
+    return snapshot.derive(key, lambda s: AggregateCube.build(s, column, split, s.previous_derived(key)))
+
+def build_bar_cubes(snapshot):
+    for short, split in bar_columns:
+        bar_cube(snapshot, col_name(short), split)
+
+datasets.add_warmer(build_bar_cubes)
+
+@cached
+def bar_return_dict(scale, status, mode, column, title, teams=[], ptheme='', split=False, margin_dict={'b':25}, window=None):
+    with metrics.phase('data'):
+        data = column_bar_data(column, scale, status, teams, ptheme, split, window)
     return {
         'data': data,
-        'layout': go.Layout( 
-            title=title,
-            yaxis={'title': '# of projects'},
-            barmode=mode,
-            margin=go.layout.Margin(margin_dict),
-            xaxis=go.layout.XAxis(categoryorder="category ascending")
-        ),
+        'layout': {
+            'title': {'text': title},
+            'yaxis': {'title': {'text': '# of projects'}},
+            'barmode': mode,
+            'margin': margin_dict,
+            'xaxis': {'categoryorder': 'category ascending'},
+        },
     }
 
 # Graph Data
-def graph_data(groups): 
-    all_vals = []
-    dict1= {}
-    for group in groups:
-        for val in group:
-            if val not in all_vals:
-                all_vals.append(val)
-
-            other_vals = [x for x in group if x != val]
-            for other_val in other_vals:
-                if val in dict1:
-                    if other_val in dict1[val]:
-                        dict1[val][other_val] += 1
-                    else:
-                        dict1[val][other_val] = 1
-                else:
-                    dict1[val] = {other_val: 1}
-    edges = []
-    for val in all_vals:
-        edges.append({'data': {'id': val, 'label': val}})
-
-    done_dict = {}
-
-    for k, v in dict1.items():
-        for k1, v1 in dict1[k].items():
-            if k1 in done_dict:
-                if k not in done_dict[k1]:
-                    edges.append({'data': {'source': k, 'target': k1, 'weight': dict1[k][k1]}})
-                    if k in done_dict:
-                        done_dict[k].append(k1)
-                    else:
-                        done_dict[k] = [k1]
-            else:
-                edges.append({'data':{'source': k, 'target': k1, 'weight': dict1[k][k1]}})
-                if k in done_dict:
-                    done_dict[k].append(k1)
-                else:
-                    done_dict[k] = [k1]
-    return edges
-
-def graph_elements(column, scale, status, ptheme):
-    dfgraph = df
-    if len(status) > 0:
-        dfgraph = dfgraph[dfgraph[col_name('status')].isin(status)]
-        
-    if len(scale) > 0:
-        dfgraph = dfgraph[dfgraph[col_name('scale')].isin(scale)]
-
-    if ptheme:
-        dfgraph = dfgraph[dfgraph[col_name('p_theme')].isin([ptheme])]
-
-    #dfgraph = dfgraph[dfgraph[col_name('p_theme')].isin(['T3'])]
-    groups = col_groups(dfgraph[column])
-    weighted_elements = graph_data(groups)
-    return weighted_elements 
-
+# Optional pruning so graphs over large vocabularies stay renderable: edges
+# lighter than 'dash-it-all-graph-min-weight' are dropped and, if
+# 'dash-it-all-graph-top-k' is set, each node keeps only its k heaviest edges
+graph_min_weight = int(os.environ.get('dash-it-all-graph-min-weight', 1))
+graph_top_k = int(os.environ.get('dash-it-all-graph-top-k', 0)) or None
+
+# Builds cytoscape nodes for every value present in the masked rows and
+# weighted edges for every pair of values that appear on the same project.
+# Nodes are identified by their short vocabulary code, so edges do not
+# repeat the labels. Given layouts (see graph_layouts.GraphLayouts), nodes
+# also carry their position in the named layout.
+def graph_node_id(code):
+    return 'n{0}'.format(code)
+
+def graph_data(index, mask, min_weight=1, top_k=None, layouts=None, layout=DEFAULT_LAYOUT):
+    with metrics.phase('data'):
+        present = np.flatnonzero(index.counts(mask))
+        matrix = index.cooccurrence(mask)
+        sources, targets, weights = cooccurrence_edges(matrix, min_weight, top_k)
+        positions = None if layouts is None else layouts.positions(layout, present, matrix).round(1)
+    checkpoint()
+
+    elements = []
+    for i, code in enumerate(present):
+        node = {'data': {'id': graph_node_id(code), 'label': index.vocab[code]}}
+        if positions is not None:
+            node['position'] = {'x': float(positions[i, 0]), 'y': float(positions[i, 1])}
+        elements.append(node)
+    for source, target, weight in zip(sources, targets, weights):
+        elements.append({'data': {'source': graph_node_id(source), 'target': graph_node_id(target), 'weight': int(weight)}})
+    return elements
+
+# Columns shown as relationship graphs. Their co-occurrence weights are
+# warmed with every snapshot, so they can be updated from the previous ones.
+graph_columns = [col_name('teams'), col_name('all_themes')]
+
+def build_graph_layouts(snapshot):
+    for column in graph_columns:
+        graph_layouts(snapshot, column)
+
+datasets.add_warmer(build_graph_layouts)
+
+# Node positions are computed here rather than by cytoscape, which is sent a
+# 'preset' layout and only places the nodes
+@cached
+def graph_elements(column, scale, status, ptheme, layout=DEFAULT_LAYOUT, window=None):
+    snapshot = current_snapshot()
+    with metrics.phase('data'):
+        mask = row_masks(snapshot).mask(scale, status, [], ptheme, window)
+    return graph_data(snapshot.tokens[column], mask, graph_min_weight, graph_top_k,
+        graph_layouts(snapshot, column), layout)
+
+# The default rules are shared and never modified, so a shallow copy is enough
 def graph_stylesheet(node):
-    styles = copy.deepcopy(default_graph_stylesheet)
+    styles = list(default_graph_stylesheet)
     styles.append(
         {
             'selector': 'node[id = "{}"]'.format(node['data']['id']),
@@ -188,9 +269,10 @@ def graph_stylesheet(node):
             }
         }
     )
-    for edge in node['edgesData']:
+    # a single rule for all the node's edges
+    if node['edgesData']:
         styles.append({
-                "selector": 'edge[id= "{}"]'.format(edge['id']),
+                "selector": ', '.join('edge[id= "{}"]'.format(edge['id']) for edge in node['edgesData']),
                 "style": {
                     "line-color": 'blue',
                     'opacity': 0.9,
@@ -200,75 +282,259 @@ def graph_stylesheet(node):
     return styles
 
 # Gantt data
-def valid_sem(sem):
-    pattern = re.compile("^20\d{2}\/20\d{2}-0[1-3]$")
-    if pattern.match(sem):
-        return True
-    else:
-        return False
-        
-def sem_to_date(sem, start_end):
-    assert(valid_sem(sem)), "Error loading gantt chart. {0} is not a valid semester".format(sem)
-    
-    semester = sem.split('-')[1]
-    years = sem.split('-')[0]
-    start_year = years.split("/")[0]
-    end_year = years.split("/")[1]
-    if semester == '01':
-        if start_end == 'start':
-            return '{0}-09-01'.format(start_year)
-        else:
-            return '{0}-12-31'.format(start_year)
-    elif semester == '02':
-        if start_end == 'start':
-            return '{0}-01-01'.format(end_year)
-        else:
-            return '{0}-04-30'.format(end_year)
-    else:
-        if start_end == 'start':
-            return '{0}-05-01'.format(end_year)
-        else:
-            return '{0}-08-31'.format(end_year)    
-    
-def gantt_data(scale, status, title, teams=[], ptheme=''):
-    dfgantt = df
-    dfgantt[col_name('teams')] = dfgantt[col_name('teams')].str.lower()
-    if len(status) > 0:
-        relvant_status = ['Completed', 'In progress', 'Committed']
-        valid_status = list(set(status) & set(relvant_status))
-        dfgantt = dfgantt[dfgantt[col_name('status')].isin(valid_status)]
-        
-    if len(scale) > 0:
-        dfgantt = dfgantt[dfgantt[col_name('scale')].isin(scale)]
-
-    teams = [re.escape(m) for m in teams]
-    if len(teams) > 0:
-        dfgantt = dfgantt[dfgantt[col_name('teams')].str.contains('|'.join(teams))]
-    
-    if ptheme:
-        dfgantt = dfgantt[dfgantt[col_name('p_theme')].isin([ptheme])]
-    
-    data = []
-    for index, row in dfgantt.iterrows():
-        pid = row[col_name('pid')]
-        project = row[col_name('project')]
-        project = (project[:40] + '....') if len(project) > 40 else project
-        row_scale = row[col_name('scale')]
-        task = '{0} - {1}'.format(pid, project)
-        try:
-            start_sem = sem_to_date(row[col_name('start')], 'start')
-            end_sem = sem_to_date(row[col_name('end')], 'end')
-            data.append({'Task':task, 'Start':start_sem, 'Finish':end_sem, 'Resource': row_scale})
-        except:
-            print('skipping {0} - failed to load valid values'.format(task))
+# 'traces' builds one line trace per resource level, 'figure_factory' draws
+# the chart with ff.create_gantt (a trace and a shape per task, several times
+# the payload)
+gantt_builder = os.environ.get('dash-it-all-gantt', 'traces')
+
+# Rows the Gantt chart shows at once. Projects are paged by this many, and
+# the 'auto' level of detail collapses them into Grouping lanes when more
+# projects match.
+gantt_rows = int(os.environ.get('dash-it-all-gantt-rows', 50))
+
+gantt_layout = {
+    'autosize': True,
+    'xaxis': dict(automargin=True, mirror='allticks', dtick='M4'),
+    'margin': dict(b=10, l=350),
+}
 
+# Layout sized to the rows shown: the height grows with the number of rows
+# and the left margin with the longest row label
+def gantt_sized_layout(title, labels, window=None):
+    longest = max([len(label) for label in labels] or [0])
+    layout = dict(gantt_layout, title=title, height=max(300, 150 + 22 * len(labels)),
+        margin=dict(gantt_layout['margin'], l=min(350, 40 + 7 * longest)))
+    if window is not None:
+        layout['xaxis'] = dict(gantt_layout['xaxis'], range=list(window))
+    return layout
+
+# Levels of detail the Gantt chart offers: one row per project, or lanes
+# collapsing the projects of a Grouping or Primary Theme
+gantt_lane_columns = {'grouping': 'Grouping', 'p_theme': 'Primary Theme'}
+
+gantt_detail_dropdown_args = {
+    'options': [{'label': 'Automatic level of detail', 'value': 'auto'},
+                {'label': 'One row per project', 'value': 'projects'},
+                {'label': 'Lanes by Grouping', 'value': 'grouping'},
+                {'label': 'Lanes by Primary Theme', 'value': 'p_theme'}],
+    'value': 'auto',
+    'multi': False,
+    'searchable': False,
+    'clearable': False,
+}
+
+# One row per task with the columns ff.create_gantt expects. Semester dates
+# are parsed once per snapshot, so this is just column operations.
+def gantt_tasks(snapshot, mask):
+    mask = mask & snapshot.valid_dates
+    df = snapshot.df[mask]
+    project = df[col_name('project')].astype(str)
+    project = project.where(project.str.len() <= 40, project.str[:40] + '....')
+    return pd.DataFrame({
+        'Task': df[col_name('pid')].astype(str) + ' - ' + project,
+        'Start': pd.Series(snapshot.start_dates[mask]).dt.strftime('%Y-%m-%d').values,
+        'Finish': pd.Series(snapshot.end_dates[mask]).dt.strftime('%Y-%m-%d').values,
+        'Resource': df[col_name('scale')].values,
+    }, columns=['Task', 'Start', 'Finish', 'Resource'])
+
+# One row per lane (a value of column) with the same columns as gantt_tasks.
+# A lane holds a task per resource level and run of semesters with the same
+# number of active projects (SemesterIndex.active_counts), so its size
+# depends on the number of semesters rather than projects. Text gives the
+# number of projects active. Only semesters first to last are drawn.
+def gantt_lanes(snapshot, mask, column, first, last):
+    mask = mask & snapshot.valid_dates
+    semesters = snapshot_semesters(snapshot)
+    lane_codes, lanes = pd.factorize(snapshot.df[column].astype(object).fillna('(none)').astype(str).values,
+        sort=True)
+    scale_codes, scales = column_codes(snapshot, col_name('scale'))
+    mask &= scale_codes >= 0
+    groups = lane_codes * len(scales) + scale_codes
+    active = semester_index(snapshot).active_counts(mask, groups, len(lanes) * len(scales))[:, first:last + 1]
+
+    # runs start where the count changes and end before the next change
+    count = active.shape[1]
+    changes = np.ones(active.shape, dtype=bool)
+    changes[:, 1:] = active[:, 1:] != active[:, :-1]
+    groups, columns = np.nonzero(changes)
+    same_group = np.append(groups[1:] == groups[:-1], False)
+    run_ends = np.where(same_group, np.append(columns[1:], count), count) - 1
+    running = active[groups, columns]
+    keep = running > 0
+    groups, columns, run_ends, running = groups[keep], columns[keep], run_ends[keep], running[keep]
+
+    totals = np.bincount(lane_codes[mask], minlength=len(lanes))
+    return pd.DataFrame({
+        'Task': [u'{0} ({1})'.format(lanes[lane], totals[lane]) for lane in groups // max(len(scales), 1)],
+        'Start': pd.Series(semesters['start'].values[first + columns]).dt.strftime('%Y-%m-%d').values,
+        'Finish': pd.Series(semesters['end'].values[first + run_ends]).dt.strftime('%Y-%m-%d').values,
+        'Resource': np.asarray(scales, dtype=object)[groups % max(len(scales), 1)],
+        'Text': ['{0} projects active'.format(n) for n in running],
+    }, columns=['Task', 'Start', 'Finish', 'Resource', 'Text'])
+
+def gantt_figure_factory(tasks, layout):
+    # only needed for this builder, so it is imported on first use
+    import plotly.figure_factory as ff
     colors = {'Low': scale_colors['Low'],
               'Medium': scale_colors['Medium'],
               'High': scale_colors['High']}
-    fig = ff.create_gantt(data, colors=colors, index_col='Resource', showgrid_x=True, showgrid_y=True, show_colorbar=True)
-    fig['layout'].update(autosize=True, width=1300, height=1500, title=title, xaxis=dict(automargin=True, mirror='allticks', dtick='M4'), margin=dict(b=10, l=350))
+    fig = ff.create_gantt(tasks.to_dict('records'), colors=colors, index_col='Resource', showgrid_x=True, showgrid_y=True, show_colorbar=True)
+    fig['layout'].update(**layout)
     return fig
 
+# Draws each resource level as a single trace of line segments separated by
+# gaps, instead of the shape and scatter per task ff.create_gantt produces.
+# Lanes draw the levels as nested bars of decreasing width, so levels
+# sharing a semester all stay visible.
+def gantt_traces(tasks, layout, lanes=False):
+    widths = {'Low': 18, 'Medium': 12, 'High': 6} if lanes else {}
+    data = []
+    for scale in [s for s in scale_colors if s in set(tasks['Resource'])]:
+        rows = tasks[tasks['Resource'] == scale]
+        x = [None] * (3 * len(rows))
+        y = [None] * (3 * len(rows))
+        x[0::3] = rows['Start'].tolist()
+        x[1::3] = rows['Finish'].tolist()
+        y[0::3] = y[1::3] = rows['Task'].tolist()
+        trace = {'x': x, 'y': y, 'type': 'scatter', 'mode': 'lines', 'name': scale,
+                 'line': {'color': scale_colors[scale], 'width': widths.get(scale, 15)}, 'hoverinfo': 'x+y+name'}
+        if lanes:
+            text = [None] * (3 * len(rows))
+            text[0::3] = text[1::3] = rows['Text'].tolist()
+            trace.update(text=text, hoverinfo='x+y+name+text')
+        data.append(trace)
+
+    layout = dict(layout, showlegend=True, hovermode='closest')
+    layout['xaxis'] = dict(layout['xaxis'], type='date', showgrid=True)
+    layout['yaxis'] = {'showgrid': True, 'categoryorder': 'array',
+                       'categoryarray': tasks['Task'].drop_duplicates().tolist()}
+    return {'data': data, 'layout': layout}
+
+# Projects matching the filters and running during the window are drawn one
+# row each, gantt_rows to a page, or collapsed into lanes (detail 'grouping'
+# or 'p_theme'). 'auto' shows projects while they fit on one page.
+# Statuses the Gantt chart shows; other chosen statuses are ignored
+gantt_statuses = ['Completed', 'In progress', 'Committed']
+
+@cached
+def gantt_data(scale, status, title, teams=[], ptheme='', window=None, detail='auto', page=1):
+    snapshot = current_snapshot()
+    valid_status = list(set(status) & set(gantt_statuses))
+    with metrics.phase('data'):
+        mask = row_masks(snapshot).mask(scale, valid_status, teams, ptheme, window) & snapshot.valid_dates
+        semesters = snapshot_semesters(snapshot)
+        first, last = semester_index(snapshot).window(window) or (0, len(semesters) - 1)
+        bounds = None
+        if last >= 0:
+            bounds = [semesters['start'].values[first], semesters['end'].values[last]]
+        count = int(mask.sum())
+        if detail not in gantt_lane_columns and detail != 'projects':
+            detail = 'projects' if count <= gantt_rows else 'grouping'
+        if detail in gantt_lane_columns:
+            tasks = gantt_lanes(snapshot, mask, col_name(detail), first, last)
+            title = '{0} ({1} projects by {2})'.format(title, count, gantt_lane_columns[detail])
+        else:
+            pages = max(1, -(-count // gantt_rows))
+            page = min(max(int(page or 1), 1), pages)
+            rows = np.flatnonzero(mask)[(page - 1) * gantt_rows:page * gantt_rows]
+            page_mask = np.zeros(len(mask), dtype=bool)
+            page_mask[rows] = True
+            tasks = gantt_tasks(snapshot, page_mask)
+            if pages > 1:
+                title = '{0} (projects {1}-{2} of {3}, page {4} of {5})'.format(
+                    title, (page - 1) * gantt_rows + 1, (page - 1) * gantt_rows + len(rows), count, page, pages)
+    checkpoint()
+    window_dates = None if bounds is None else [str(d)[:10] for d in bounds]
+    # none of the chosen statuses is shown on the chart
+    if len(tasks) == 0 or (len(status) > 0 and len(valid_status) == 0):
+        return {'data': [], 'layout': gantt_sized_layout(title, [], window_dates)}
+    layout = gantt_sized_layout(title, tasks['Task'].drop_duplicates().tolist(), window_dates)
+    if gantt_builder == 'figure_factory' and detail not in gantt_lane_columns:
+        return gantt_figure_factory(tasks, layout)
+    return gantt_traces(tasks, layout, lanes=detail in gantt_lane_columns)
+
+# Projects active in each semester of the window, stacked by resource level.
+# Counted with one sweep over the interval endpoints for all levels at once
+# (SemesterIndex.active_counts).
+@cached
+def active_timeline(scale, status, title, teams=[], ptheme='', window=None):
+    snapshot = current_snapshot()
+    index = semester_index(snapshot)
+    with metrics.phase('data'):
+        mask = row_masks(snapshot).mask(scale, status, teams, ptheme)
+        scale_codes, scales = column_codes(snapshot, col_name('scale'))
+        counts = index.active_counts(mask & (scale_codes >= 0), scale_codes, len(scales))
+    first, last = index.window(window) or (0, len(index.table) - 1)
+    labels = index.table['label'].tolist()[first:last + 1]
+
+    data = []
+    for level in [s for s in scale_colors if s in scales]:
+        data.append({'x': labels, 'y': counts[scales.index(level), first:last + 1].tolist(), 'type': 'bar',
+                     'name': level, 'marker': {'color': scale_colors[level]}})
+    return {
+        'data': data,
+        'layout': {
+            'title': {'text': title},
+            'yaxis': {'title': {'text': '# of active projects'}},
+            'barmode': 'stack',
+            'margin': {'b': 100},
+        },
+    }
+
+
+# Filters of every cached figure function, from its bound arguments, as
+# (scale, status, teams, ptheme, window). A figure only depends on the
+# projects its filters select, so after a refresh that changed a few
+# projects, figures whose filters select none of them (in the old or the new
+# sheet) are carried over to the new version by carry_figures. The timeline
+# counts every semester and only then cuts out the window.
+figure_filters = {
+    bar_return_dict: lambda a: (a['scale'], a['status'], a['teams'], a['ptheme'], a['window']),
+    graph_elements: lambda a: (a['scale'], a['status'], [], a['ptheme'], a['window']),
+    gantt_data: lambda a: (a['scale'], list(set(a['status']) & set(gantt_statuses)), a['teams'], a['ptheme'],
+        a['window']),
+    active_timeline: lambda a: (a['scale'], a['status'], a['teams'], a['ptheme'], None),
+}
+figure_functions = {func.__name__: func for func in figure_filters}
+
+# What figures depend on besides the rows they select: the scale, status and
+# theme values (and their order) and the semesters
+def same_outline(previous, snapshot):
+    return (previous.valid_scales == snapshot.valid_scales and previous.valid_status == snapshot.valid_status
+        and previous.valid_pthemes == snapshot.valid_pthemes
+        and snapshot_semesters(previous)['label'].tolist() == snapshot_semesters(snapshot)['label'].tolist())
+
+# Graphs also place their nodes by layouts of the whole vocabulary
+def same_graph(previous, snapshot, column, layout):
+    before, after = graph_layouts(previous, column), graph_layouts(snapshot, column)
+    if before.index.vocab != after.index.vocab:
+        return False
+    return layout in COUNT_LAYOUTS or np.array_equal(before.weights, after.weights)
+
+def carry_figures(dataset, previous, snapshot):
+    changes = snapshot.changes
+    if changes is None or changes.previous is not previous or not same_outline(previous, snapshot):
+        return
+    before, after = row_masks(previous), row_masks(snapshot)
+
+    # figures whose arguments cannot be checked are computed again
+    def keep(name, args, kwargs):
+        func = figure_functions.get(name)
+        try:
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            bound.apply_defaults()
+            values = bound.arguments
+            if func is graph_elements and not same_graph(previous, snapshot, values['column'], values['layout']):
+                return False
+            filters = figure_filters[func](values)
+            return not (before.mask(*filters)[changes.removed].any() or
+                        after.mask(*filters)[changes.changed].any())
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    dataset.figure_cache.carry_over(previous.digest, snapshot.digest, keep)
+
+datasets.add_transition(carry_figures)
 
 # Define some re-usable values for HTML components
 def options_list(list, lower_val=False):
@@ -280,22 +546,6 @@ def options_list(list, lower_val=False):
         options.append({'label': val, 'value': value})
     return options
 
-scale_dropdown_args = {
-    'options':options_list(valid_scales), 
-    'value':valid_scales,
-    'multi': True,
-    'searchable':False,
-    'placeholder':"Showing all resource requirement levels, click to filter by one or more ...",
-}
-
-status_dropdown_args = {
-    'options':options_list(valid_status), 
-    'value':['Committed', 'In progress', 'Completed'],
-    'multi': True,
-    'searchable':False,
-    'placeholder':"Showing all project statuses, click to filter by one or more ...",
-}
-            
 barmode_dropdown_args={
     'options':[
         {'label': 'Stack Resource Requirements', 'value':'stack'},
@@ -320,20 +570,9 @@ themes_dropdown_args={
     'clearable': False
 }
 
-ptheme_options = []
-for ptheme in valid_pthemes:
-    ptheme_options.append({'label': 'Primary Theme: {0}'.format(ptheme), 'value': ptheme})
-
-ptheme_dropdown_args={
-    'options': ptheme_options,
-    'multi': False,
-    'searchable':False,
-    'placeholder':"Filter by a specific Primary Theme ...",
-}
-
 graph_layout_dropdown_args = {
-    'options': options_list(['random', 'grid', 'circle', 'concentric', 'breadthfirst', 'cose']),
-    'value':'circle',
+    'options': options_list(LAYOUTS),
+    'value': DEFAULT_LAYOUT,
     'multi':False,
     'searchable':False,
     'clearable':False
@@ -357,137 +596,373 @@ default_graph_stylesheet = [
     ]
 
 graph_layout_default_args={
-    'layout':{'name': 'circle', 'animate': True},
+    'layout':{'name': 'preset'},
     'elements':[],
     'style':{'width': '100%', 'height': '800px'},
     'zoomingEnabled': False,
     'stylesheet': default_graph_stylesheet
 }
 
-all_teams = col_value_counts(df[col_name('teams')], True).axes[0].sort_values()
-all_teams = list(filter(None, all_teams))
-all_teams_lower = [x.lower() for x in all_teams]
-teams_dropdown_args = {
-    'options': options_list(all_teams, True), 
-    'value': [],
-    'multi':True,
-    'searchable':False,
-    'placeholder':"Filter projects by one or more teams...",
+# The project table is paged, sorted and filtered on the server (see
+# update_project_table), so only the visible page is ever sent
+table_page_size = int(os.environ.get('dash-it-all-table-page-size', 25))
+
+table_args = {
+    'columns': [{'name': col_name(short), 'id': short} for short in TABLE_COLUMNS],
+    'data': [],
+    'pagination_mode': 'be',
+    'pagination_settings': {'current_page': 0, 'page_size': table_page_size},
+    'sorting': 'be',
+    'sorting_type': 'multi',
+    'sorting_settings': [],
+    'filtering': 'be',
+    'filtering_settings': '',
+    'style_data': {'whiteSpace': 'normal'},
+    'css': [{
+        'selector': '.dash-cell div.dash-cell-value',
+        'rule': 'display: inline; white-space: inherit; overflow: inherit; text-overflow: inherit;'
+    }],
 }
 
+# Dropdown arguments that depend on the data are built once per snapshot
+def build_dropdown_args(snapshot):
+    all_teams = snapshot.tokens[col_name('teams')].vocab
+
+    ptheme_options = []
+    for ptheme in snapshot.valid_pthemes:
+        ptheme_options.append({'label': 'Primary Theme: {0}'.format(ptheme), 'value': ptheme})
+
+    return {
+        'scale': {
+            'options':options_list(snapshot.valid_scales), 
+            'value':snapshot.valid_scales,
+            'multi': True,
+            'searchable':False,
+            'placeholder':"Showing all resource requirement levels, click to filter by one or more ...",
+        },
+        'status': {
+            'options':options_list(snapshot.valid_status), 
+            'value':['Committed', 'In progress', 'Completed'],
+            'multi': True,
+            'searchable':False,
+            'placeholder':"Showing all project statuses, click to filter by one or more ...",
+        },
+        'ptheme': {
+            'options': ptheme_options,
+            'multi': False,
+            'searchable':False,
+            'placeholder':"Filter by a specific Primary Theme ...",
+        },
+        'teams': {
+            'options': options_list(all_teams, True), 
+            'value': [],
+            'multi':True,
+            'searchable':False,
+            'placeholder':"Filter projects by one or more teams...",
+        },
+    }
+
+def dropdown_args(snapshot):
+    return snapshot.derive('dropdown_args', build_dropdown_args)
+
+datasets.add_warmer(dropdown_args)
+
+# Optional dashboard-wide filter bar ('dash-it-all-filter-bar'). Chart
+# dropdowns then start empty and inherit the dashboard filter until a value is
+# picked for the chart, and all figures are computed in one callback.
+filter_bar = 'dash-it-all-filter-bar' in os.environ
+
+def build_chart_dropdown_args(snapshot):
+    args = dropdown_args(snapshot)
+    if not filter_bar:
+        return args
+    inherited = dict(args)
+    for dim in [d for d in FILTER_DIMENSIONS if d in args]:
+        inherited[dim] = dict(args[dim], value=[] if args[dim]['multi'] else None,
+            placeholder='Using the dashboard filter, click to override ...')
+    return inherited
+
+def chart_dropdown_args(snapshot):
+    return snapshot.derive('chart_dropdown_args', build_chart_dropdown_args)
+
+# A range over the semesters of the sheet, marked at the start of each
+# academic year. Values are positions in snapshot_semesters.
+def semester_slider_args(snapshot):
+    labels = snapshot_semesters(snapshot)['label'].tolist()
+    last = max(len(labels) - 1, 0)
+    return {
+        'min': 0,
+        'max': last,
+        'value': [0, last],
+        'marks': {i: label[:5] + label[7:9] for i, label in enumerate(labels) if label.endswith('-01')},
+        'allowCross': False,
+    }
+
+def filter_bar_components(snapshot):
+    if not filter_bar:
+        return []
+    args = dropdown_args(snapshot)
+    return [html.Div(className="graph-box filter-bar",
+        children=[
+            html.Div(className="graph-title", children=[html.H3('Dashboard filters'),]),
+        ] + [dcc.Dropdown(id='filter-{0}'.format(dim), **args[dim]) for dim in FILTER_DIMENSIONS if dim in args]
+          + [dcc.RangeSlider(id='filter-window', **semester_slider_args(snapshot))]
+    )]
+
 # App setup and layout
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=True)
 server = app.server
 
+# Responses are gzipped at 'dash-it-all-gzip-level'; with the brotli package
+# installed, clients that accept it get brotli at 'dash-it-all-brotli-quality'
+gzip_level = int(os.environ.get('dash-it-all-gzip-level', 6))
+brotli_quality = int(os.environ.get('dash-it-all-brotli-quality', 4))
+configure_compression(server, gzip_level, brotli_quality)
+
+auth = None
 if 'dash-it-all-pass' in os.environ:
+    import ast
     pass_pairs = ast.literal_eval(os.environ['dash-it-all-pass'])
     auth = dash_auth.BasicAuth(
         app,
         pass_pairs
     )
 
-app.layout =html.Div(children=[
-    html.H1(children='UCC Library Strategy - Planning Dashboard'),
-
-    html.Div(children='''
-        The plots below provide an overview of the projects being undertaken in support of the UCC Library Strategy.
-    '''),
-    html.Div(className="graph-box",
-        children=[
-            dcc.Graph(id='status-bar'),
-            dcc.Dropdown(id='status-bar-barmode', **barmode_dropdown_args),
-            dcc.Dropdown(id='status-bar-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='status-bar-teams', **teams_dropdown_args), 
-            dcc.Dropdown(id='status-bar-scale', **scale_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            dcc.Graph(id='pthemes-bar'),
-            dcc.Dropdown(id='pthemes-bar-barmode', **barmode_dropdown_args),
-            dcc.Dropdown(id='pthemes-bar-themes', **themes_dropdown_args),
-            dcc.Dropdown(id='pthemes-bar-teams', **teams_dropdown_args), 
-            dcc.Dropdown(id='pthemes-bar-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='pthemes-bar-status', **status_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            html.Div(className="graph-title", children=[html.H3('Intra-project theme relationships'),]),
-            cyto.Cytoscape(id='theme-graph', **graph_layout_default_args),
-            dcc.Dropdown(id='theme-graph-layout', **graph_layout_dropdown_args),
-            dcc.Dropdown(id='theme-graph-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='theme-graph-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='theme-graph-status', **status_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            dcc.Graph(id='grp-bar'),
-            dcc.Dropdown(id='grp-bar-barmode', **barmode_dropdown_args),
-            dcc.Dropdown(id='grp-bar-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='grp-bar-teams', **teams_dropdown_args), 
-            dcc.Dropdown(id='grp-bar-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='grp-bar-status', **status_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            dcc.Graph(id='teams-bar'),
-            dcc.Dropdown(id='teams-bar-barmode', **barmode_dropdown_args),
-            dcc.Dropdown(id='teams-bar-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='teams-bar-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='teams-bar-status', **status_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            dcc.Graph(id='external-bar'),
-            dcc.Dropdown(id='external-bar-barmode', **barmode_dropdown_args),
-            dcc.Dropdown(id='external-bar-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='external-bar-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='external-bar-status', **status_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            html.Div(className="graph-title", children=[html.H3('Intra-project Team relationships'),]),
-            cyto.Cytoscape(id='teams-graph', **graph_layout_default_args),
-            dcc.Dropdown(id='teams-graph-layout', **graph_layout_dropdown_args),
-            dcc.Dropdown(id='teams-graph-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='teams-graph-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='teams-graph-status', **status_dropdown_args),
-        ]
-    ),
-    html.Div(className="graph-box",
-        children=[
-            dcc.Graph(id='proj-gantt'),
-            dcc.Dropdown(id='proj-gantt-ptheme', **ptheme_dropdown_args),
-            dcc.Dropdown(id='proj-gantt-teams', **teams_dropdown_args),
-            dcc.Dropdown(id='proj-gantt-scale', **scale_dropdown_args),
-            dcc.Dropdown(id='proj-gantt-status', **status_dropdown_args),
+def authorized():
+    return auth is None or auth.is_authorized()
+
+# dash_auth only protects the views that exist when it is set up, so routes
+# added to the server afterwards check the credentials themselves
+def requires_auth(view):
+    @functools.wraps(view)
+    def protected(*args, **kwargs):
+        if not authorized():
+            return auth.login_request()
+        return view(*args, **kwargs)
+    return protected
+
+# Gauges of the loaded datasets, labelled with their names
+def snapshot_gauges():
+    gauges = [
+        ('dash_datasets_loaded', [], len(datasets.loaded())),
+        ('dash_datasets_evicted', [], datasets.evictions),
+        ('dash_callbacks_superseded', [], latest_requests.superseded),
+    ]
+    for dataset in datasets.loaded():
+        labels = [('dataset', dataset.name)]
+        snapshot = dataset.source.snapshot
+        stats = dataset.figure_cache.stats()
+        gauges += [
+            ('dash_snapshot_version', labels, snapshot.version),
+            ('dash_snapshot_rows', labels, len(snapshot.df)),
+            ('dash_snapshot_bytes', labels, dataset.nbytes()),
+            ('dash_snapshot_load_seconds', labels, dataset.source.last_duration or 0),
+            ('dash_snapshot_age_seconds', labels, time.time() - snapshot.loaded_at),
+            ('dash_figure_cache_entries', labels, stats['entries']),
+            ('dash_figure_cache_shared', labels, stats['shared']),
         ]
-    ),
-    #html.Div(className="graph-box",
-    #    children=[
-    #        dash_table.DataTable(
-    #            style_data={'whiteSpace': 'normal'},
-    #            css=[{
-    #                'selector': '.dash-cell div.dash-cell-value',
-    #                'rule': 'display: inline; white-space: inherit; overflow: inherit; text-overflow: inherit;'
-    #            }],
-    #            id='table',
-    #            columns=[{"name": i, "id": i} for i in df.columns],
-    #            data=df.to_dict("rows"),
-    #        )
-    #    ]
-    #),    
-]) 
+    # the samples of a metric have to be listed together
+    return sorted(gauges, key=lambda gauge: gauge[0])
+
+if metrics.enabled:
+    metrics.add_gauge(snapshot_gauges)
+
+    @server.route('/metrics')
+    @requires_auth
+    def serve_metrics():
+        return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Export of the projects matching the chart filters, streamed in chunks as
+# CSV or NDJSON. Filters are query parameters, repeated for several values,
+# and window takes two semester slider positions:
+#   /export.csv?status=Committed&teams=Team 1&teams=Team 2&window=3,8
+@server.route('/export.<fmt>')
+@requires_auth
+def export_projects(fmt):
+    if fmt not in EXPORT_MIMETYPES:
+        flask.abort(404)
+    args = flask.request.args
+    try:
+        window = [int(v) for v in args['window'].split(',')] if args.get('window') else None
+    except ValueError:
+        window = []
+    if window is not None and len(window) != 2:
+        flask.abort(400)
+    snapshot = current_snapshot()
+    mask = row_masks(snapshot).mask(args.getlist('scale'), args.getlist('status'), args.getlist('teams'),
+        args.get('ptheme', ''), window)
+    response = flask.Response(export_chunks(snapshot, mask, fmt), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename=projects-{0}.{1}'.format(snapshot.version, fmt)
+    return response
+
+# On-demand profiling of callback requests: with 'dash-it-all-profile-dir'
+# set, a callback request from an authorized client carrying an
+# X-Dash-Profile header (cprofile or sample) is profiled into that directory,
+# which is kept under 'dash-it-all-profile-max-mb' megabytes
+if 'dash-it-all-profile-dir' in os.environ:
+    profiler = RequestProfiler(os.environ['dash-it-all-profile-dir'],
+        int(float(os.environ.get('dash-it-all-profile-max-mb', 100)) * 1024 * 1024))
+    update_endpoint = '{0}_dash-update-component'.format(app.config['routes_pathname_prefix'])
+    server.view_functions[update_endpoint] = profiler.wrap(server.view_functions[update_endpoint], authorized)
+
+# The layout only changes with the data, so it is built once per snapshot.
+# Dash calls serve_layout when it is assigned and on every page load.
+def build_layout(snapshot):
+    args = chart_dropdown_args(snapshot)
+    return html.Div(children=[
+        html.H1(children='UCC Library Strategy - Planning Dashboard'),
+
+        html.Div(children='''
+            The plots below provide an overview of the projects being undertaken in support of the UCC Library Strategy.
+        '''),
+    ] + filter_bar_components(snapshot) + [
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='status-bar'),
+                dcc.Dropdown(id='status-bar-barmode', **barmode_dropdown_args),
+                dcc.Dropdown(id='status-bar-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='status-bar-teams', **args['teams']), 
+                dcc.Dropdown(id='status-bar-scale', **args['scale']),
+                dcc.RangeSlider(id='status-bar-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='pthemes-bar'),
+                dcc.Dropdown(id='pthemes-bar-barmode', **barmode_dropdown_args),
+                dcc.Dropdown(id='pthemes-bar-themes', **themes_dropdown_args),
+                dcc.Dropdown(id='pthemes-bar-teams', **args['teams']), 
+                dcc.Dropdown(id='pthemes-bar-scale', **args['scale']),
+                dcc.Dropdown(id='pthemes-bar-status', **args['status']),
+                dcc.RangeSlider(id='pthemes-bar-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                html.Div(className="graph-title", children=[html.H3('Intra-project theme relationships'),]),
+                cyto.Cytoscape(id='theme-graph', **graph_layout_default_args),
+                dcc.Dropdown(id='theme-graph-layout', **graph_layout_dropdown_args),
+                dcc.Dropdown(id='theme-graph-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='theme-graph-scale', **args['scale']),
+                dcc.Dropdown(id='theme-graph-status', **args['status']),
+                dcc.RangeSlider(id='theme-graph-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='grp-bar'),
+                dcc.Dropdown(id='grp-bar-barmode', **barmode_dropdown_args),
+                dcc.Dropdown(id='grp-bar-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='grp-bar-teams', **args['teams']), 
+                dcc.Dropdown(id='grp-bar-scale', **args['scale']),
+                dcc.Dropdown(id='grp-bar-status', **args['status']),
+                dcc.RangeSlider(id='grp-bar-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='teams-bar'),
+                dcc.Dropdown(id='teams-bar-barmode', **barmode_dropdown_args),
+                dcc.Dropdown(id='teams-bar-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='teams-bar-scale', **args['scale']),
+                dcc.Dropdown(id='teams-bar-status', **args['status']),
+                dcc.RangeSlider(id='teams-bar-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='external-bar'),
+                dcc.Dropdown(id='external-bar-barmode', **barmode_dropdown_args),
+                dcc.Dropdown(id='external-bar-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='external-bar-scale', **args['scale']),
+                dcc.Dropdown(id='external-bar-status', **args['status']),
+                dcc.RangeSlider(id='external-bar-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                html.Div(className="graph-title", children=[html.H3('Intra-project Team relationships'),]),
+                cyto.Cytoscape(id='teams-graph', **graph_layout_default_args),
+                dcc.Dropdown(id='teams-graph-layout', **graph_layout_dropdown_args),
+                dcc.Dropdown(id='teams-graph-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='teams-graph-scale', **args['scale']),
+                dcc.Dropdown(id='teams-graph-status', **args['status']),
+                dcc.RangeSlider(id='teams-graph-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='proj-gantt'),
+                dcc.Dropdown(id='proj-gantt-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='proj-gantt-teams', **args['teams']),
+                dcc.Dropdown(id='proj-gantt-scale', **args['scale']),
+                dcc.Dropdown(id='proj-gantt-status', **args['status']),
+                dcc.Dropdown(id='proj-gantt-detail', **gantt_detail_dropdown_args),
+                dcc.RangeSlider(id='proj-gantt-window', **semester_slider_args(snapshot)),
+                html.Label(['Page ', dcc.Input(id='proj-gantt-page', type='number', min=1, step=1, value=1)]),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                dcc.Graph(id='active-timeline'),
+                dcc.Dropdown(id='active-timeline-ptheme', **args['ptheme']),
+                dcc.Dropdown(id='active-timeline-teams', **args['teams']),
+                dcc.Dropdown(id='active-timeline-scale', **args['scale']),
+                dcc.Dropdown(id='active-timeline-status', **args['status']),
+                dcc.RangeSlider(id='active-timeline-window', **semester_slider_args(snapshot)),
+            ]
+        ),
+        html.Div(className="graph-box",
+            children=[
+                html.Div(className="graph-title", children=[html.H3('Projects'),]),
+                dash_table.DataTable(id='project-table', **table_args),
+            ]
+        ),
+    ])
+
+def serve_layout():
+    return current_snapshot().derive('layout', build_layout)
+
+app.layout = serve_layout
 
 # Callbacks and related helper methods
+# Registers a dash callback that runs against a single snapshot throughout,
+# and stops early once its request is superseded (see latest_requests)
+def callback(output, inputs=[], state=[]):
+    def decorator(func):
+        @functools.wraps(func)
+        def pinned_func(*args):
+            outer = (getattr(pinned, 'dataset', None), getattr(pinned, 'snapshot', None))
+            if outer[1] is None:
+                pinned.dataset = current_dataset()
+                pinned.snapshot = pinned.dataset.source.snapshot
+            try:
+                with latest_requests.track(request_ticket()):
+                    checkpoint()
+                    return func(*args)
+            except Superseded:
+                raise PreventUpdate
+            finally:
+                pinned.dataset, pinned.snapshot = outer
+        return app.callback(output, inputs, state)(metrics.compute(pinned_func))
+    return decorator
+
+# Callbacks producing a figure or graph elements. Without the filter bar each
+# is registered on its own; with it they are collected and answered together
+# by update_figures below.
+figure_callbacks = []
+
+def figure_callback(output, inputs):
+    def decorator(func):
+        if filter_bar:
+            figure_callbacks.append((output, inputs, func))
+            return func
+        return callback(output, inputs)(func)
+    return decorator
+
 def input_scale(base_id):
     return Input('{0}-scale'.format(base_id), 'value')
 
@@ -506,6 +981,9 @@ def input_ptheme(base_id):
 def input_theme_type(base_id):
     return Input('{0}-themes'.format(base_id), 'value')
 
+def input_window(base_id):
+    return Input('{0}-window'.format(base_id), 'value')
+
 def bar_input_params(base_id, input_list):
     inputs = [] #[input_scale(base_id), input_status(base_id), input_barmode(base_id)]
     if 'scale' in input_list:
@@ -525,77 +1003,123 @@ def bar_input_params(base_id, input_list):
 
     if 'theme_type' in input_list:
         inputs.append(input_theme_type(base_id)) 
+
+    if 'window' in input_list:
+        inputs.append(input_window(base_id))
     return inputs
 
 def gantt_input_params(base_id):
-    return [input_scale(base_id), input_status(base_id), input_teams(base_id), input_ptheme(base_id)]
+    return [input_scale(base_id), input_status(base_id), input_teams(base_id), input_ptheme(base_id),
+        input_window(base_id), Input('{0}-detail'.format(base_id), 'value'),
+        Input('{0}-page'.format(base_id), 'value')]
+
+def timeline_input_params(base_id):
+    return [input_scale(base_id), input_status(base_id), input_teams(base_id), input_ptheme(base_id),
+        input_window(base_id)]
 
 def graph_input_params_data(base_id):
-    return [input_scale(base_id), input_status(base_id), input_ptheme(base_id)]
-    
-def graph_input_params_layout(base_id):
-    return [Input('{0}-layout'.format(base_id), 'value')]
+    return [input_scale(base_id), input_status(base_id), input_ptheme(base_id),
+        Input('{0}-layout'.format(base_id), 'value'), input_window(base_id)]
 
-@app.callback(Output('status-bar', 'figure'), bar_input_params('status-bar', ['scale', 'mode', 'team', 'ptheme']))
-def update_status_bar(scale, mode, teams, ptheme):
-    return bar_return_dict(scale, [], mode, col_name('status'), 'Project Statuses', teams, ptheme, False, {'b':25})
+@figure_callback(Output('status-bar', 'figure'), bar_input_params('status-bar', ['scale', 'mode', 'team', 'ptheme', 'window']))
+def update_status_bar(scale, mode, teams, ptheme, window):
+    return bar_return_dict(scale, [], mode, col_name('status'), 'Project Statuses', teams, ptheme, False, {'b':25}, window)
 
-@app.callback(Output('pthemes-bar', 'figure'), bar_input_params('pthemes-bar', ['scale', 'status', 'mode', 'team', 'theme_type']))
-def update_pthemes_bar(scale, status, mode, teams, themes):
+@figure_callback(Output('pthemes-bar', 'figure'), bar_input_params('pthemes-bar', ['scale', 'status', 'mode', 'team', 'theme_type', 'window']))
+def update_pthemes_bar(scale, status, mode, teams, themes, window):
     if themes == 'p_theme':
-        return bar_return_dict(scale, status, mode, col_name(themes), 'Projects by Primary Themes', teams)
+        return bar_return_dict(scale, status, mode, col_name(themes), 'Projects by Primary Themes', teams, window=window)
     elif themes == 's_themes':
-        return bar_return_dict(scale, status, mode, col_name(themes), 'Projects by Secondary Themes', teams, '', True, {'b':25})
+        return bar_return_dict(scale, status, mode, col_name(themes), 'Projects by Secondary Themes', teams, '', True, {'b':25}, window)
     else: 
-        return bar_return_dict(scale, status, mode, col_name(themes), 'Projects by Primary and Secondary Themes', teams, '', True, {'b':25})
+        return bar_return_dict(scale, status, mode, col_name(themes), 'Projects by Primary and Secondary Themes', teams, '', True, {'b':25}, window)
 
 # start theme-graph 
-@app.callback(Output('theme-graph', 'elements'), graph_input_params_data('theme-graph'))
-def update_theme_graph_data(scale, status, ptheme):
-    return graph_elements(col_name('all_themes'), scale, status, ptheme)
-
-@app.callback(Output('theme-graph', 'layout'), graph_input_params_layout('theme-graph'))
-def update_theme_graph_layout(layout):
-    return {'name': layout, 'animate': True}
+@figure_callback(Output('theme-graph', 'elements'), graph_input_params_data('theme-graph'))
+def update_theme_graph_data(scale, status, ptheme, layout, window):
+    return graph_elements(col_name('all_themes'), scale, status, ptheme, layout, window)
 
-@app.callback(Output('theme-graph', 'stylesheet'), [Input('theme-graph', 'tapNode')])
+@callback(Output('theme-graph', 'stylesheet'), [Input('theme-graph', 'tapNode')])
 def update_theme_graph_stylesheet(node):
     if not node:
         return default_graph_stylesheet  
     return graph_stylesheet(node)
 # end theme-graph 
 
-@app.callback(Output('grp-bar', 'figure'), bar_input_params('grp-bar', ['scale', 'status', 'mode', 'team', 'ptheme']))
-def update_grp_bar(scale, status, mode, teams, ptheme):
-    return bar_return_dict(scale, status, mode, col_name('grouping'), 'Project Groupings', teams, ptheme, False, {'b':140})
+@figure_callback(Output('grp-bar', 'figure'), bar_input_params('grp-bar', ['scale', 'status', 'mode', 'team', 'ptheme', 'window']))
+def update_grp_bar(scale, status, mode, teams, ptheme, window):
+    return bar_return_dict(scale, status, mode, col_name('grouping'), 'Project Groupings', teams, ptheme, False, {'b':140}, window)
 
-@app.callback(Output('teams-bar', 'figure'), bar_input_params('teams-bar', ['scale', 'status', 'mode', 'ptheme']))
-def update_teams_bar(scale, status, mode, ptheme):
-    return bar_return_dict(scale, status, mode, col_name('teams'), 'Projects by Library Teams', [], ptheme, True, {'b':120})
+@figure_callback(Output('teams-bar', 'figure'), bar_input_params('teams-bar', ['scale', 'status', 'mode', 'ptheme', 'window']))
+def update_teams_bar(scale, status, mode, ptheme, window):
+    return bar_return_dict(scale, status, mode, col_name('teams'), 'Projects by Library Teams', [], ptheme, True, {'b':120}, window)
 
-@app.callback(Output('external-bar', 'figure'), bar_input_params('external-bar', ['scale', 'status', 'mode', 'ptheme']))
-def update_external_bar(scale, status, mode, ptheme):
-    return bar_return_dict(scale, status, mode, col_name('external'), 'Projects by external entities involved', [], ptheme, True, {'b':120})
+@figure_callback(Output('external-bar', 'figure'), bar_input_params('external-bar', ['scale', 'status', 'mode', 'ptheme', 'window']))
+def update_external_bar(scale, status, mode, ptheme, window):
+    return bar_return_dict(scale, status, mode, col_name('external'), 'Projects by external entities involved', [], ptheme, True, {'b':120}, window)
 
 # start teams-graph 
-@app.callback(Output('teams-graph', 'elements'), graph_input_params_data('teams-graph'))
-def update_teams_graph_data(scale, status, ptheme):
-    return graph_elements(col_name('teams'), scale, status, ptheme)
-
-@app.callback(Output('teams-graph', 'layout'), graph_input_params_layout('teams-graph'))
-def update_teams_graph_layout(layout):
-    return {'name': layout, 'animate': True}
+@figure_callback(Output('teams-graph', 'elements'), graph_input_params_data('teams-graph'))
+def update_teams_graph_data(scale, status, ptheme, layout, window):
+    return graph_elements(col_name('teams'), scale, status, ptheme, layout, window)
 
-@app.callback(Output('teams-graph', 'stylesheet'), [Input('teams-graph', 'tapNode')])
+@callback(Output('teams-graph', 'stylesheet'), [Input('teams-graph', 'tapNode')])
 def update_teams_graph_stylesheet(node):
     if not node:
         return default_graph_stylesheet  
     return graph_stylesheet(node)
 # end teams-graph    
 
-@app.callback(Output('proj-gantt', 'figure'), gantt_input_params('proj-gantt'))
-def update_proj_gantt(scale, status, teams, ptheme):
-    return gantt_data(scale, status, "Project Gantt Chart", teams, ptheme)
+@figure_callback(Output('proj-gantt', 'figure'), gantt_input_params('proj-gantt'))
+def update_proj_gantt(scale, status, teams, ptheme, window, detail, page):
+    return gantt_data(scale, status, "Project Gantt Chart", teams, ptheme, window, detail, page)
+
+@figure_callback(Output('active-timeline', 'figure'), timeline_input_params('active-timeline'))
+def update_active_timeline(scale, status, teams, ptheme, window):
+    return active_timeline(scale, status, 'Projects active per semester', teams, ptheme, window)
+
+# The rows of a filter and sort state are kept by the snapshot's
+# ProjectTable, so turning pages only slices them. Clients cannot ask for
+# pages larger than 10 times the configured size.
+@callback(Output('project-table', 'data'), [Input('project-table', 'pagination_settings'),
+    Input('project-table', 'sorting_settings'), Input('project-table', 'filtering_settings')])
+def update_project_table(pagination, sorting, filtering):
+    pagination = pagination or {}
+    page_size = min(max(int(pagination.get('page_size') or table_page_size), 1), 10 * table_page_size)
+    with metrics.phase('data'):
+        return project_table(current_snapshot()).page(pagination.get('current_page', 0), page_size,
+            filtering, sorting)
+
+# Chart values left empty, and chart windows covering every semester, take
+# the dashboard filter's value
+def inherit_filters(inputs, values, filters):
+    index = semester_index(current_snapshot())
+    for i, value in zip(inputs, values):
+        dim = i.component_id.rsplit('-', 1)[-1]
+        if dim in filters and (value in (None, '', []) or (dim == 'window' and index.window(value) is None)):
+            value = filters[dim]
+        yield value
+
+# One request computes every figure for the page, against one snapshot. Charts
+# sharing a filter state share its row mask (see filters.RowMasks), and
+# figures already computed for their inputs come from the figure cache.
+if filter_bar:
+    filter_inputs = [Input('filter-{0}'.format(dim), 'value') for dim in FILTER_DIMENSIONS]
+    chart_inputs = [i for _, inputs, _ in figure_callbacks for i in inputs]
+
+    @callback([output for output, _, _ in figure_callbacks], filter_inputs + chart_inputs)
+    def update_figures(*values):
+        filters = dict(zip(FILTER_DIMENSIONS, values))
+        values = values[len(filter_inputs):]
+        figures = []
+        for output, inputs, func in figure_callbacks:
+            checkpoint()
+            figures.append(func(*inherit_filters(inputs, values[:len(inputs)], filters)))
+            values = values[len(inputs):]
+        return figures
+
+# Keep this after every callback registration
+metrics.instrument(app)
 
 
 # Initiate app
@@ -0,0 +1,19 @@
+// Tags every dash callback request with this tab's id and a sequence
+// number, so the server can stop working on requests a later one for the
+// same output has superseded (see coalesce.LatestRequests)
+(function () {
+    var tab = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    var sequence = 0;
+    var fetch = window.fetch;
+
+    window.fetch = function (url, options) {
+        if (typeof url === 'string' && url.indexOf('_dash-update-component') !== -1) {
+            options = Object.assign({}, options);
+            options.headers = Object.assign({}, options.headers, {
+                'X-Dash-Tab': tab,
+                'X-Dash-Sequence': String(++sequence)
+            });
+        }
+        return fetch.apply(this, [url, options]);
+    };
+})();
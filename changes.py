@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+from columns import col_name
+
+# Above this share of added, edited and deleted projects a refresh rebuilds
+# the snapshot from scratch
+MAX_CHANGED_FRACTION = 0.25
+
+
+# Row hashes of a cleaned sheet, before any compaction. Rows with equal
+# hashes are taken to be identical.
+def row_hashes(df):
+    array = pd.util.hash_pandas_object(df, index=False).values
+    array.flags.writeable = False
+    return array
+
+
+# What changed between a snapshot and the sheet loaded after it, with
+# projects matched by Project-id. source_rows maps every new row to the old
+# row it is an unchanged copy of, or -1 for added and edited projects
+# (changed); removed marks the old rows without an unchanged copy (deleted
+# and edited projects).
+#
+# previous is only held while the new snapshot is built and warmed, so that
+# derived values can be updated from the previous snapshot's; DataSource
+# releases it once the new snapshot is published.
+class SheetChanges(object):
+    def __init__(self, previous, source_rows):
+        self.previous = previous
+        self.previous_digest = previous.digest
+        self.source_rows = source_rows
+        self.changed = source_rows < 0
+        self.carried = ~self.changed
+        self.removed = np.ones(len(previous.df), dtype=bool)
+        self.removed[source_rows[self.carried]] = False
+        # old -> new cell maps of the updated token indexes, by column
+        self.cell_maps = {}
+        for array in [self.source_rows, self.changed, self.carried, self.removed]:
+            array.flags.writeable = False
+
+    def __len__(self):
+        return int(self.changed.sum() + self.removed.sum())
+
+    def release(self):
+        self.previous = None
+
+    # A value derived from the previous snapshot, if it was derived there
+    def previous_value(self, key):
+        previous = self.previous
+        if previous is None:
+            return None
+        return previous._derived.get(key)
+
+    # A per-row array for the new rows: carried rows copy old_values, the
+    # changed rows get compute(changed)
+    def carry(self, old_values, compute):
+        values = np.empty(len(self.source_rows), dtype=old_values.dtype)
+        values[self.carried] = old_values[self.source_rows[self.carried]]
+        if self.changed.any():
+            values[self.changed] = compute(self.changed)
+        return values
+
+
+# The changes from previous to a freshly loaded sheet with the given row
+# hashes, or None when it has to be built from scratch: no previous snapshot
+# (or one without row hashes), missing or repeated Project-ids, or too many
+# changes to be worth applying one by one
+def diff_rows(previous, df, hashes, max_fraction=MAX_CHANGED_FRACTION):
+    if previous is None or previous.row_hashes is None or len(previous.row_hashes) != len(previous.df):
+        return None
+    old_ids = pd.Index(previous.df[col_name('pid')])
+    new_ids = pd.Index(df[col_name('pid')])
+    for ids in [old_ids, new_ids]:
+        if ids.hasnans or not ids.is_unique:
+            return None
+    source_rows = old_ids.get_indexer(new_ids).astype(np.int64)
+    found = source_rows >= 0
+    same = np.zeros(len(source_rows), dtype=bool)
+    same[found] = previous.row_hashes[source_rows[found]] == hashes[found]
+    source_rows[~same] = -1
+    changes = SheetChanges(previous, source_rows)
+    if len(changes) > max_fraction * max(len(df), 1):
+        return None
+    return changes
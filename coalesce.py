@@ -0,0 +1,106 @@
+import contextlib
+import threading
+from collections import OrderedDict
+
+
+# Raised at a checkpoint of a request a later one has made pointless
+class Superseded(Exception):
+    pass
+
+
+class Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+# Concurrent calls with the same key share one computation: the first caller
+# runs it and the others wait for its result or exception. A computation
+# given up because its own request was superseded is not shared; whoever was
+# waiting for it runs it again. While waiting, check is called every poll
+# seconds, so waiters can be superseded too.
+class SingleFlight(object):
+    def __init__(self, poll=0.05):
+        self.poll = poll
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, check=None):
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+            if leader:
+                try:
+                    flight.value = func()
+                    return flight.value
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+
+            while not flight.done.wait(self.poll):
+                if check is not None:
+                    check()
+            if not isinstance(flight.error, Superseded):
+                with self._lock:
+                    self.shared += 1
+                if flight.error is not None:
+                    raise flight.error
+                return flight.value
+
+
+# The latest callback request for every (tab, output), by the sequence
+# numbers the browser puts on them (see assets/request_sequence.js). Once a
+# later request for the same output arrives from the same tab, the earlier
+# one is superseded: dash-renderer ignores responses to all but the latest
+# request of an output, so any work left on it is wasted. The request a
+# thread is serving is tracked with track(); check() raises Superseded if it
+# has been superseded. Requests without a tab are never superseded.
+class LatestRequests(object):
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.superseded = 0
+        self._latest = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ticket is (tab, output, sequence), or None for an untracked request
+    @contextlib.contextmanager
+    def track(self, ticket):
+        outer = getattr(self._local, 'ticket', None)
+        if ticket is not None:
+            tab, output, sequence = ticket
+            with self._lock:
+                key = (tab, output)
+                if sequence > self._latest.get(key, -1):
+                    self._latest[key] = sequence
+                    self._latest.move_to_end(key)
+                    while len(self._latest) > self.max_entries:
+                        self._latest.popitem(last=False)
+        self._local.ticket = ticket
+        try:
+            yield
+        finally:
+            self._local.ticket = outer
+
+    def is_superseded(self):
+        ticket = getattr(self._local, 'ticket', None)
+        if ticket is None:
+            return False
+        tab, output, sequence = ticket
+        with self._lock:
+            return self._latest.get((tab, output), sequence) > sequence
+
+    def check(self):
+        if self.is_superseded():
+            with self._lock:
+                self.superseded += 1
+            raise Superseded()
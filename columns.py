@@ -0,0 +1,20 @@
+def col_name(short):
+    lookup = {
+        'pid': 'Project-id',
+        'project': 'Project',
+        'desc': 'Description',
+        'grouping': 'Grouping',
+        'scale': 'Resource Requirement (Low/Medium/High)',
+        'status': 'Status (Potential/Committed/In progress/Completed/Rejected/Duplicate)',
+        'p_theme': 'Primary Library Strategy Theme',
+        's_themes': 'Secondary Strategy Theme(s)',
+        'all_themes': 'all_themes',
+        'teams': 'Library Teams involved',
+        'external': 'External Parties involved',
+        'start': 'Start Semester',
+        'end': 'End Semester'
+    }
+    if short in lookup:
+        return lookup[short]
+    else:
+        return short
@@ -0,0 +1,38 @@
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Responses are gzipped by Flask-Compress, which dash registers on the server.
+# If the brotli package is installed, clients accepting br get brotli instead;
+# this hook runs before Flask-Compress (after_request hooks run in reverse)
+# and Flask-Compress leaves responses that already have a Content-Encoding.
+def configure_compression(server, gzip_level=6, brotli_quality=4, min_size=500):
+    server.config['COMPRESS_LEVEL'] = gzip_level
+    server.config['COMPRESS_MIN_SIZE'] = min_size
+    if brotli is None:
+        return
+
+    @server.after_request
+    def brotli_response(response):
+        if ('br' not in request.headers.get('Accept-Encoding', '').lower() or
+                response.mimetype not in server.config['COMPRESS_MIMETYPES'] or
+                not 200 <= response.status_code < 300 or
+                response.is_streamed or
+                'Content-Encoding' in response.headers):
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(brotli.compress(data, quality=brotli_quality))
+        response.headers['Content-Encoding'] = 'br'
+        response.headers['Content-Length'] = response.content_length
+        vary = response.headers.get('Vary')
+        if not vary:
+            response.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            response.headers['Vary'] = '{0}, Accept-Encoding'.format(vary)
+        return response
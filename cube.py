@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+from columns import col_name
+from semesters import semester_index
+
+
+# Integer codes (-1 for missing) and labels of a column; categorical columns
+# of a compact snapshot already carry them
+def codes_and_labels(series):
+    if isinstance(series.dtype, pd.api.types.CategoricalDtype):
+        return series.cat.codes.values.astype(np.int64), list(series.cat.categories)
+    return pd.factorize(series)
+
+
+# codes_and_labels of a snapshot column, computed once per snapshot
+def column_codes(snapshot, column):
+    def build(snapshot):
+        codes, labels = codes_and_labels(snapshot.df[column])
+        codes.flags.writeable = False
+        return codes, list(labels)
+    return snapshot.derive(('codes', column), build)
+
+
+CUBE_DIMENSIONS = ['status', 'scale', 'p_theme', 'teams', 'interval', 'value']
+
+
+# Distinct cells with their summed weights, leaving out cells summing to 0
+def aggregate(cells, weights):
+    cells, inverse = np.unique(cells, return_inverse=True)
+    counts = np.bincount(inverse, weights=weights, minlength=len(cells)).astype(np.int64)
+    present = counts != 0
+    return cells[present], counts[present]
+
+
+# Sum of two sets of distinct sorted cells, the second usually much smaller:
+# cells already present are found by binary search, the others inserted.
+# The first set can be out of order after its codes were mapped.
+def merge(cells, counts, more_cells, more_counts):
+    if (np.diff(cells) <= 0).any():
+        return aggregate(np.concatenate([cells, more_cells]), np.concatenate([counts, more_counts]))
+    positions = np.searchsorted(cells, more_cells)
+    found = positions < len(cells)
+    found[found] = cells[positions[found]] == more_cells[found]
+    counts = counts.copy()
+    counts[positions[found]] += more_counts[found]
+    return (np.insert(cells, positions[~found], more_cells[~found]),
+            np.insert(counts, positions[~found], more_counts[~found]))
+
+
+# Codes of old labels among new ones, -1 for labels that are gone
+def label_map(old_labels, new_labels):
+    lookup = {label: code for code, label in enumerate(new_labels)}
+    return np.array([lookup.get(label, -1) for label in old_labels], dtype=np.int64)
+
+
+# Cube interval codes (0 for none, then 1 + interval) of an old semester
+# index in a new one; intervals are matched by their semester labels
+def interval_map(old, new):
+    positions = label_map(old.table['label'].tolist(), new.table['label'].tolist())
+    lookup = {pair: code + 1 for code, pair in enumerate(zip(new.interval_starts.tolist(),
+                                                            new.interval_ends.tolist()))}
+    pairs = zip(positions[old.interval_starts].tolist(), positions[old.interval_ends].tolist())
+    return np.array([0] + [lookup.get(pair, -1) for pair in pairs], dtype=np.int64)
+
+
+# Pre-aggregated project counts for one bar chart column, built once per
+# snapshot. Every non-empty (status, scale, primary theme, team set,
+# semester interval, value) cell is stored once with its count, so a query
+# only touches the aggregated cells and never the rows.
+#
+# Team filters match projects with any of the chosen teams, which is not a
+# sum over single teams. The cube therefore keys on the project's whole team
+# cell (see TokenIndex.row_cells) and a filter selects every team cell that
+# contains one of the teams. Semester windows likewise select every interval
+# of the snapshot's SemesterIndex that overlaps them.
+class AggregateCube(object):
+    def __init__(self, dims, labels, counts, team_index, semesters):
+        self.dims = dims
+        self.labels = labels
+        self.counts = counts
+        self.team_index = team_index
+        self.semesters = semesters
+        for array in list(dims.values()) + [counts]:
+            array.flags.writeable = False
+        self.nbytes = sum(a.nbytes for a in list(dims.values()) + [counts])
+        self.lookup = {}
+        for dim, values in labels.items():
+            self.lookup[dim] = {value: code for code, value in enumerate(values)}
+
+    # Cube coordinates of the rows in row_mask (every row by default): one
+    # code array per dimension (a row appears once per value of a split
+    # column), their labels and the cube's shape
+    @staticmethod
+    def coordinates(snapshot, column, split=False, row_mask=None):
+        team_index = snapshot.tokens[col_name('teams')]
+        semesters = semester_index(snapshot)
+        if split:
+            index = snapshot.tokens[column]
+            rows, values, value_labels = index.rows, index.codes, index.vocab
+        else:
+            value_codes, value_labels = column_codes(snapshot, column)
+            rows = np.flatnonzero(value_codes >= 0)
+            values = value_codes[rows]
+        if row_mask is not None:
+            keep = row_mask[rows]
+            rows, values = rows[keep], values[keep]
+
+        labels = {'value': list(value_labels)}
+        codes = []
+        for dim in ['status', 'scale', 'p_theme']:
+            # missing values get code 0, real values start at 1
+            dim_codes, dim_labels = column_codes(snapshot, col_name(dim))
+            labels[dim] = [None] + list(dim_labels)
+            codes.append(dim_codes[rows] + 1)
+        codes.append(team_index.row_cells[rows])
+        # rows without an interval get code 0
+        codes.append(semesters.row_intervals[rows] + 1)
+        codes.append(values)
+
+        shape = (len(labels['status']), len(labels['scale']), len(labels['p_theme']),
+                 len(team_index.cell_rows), len(semesters.interval_starts) + 1, len(labels['value']))
+        return codes, labels, shape
+
+    @classmethod
+    def build(cls, snapshot, column, split=False, previous=None):
+        if previous is not None and snapshot.changes is not None:
+            cube = cls.update(previous, snapshot, column, split)
+            if cube is not None:
+                return cube
+        codes, labels, shape = cls.coordinates(snapshot, column, split)
+        cells, counts = aggregate(np.ravel_multi_index(codes, shape), np.ones(len(codes[-1]), dtype=np.int64))
+        return cls.from_cells(snapshot, labels, shape, cells, counts)
+
+    @classmethod
+    def from_cells(cls, snapshot, labels, shape, cells, counts):
+        cell_codes = [c.astype(np.int32) for c in np.unravel_index(cells, shape)]
+        dims = dict(zip(CUBE_DIMENSIONS, cell_codes))
+        return cls(dims, labels, counts.astype(np.int32), snapshot.tokens[col_name('teams')],
+                   semester_index(snapshot))
+
+    # The cube of a snapshot built from the previous one (see SheetChanges),
+    # from that snapshot's cube: the rows removed since are taken out in the
+    # old coordinates, what is left is mapped to the new ones and the changed
+    # rows are added. Only the changed rows are aggregated; the cells of the
+    # previous cube are sorted and merged into. Returns None if the cubes do
+    # not line up.
+    @classmethod
+    def update(cls, previous, snapshot, column, split=False):
+        changes = snapshot.changes
+        old = changes.previous
+        if old is None:
+            return None
+        old_codes, old_labels, old_shape = cls.coordinates(old, column, split, changes.removed)
+        cells = np.ravel_multi_index([previous.dims[d] for d in CUBE_DIMENSIONS], old_shape)
+        counts = previous.counts.astype(np.int64)
+        removed, removed_counts = aggregate(np.ravel_multi_index(old_codes, old_shape),
+                                            np.ones(len(old_codes[-1]), dtype=np.int64))
+        positions = np.searchsorted(cells, removed)
+        if (positions >= len(cells)).any() or (cells[positions] != removed).any():
+            return None
+        counts[positions] -= removed_counts
+        if (counts < 0).any():
+            return None
+        cells, counts = cells[counts > 0], counts[counts > 0]
+
+        codes, labels, shape = cls.coordinates(snapshot, column, split, changes.changed)
+        maps = [label_map(old_labels[dim], labels[dim]) for dim in ['status', 'scale', 'p_theme']]
+        maps.append(changes.cell_maps[col_name('teams')])
+        maps.append(interval_map(semester_index(old), semester_index(snapshot)))
+        maps.append(label_map(old_labels['value'], labels['value']))
+        mapped = [m[c] for m, c in zip(maps, np.unravel_index(cells, old_shape))]
+        if any((c < 0).any() for c in mapped):
+            return None
+
+        added, added_counts = aggregate(np.ravel_multi_index(codes, shape), np.ones(len(codes[-1]), dtype=np.int64))
+        cells, counts = merge(np.ravel_multi_index(mapped, shape), counts, added, added_counts)
+        return cls.from_cells(snapshot, labels, shape, cells, counts)
+
+    def _codes(self, dim, values):
+        return [self.lookup[dim][v] for v in values if v in self.lookup[dim]]
+
+    # Boolean mask over the stored cells for the status/team/theme filters and
+    # a (first, last) semester window
+    def cell_mask(self, statuses=[], teams=[], ptheme='', window=None):
+        mask = np.ones(len(self.counts), dtype=bool)
+        if len(statuses) > 0:
+            mask &= np.in1d(self.dims['status'], self._codes('status', statuses))
+
+        if len(teams) > 0:
+            mask &= self.team_index.cells_with_any(teams)[self.dims['teams']]
+
+        if ptheme:
+            mask &= np.in1d(self.dims['p_theme'], self._codes('p_theme', [ptheme]))
+
+        if window is not None:
+            active = np.concatenate([[False], self.semesters.active_intervals(*window)])
+            mask &= active[self.dims['interval']]
+        return mask
+
+    # Same shape as Series.value_counts: value -> count for one scale, largest first, ties by label
+    def value_counts(self, scale, cell_mask):
+        mask = cell_mask & np.in1d(self.dims['scale'], self._codes('scale', [scale]))
+        totals = np.bincount(self.dims['value'][mask], weights=self.counts[mask],
+                             minlength=len(self.labels['value'])).astype(np.int64)
+        labels = self.labels['value']
+        present = sorted(np.flatnonzero(totals), key=lambda c: (-totals[c], str(labels[c])))
+        return pd.Series(totals[present], index=[labels[c] for c in present])
@@ -0,0 +1,165 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Dataset names appear in URLs and directory names
+DATASET_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+# name=url pairs separated by semicolons, e.g.
+#   projects=lmt_projects.csv;library-2018=https://example.org/2018.csv
+# Returns an OrderedDict in the order given; the first is the default.
+def parse_datasets(text):
+    urls = OrderedDict()
+    for entry in text.split(';'):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, url = entry.partition('=')
+        name, url = name.strip(), url.strip()
+        if not sep or not url or not DATASET_NAME.match(name):
+            raise ValueError('Invalid dataset {0!r}, expected name=url'.format(entry))
+        if name in urls:
+            raise ValueError('Dataset {0!r} is configured twice'.format(name))
+        urls[name] = url
+    if not urls:
+        raise ValueError('No datasets configured')
+    return urls
+
+
+# One sheet served by the dashboard: its DataSource and the figure cache of
+# its snapshots. The sheet is loaded by the first load() and then refreshed
+# in the background until the dataset is closed.
+class Dataset(object):
+    def __init__(self, name, source, figure_cache):
+        self.name = name
+        self.source = source
+        self.figure_cache = figure_cache
+        self._size = (None, 0)
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            snapshot = self.source.snapshot
+            self.source.start()
+            return snapshot
+
+    @property
+    def loaded(self):
+        return self.source.loaded
+
+    # Approximate memory held by the current snapshot, its indexes and
+    # derived values, measured once per snapshot version
+    def nbytes(self):
+        if not self.source.loaded:
+            return 0
+        snapshot = self.source.snapshot
+        version, size = self._size
+        if version != snapshot.version:
+            size = snapshot.nbytes()
+            self._size = (snapshot.version, size)
+        return size
+
+    def close(self):
+        self.source.stop()
+        self.figure_cache.clear()
+
+
+# Named datasets hosted by one process. A dataset is opened (see
+# open_dataset) and loaded on first access; loaded datasets are kept in
+# least recently used order, and when loading one takes the total past
+# budget bytes, the coldest others are closed and dropped with their
+# snapshots, indexes and figure caches. Requests still holding a dropped
+# snapshot finish with it; the next access loads the dataset again.
+#
+# Warmers and transitions apply to every dataset; transitions are called
+# with the dataset, the published snapshot and the one replacing it.
+class DatasetRegistry(object):
+    def __init__(self, urls, open_dataset, budget=None):
+        self.urls = OrderedDict(urls)
+        self.default = next(iter(self.urls))
+        self.budget = budget
+        self.evictions = 0
+        self._open_dataset = open_dataset
+        self._datasets = OrderedDict()
+        self._warmers = []
+        self._transitions = []
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.urls
+
+    def add_warmer(self, warmer):
+        with self._lock:
+            self._warmers.append(warmer)
+            datasets = list(self._datasets.values())
+        for dataset in datasets:
+            dataset.source.add_warmer(warmer)
+
+    def add_transition(self, transition):
+        with self._lock:
+            self._transitions.append(transition)
+            datasets = list(self._datasets.values())
+        for dataset in datasets:
+            self._add_transition(dataset, transition)
+
+    def _add_transition(self, dataset, transition):
+        dataset.source.add_transition(lambda previous, new: transition(dataset, previous, new))
+
+    def _open(self, name):
+        dataset = self._open_dataset(name, self.urls[name])
+        for warmer in self._warmers:
+            dataset.source.add_warmer(warmer)
+        for transition in self._transitions:
+            self._add_transition(dataset, transition)
+        return dataset
+
+    # The named (or default) dataset, loaded. Raises KeyError for names that
+    # are not configured.
+    def get(self, name=None):
+        name = name or self.default
+        with self._lock:
+            dataset = self._datasets.get(name)
+            if dataset is None:
+                if name not in self.urls:
+                    raise KeyError(name)
+                dataset = self._datasets[name] = self._open(name)
+            self._datasets.move_to_end(name)
+        if not dataset.loaded:
+            dataset.load()
+            self._enforce_budget(dataset)
+        return dataset
+
+    # The datasets currently open, coldest first
+    def loaded(self):
+        with self._lock:
+            return [d for d in self._datasets.values() if d.loaded]
+
+    def nbytes(self):
+        return sum(dataset.nbytes() for dataset in self.loaded())
+
+    def _enforce_budget(self, keep):
+        if not self.budget:
+            return
+        sizes = [(dataset, dataset.nbytes()) for dataset in self.loaded()]
+        total = sum(size for _, size in sizes)
+        evicted = []
+        with self._lock:
+            for dataset, size in sizes:
+                if total <= self.budget:
+                    break
+                if dataset is keep or self._datasets.get(dataset.name) is not dataset:
+                    continue
+                del self._datasets[dataset.name]
+                evicted.append(dataset)
+                total -= size
+            self.evictions += len(evicted)
+        for dataset in evicted:
+            dataset.close()
+            logger.info('Evicted dataset %s to stay within the memory budget', dataset.name)
+        if total > self.budget:
+            logger.warning('Datasets hold %.0f MB, over the budget of %.0f MB', total / 2.0 ** 20,
+                           self.budget / 2.0 ** 20)
@@ -0,0 +1,516 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+from changes import diff_rows, row_hashes
+from columns import col_name
+from semesters import semester_dates
+from tokens import TokenIndex
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated columns that get a token index per snapshot
+MULTI_VALUE_COLUMNS = ['teams', 'external', 's_themes', 'all_themes']
+
+# Columns stored as categoricals in compact snapshots
+CATEGORICAL_COLUMNS = ['status', 'scale', 'p_theme', 'grouping', 'start', 'end']
+
+# Project ids named in a warning about invalid rows; the rest are counted
+LOGGED_IDS = 10
+
+
+# Cleanup applied to every freshly loaded sheet before it is published.
+# Compact snapshots never build the joined all_themes strings.
+def clean_frame(df, compact=False):
+    df[col_name('s_themes')] = df[col_name('s_themes')].fillna('')
+    if not compact:
+        df["all_themes"] = df[col_name('p_theme')].map(str) + ', ' + df[col_name('s_themes')]
+    df[col_name('scale')] = df[col_name('scale')].str.strip()
+    df[col_name('status')] = df[col_name('status')].str.strip()
+    df[col_name('status')] = df[col_name('status')].str.capitalize()
+    df[col_name('teams')] = df[col_name('teams')].fillna('')
+    df[col_name('external')] = df[col_name('external')].fillna('')
+    df[col_name('start')] = df[col_name('start')].fillna('')
+    df[col_name('end')] = df[col_name('end')].fillna('')
+    return df
+
+
+# Indexer (loc, iloc, at, iat) of a FrozenFrame or FrozenSeries: reads go
+# through, writes fail
+class ReadOnlyIndexer(object):
+    def __init__(self, indexer):
+        self._indexer = indexer
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __setitem__(self, key, value):
+        read_only()
+
+    # df.loc(axis=...) returns another indexer
+    def __call__(self, *args, **kwargs):
+        return ReadOnlyIndexer(self._indexer(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._indexer, name)
+
+
+def read_only(*args, **kwargs):
+    raise TypeError('Snapshot frames are read-only, use .copy() to get a writable frame')
+
+
+# A column of a FrozenFrame. Item assignment, through the Series or its
+# indexers, raises TypeError and .values is a read-only view. Anything
+# computed from it is an ordinary Series.
+class FrozenSeries(pd.Series):
+    @property
+    def _constructor(self):
+        return pd.Series
+
+    @property
+    def _constructor_expanddim(self):
+        return pd.DataFrame
+
+    __setitem__ = _update_inplace = read_only
+
+    @property
+    def loc(self):
+        return ReadOnlyIndexer(pd.Series.loc.fget(self))
+
+    @property
+    def iloc(self):
+        return ReadOnlyIndexer(pd.Series.iloc.fget(self))
+
+    @property
+    def at(self):
+        return ReadOnlyIndexer(pd.Series.at.fget(self))
+
+    @property
+    def iat(self):
+        return ReadOnlyIndexer(pd.Series.iat.fget(self))
+
+    @property
+    def values(self):
+        return read_only_view(pd.Series.values.fget(self))
+
+
+# DataFrame that refuses to be changed in place: assignments through the
+# frame, its indexers or its columns raise TypeError, and .values is a
+# read-only view. The arrays behind numeric, boolean and categorical
+# columns are read-only too; those behind text columns are not, as pandas'
+# Cython routines refuse read-only object arrays. Filtering, selecting
+# columns or copy() return ordinary DataFrames, so callbacks work on their
+# own frames.
+class FrozenFrame(pd.DataFrame):
+    def __init__(self, *args, **kwargs):
+        pd.DataFrame.__init__(self, *args, **kwargs)
+        # consolidating later would replace the frozen arrays with new ones
+        self._consolidate_inplace()
+        manager = self._mgr if hasattr(self, '_mgr') else self._data
+        for block in manager.blocks:
+            freeze_values(block.values)
+
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    __setitem__ = __delitem__ = insert = _update_inplace = read_only
+
+    @property
+    def loc(self):
+        return ReadOnlyIndexer(pd.DataFrame.loc.fget(self))
+
+    @property
+    def iloc(self):
+        return ReadOnlyIndexer(pd.DataFrame.iloc.fget(self))
+
+    @property
+    def at(self):
+        return ReadOnlyIndexer(pd.DataFrame.at.fget(self))
+
+    @property
+    def iat(self):
+        return ReadOnlyIndexer(pd.DataFrame.iat.fget(self))
+
+    @property
+    def values(self):
+        return read_only_view(pd.DataFrame.values.fget(self))
+
+    # Columns are boxed (and cached) here; they share the frame's arrays
+    def _box_col_values(self, *args, **kwargs):
+        column = pd.DataFrame._box_col_values(self, *args, **kwargs)
+        column.__class__ = FrozenSeries
+        return column
+
+    # pandas keeps its own state in underscore attributes
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            read_only()
+
+
+def freeze_array(array):
+    array.flags.writeable = False
+    return array
+
+
+def read_only_view(array):
+    if isinstance(array, np.ndarray):
+        array = array.view()
+        array.flags.writeable = False
+    return array
+
+
+# Makes the array behind a column read-only: an ndarray, or the codes of a
+# categorical. Object arrays are left writable (see FrozenFrame).
+def freeze_values(values):
+    for array in [values, getattr(values, '_ndarray', None), getattr(values, '_codes', None)]:
+        if isinstance(array, np.ndarray) and array.dtype != object:
+            array.flags.writeable = False
+
+
+# Compact layout: low-cardinality columns become categoricals (one copy of
+# each label plus small integer codes) and the raw multi-value strings are
+# dropped, as their token indexes hold the same information
+def compact_frame(df):
+    df = df.drop(columns=[col_name(c) for c in MULTI_VALUE_COLUMNS if col_name(c) in df.columns])
+    for short in CATEGORICAL_COLUMNS:
+        df[col_name(short)] = df[col_name(short)].astype('category')
+    return df
+
+
+# Token indexes of a snapshot. Indexes registered with lazy are only built
+# on first access.
+class TokenIndexes(dict):
+    def __init__(self):
+        dict.__init__(self)
+        self._builders = {}
+        self._lock = threading.Lock()
+
+    def lazy(self, column, builder):
+        self._builders[column] = builder
+
+    def __missing__(self, column):
+        with self._lock:
+            if not dict.__contains__(self, column):
+                self[column] = self._builders[column]()
+            return dict.__getitem__(self, column)
+
+
+# One loaded version of the sheet. Everything derived from the data is
+# computed here (or lazily through derive) so it happens once per snapshot
+# rather than once per request or per worker import.
+#
+# Snapshots are immutable once built: the frame is a FrozenFrame, the NumPy
+# arrays behind the indexes are read-only and attributes cannot be rebound.
+# Callbacks running in parallel threads can therefore share one snapshot
+# without locks; see "Concurrency" in the README.
+#
+# A snapshot built from the one before it records what changed in changes
+# (see changes.SheetChanges); row_hashes are what the next refresh diffs
+# against.
+class Snapshot(object):
+    def __init__(self, df, tokens, start_dates, end_dates, version, validator=None, compact=False, digest=None,
+                 row_hashes=None, changes=None):
+        self.df = FrozenFrame(df)
+        self.tokens = tokens
+        self.compact = compact
+        self.version = version
+        self.validator = validator
+        self.row_hashes = row_hashes
+        self.changes = changes
+        # identifies the content, so caches shared between workers (whose
+        # version counters are independent) agree on what they hold
+        if digest is None and row_hashes is not None:
+            digest = hashlib.sha1(row_hashes.tobytes() + (b'compact' if compact else b'')).hexdigest()[:16]
+        elif digest is None:
+            digest = hashlib.sha1(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()[:16]
+        self.digest = digest
+        self.loaded_at = time.time()
+        self._derived = {}
+        # reentrant, so builders can derive the values they depend on
+        self._derive_lock = threading.RLock()
+
+        self.valid_status = df[col_name('status')].value_counts().axes[0].tolist()
+        self.valid_scales = df[col_name('scale')].value_counts().axes[0].tolist()
+        self.valid_pthemes = df[col_name('p_theme')].value_counts().axes[0].sort_values().tolist()
+
+        self.start_dates = start_dates
+        self.end_dates = end_dates
+        self.valid_dates = ~(pd.isnull(start_dates) | pd.isnull(end_dates))
+        invalid = np.flatnonzero(~self.valid_dates)
+        if len(invalid) > 0:
+            # the full list only at debug level, as a sheet can have thousands
+            ids = df[col_name('pid')].iloc[invalid].astype(str).tolist()
+            more = ' and {0} more'.format(len(ids) - LOGGED_IDS) if len(ids) > LOGGED_IDS else ''
+            logger.warning('%s projects have no valid start/end semester and are left out of the Gantt chart: %s%s',
+                           len(ids), ', '.join(ids[:LOGGED_IDS]), more)
+            logger.debug('Projects without a valid start/end semester: %s', ', '.join(ids))
+
+        for array in [self.start_dates, self.end_dates, self.valid_dates]:
+            freeze_array(array)
+        self._frozen = True
+
+    # Builds a snapshot from a freshly loaded and cleaned sheet: token indexes,
+    # semester dates and, for compact snapshots, the compact frame. Given the
+    # previous snapshot, projects are matched by Project-id and when only a
+    # few changed, the token indexes and semester dates are updated from the
+    # previous ones for the changed rows only.
+    @classmethod
+    def build(cls, df, version, validator=None, compact=False, previous=None):
+        hashes = row_hashes(df)
+        changes = diff_rows(previous, df, hashes) if previous is not None and previous.compact == compact else None
+
+        def token_index(short):
+            column = col_name(short)
+            if changes is None:
+                return TokenIndex.from_series(df[column])
+            index, changes.cell_maps[column] = previous.tokens[column].update(changes.source_rows, df[column])
+            return index
+
+        tokens = TokenIndexes()
+        if compact:
+            for short in ['teams', 'external', 's_themes']:
+                tokens[col_name(short)] = token_index(short)
+            primary = TokenIndex.from_series(df[col_name('p_theme')].astype(str))
+            secondary = tokens[col_name('s_themes')]
+            tokens.lazy(col_name('all_themes'), lambda: TokenIndex.concat(primary, secondary))
+            df = compact_frame(df)
+        else:
+            for short in MULTI_VALUE_COLUMNS:
+                tokens[col_name(short)] = token_index(short)
+
+        def dates(short, start_end):
+            series = df[col_name(short)]
+            if changes is None:
+                return semester_dates(series, start_end)
+            old = previous.start_dates if start_end == 'start' else previous.end_dates
+            return changes.carry(old, lambda rows: semester_dates(series[rows], start_end))
+
+        start_dates = dates('start', 'start')
+        end_dates = dates('end', 'end')
+        return cls(df, tokens, start_dates, end_dates, version, validator, compact, row_hashes=hashes,
+                   changes=changes)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('Snapshots are read-only')
+        object.__setattr__(self, name, value)
+
+    # Approximate memory held by the snapshot: the frame, its indexes and any
+    # derived values that report their size
+    def nbytes(self):
+        total = self.df.memory_usage(index=True, deep=True).sum()
+        total += sum(index.nbytes for index in list(self.tokens.values()))
+        total += self.start_dates.nbytes + self.end_dates.nbytes + self.valid_dates.nbytes
+        total += sum(getattr(value, 'nbytes', 0) for value in list(self._derived.values()))
+        return int(total)
+
+    # The value the previous snapshot derived for key, while this snapshot is
+    # being built from it (see SheetChanges), else None
+    def previous_derived(self, key):
+        if self.changes is None:
+            return None
+        return self.changes.previous_value(key)
+
+    # Memoize a value computed from this snapshot, e.g. dropdown options.
+    # builder receives the snapshot and is called at most once per key.
+    def derive(self, key, builder):
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+        with self._derive_lock:
+            if key not in self._derived:
+                self._derived[key] = builder(self)
+            return self._derived[key]
+
+
+def is_remote(url):
+    return url.startswith('http://') or url.startswith('https://')
+
+
+def read_sheet(source, url, sheet):
+    if url.lower().split('?')[0].endswith('.csv'):
+        return pd.read_csv(source)
+    return pd.read_excel(source, sheet)
+
+
+# Loads the sheet and keeps the latest good snapshot. Remote sheets are
+# fetched conditionally (ETag/Last-Modified), local files are only re-read
+# when their mtime or size changes. A failed or timed out refresh is logged
+# and the previous snapshot keeps being served.
+class DataSource(object):
+    def __init__(self, url, sheet='Projects', interval=0, timeout=30, compact=False, store=None):
+        self.url = url
+        self.sheet = sheet
+        self.compact = compact
+        self.store = store
+        self.interval = interval
+        self.timeout = timeout
+        self.last_error = None
+        self.last_checked = None
+        # seconds the last successful load took, warmers included
+        self.last_duration = None
+        self._snapshot = None
+        self._version = 0
+        self._validator = None
+        self._warmers = []
+        self._transitions = []
+        self._refresh_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    # Warmers are called with each new snapshot before it is published, so
+    # expensive derived values are built off the request path.
+    def add_warmer(self, warmer):
+        self._warmers.append(warmer)
+        if self._snapshot is not None:
+            warmer(self._snapshot)
+
+    # Transitions are called with the published snapshot and the one about to
+    # replace it, after the warmers, e.g. to carry cached values over
+    def add_transition(self, transition):
+        self._transitions.append(transition)
+
+    def _fetch_remote(self):
+        headers = {}
+        if self._validator:
+            if self._validator.get('etag'):
+                headers['If-None-Match'] = self._validator['etag']
+            if self._validator.get('last_modified'):
+                headers['If-Modified-Since'] = self._validator['last_modified']
+        response = requests.get(self.url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None, self._validator
+        response.raise_for_status()
+        content = response.content
+        validator = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha1': hashlib.sha1(content).hexdigest(),
+        }
+        # Servers without validators still get a cheap unchanged check
+        if self._validator and self._validator.get('sha1') == validator['sha1']:
+            return None, validator
+        return read_sheet(io.BytesIO(content), self.url, self.sheet), validator
+
+    def _fetch_local(self):
+        stat = os.stat(self.url)
+        validator = {'mtime': stat.st_mtime, 'size': stat.st_size}
+        if validator == self._validator:
+            return None, validator
+        return read_sheet(self.url, self.url, self.sheet), validator
+
+    # Returns True when a new snapshot was published
+    def refresh(self, use_store=True):
+        with self._refresh_lock:
+            self.last_checked = started = time.time()
+            try:
+                stored = None
+                if self._snapshot is None and self.store is not None and use_store:
+                    # a stored snapshot is only used if the sheet has not
+                    # changed since it was written
+                    stored = self.store.current(self.url, self.compact)
+                    if stored is not None:
+                        self._validator = stored['validator']
+                if is_remote(self.url):
+                    raw, validator = self._fetch_remote()
+                else:
+                    raw, validator = self._fetch_local()
+                if raw is None and stored is not None:
+                    snapshot = self._load_stored(stored)
+                    if snapshot is None:
+                        self._validator = None
+                        return self.refresh(use_store=False)
+                elif raw is None:
+                    self._validator = validator
+                    return False
+                else:
+                    snapshot = Snapshot.build(clean_frame(raw, self.compact), self._version + 1, validator,
+                                              self.compact, previous=self._snapshot)
+                    if self.store is not None:
+                        self._save_stored(snapshot)
+                for warmer in self._warmers:
+                    warmer(snapshot)
+                if self._snapshot is not None:
+                    for transition in self._transitions:
+                        transition(self._snapshot, snapshot)
+            except Exception as e:
+                self.last_error = e
+                if self._snapshot is None:
+                    raise
+                logger.exception('Refreshing %s failed, still serving version %s',
+                                 self.url, self._snapshot.version)
+                return False
+
+            self.last_error = None
+            self.last_duration = time.time() - started
+            self._validator = snapshot.validator
+            self._version = snapshot.version
+            # a single reference assignment, so readers see either the old
+            # or the new snapshot, never a partially built one
+            self._snapshot = snapshot
+            if snapshot.changes is not None:
+                snapshot.changes.release()
+                logger.info('Loaded %s as version %s (%s rows, %s changed)', self.url, snapshot.version,
+                            len(snapshot.df), len(snapshot.changes))
+            else:
+                logger.info('Loaded %s as version %s (%s rows)', self.url, snapshot.version, len(snapshot.df))
+            return True
+
+    def _load_stored(self, manifest):
+        try:
+            snapshot = self.store.load(manifest, self._version + 1)
+            logger.info('Using stored snapshot %s of %s', manifest['digest'], self.url)
+            return snapshot
+        except Exception:
+            logger.exception('Stored snapshot %s is unusable, reading %s', manifest['digest'], self.url)
+            return None
+
+    def _save_stored(self, snapshot):
+        try:
+            self.store.save(snapshot, self.url)
+        except Exception:
+            logger.exception('Could not store snapshot %s', snapshot.digest)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Background refresh of %s failed', self.url)
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='dash-it-all-refresh')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+
+import numpy as np
+
+from columns import col_name
+from table import TABLE_COLUMNS, project_table
+
+# Formats the export route serves, with their mimetypes. Neither is in
+# Flask-Compress's COMPRESS_MIMETYPES, which would buffer the whole stream
+# to gzip it; the brotli hook leaves streamed responses alone.
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+# Chunks of an export of the rows selected by mask, in sheet order. Cells
+# come from the project table's factorized columns, so a chunk only looks
+# up chunk_rows codes and no frame or string of the whole export is built.
+def export_chunks(snapshot, mask, fmt='csv', chunk_rows=1000):
+    table = project_table(snapshot)
+    names = [col_name(short) for short in TABLE_COLUMNS]
+    columns = []
+    for short in TABLE_COLUMNS:
+        codes, uniques = table.codes(short)
+        columns.append((codes, np.append(uniques, None)))
+    rows = np.flatnonzero(mask)
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        values = [uniques[codes[chunk]] for codes, uniques in columns]
+        if fmt == 'csv':
+            if start:
+                buffer.seek(0)
+                buffer.truncate()
+            writer.writerows(zip(*values))
+            yield buffer.getvalue()
+        else:
+            yield ''.join(json.dumps(dict(zip(names, record))) + '\n' for record in zip(*values))
+    if fmt == 'csv' and not len(rows):
+        yield buffer.getvalue()
@@ -0,0 +1,238 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import plotly
+
+from coalesce import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# Filter values arrive from dropdowns in click order; the cache key should
+# not depend on that order, or on '' vs None for a cleared single select.
+# Lists and sets are the unordered values of one filter; tuples (such as a
+# call's positional arguments) keep their order. Booleans are tagged so
+# True and 1 stay apart.
+def normalize(value):
+    if isinstance(value, (list, set, frozenset)):
+        return tuple(sorted(set(normalize(v) for v in value), key=repr))
+    if isinstance(value, tuple):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+    if isinstance(value, bool):
+        return ('bool', value)
+    if value == '':
+        return None
+    return value
+
+
+# Size-bounded LRU cache for figures and graph elements. Entries belong to
+# one data version; the first lookup with a newer version drops everything
+# cached for the old one, except the entries carry_over moved to it. With a
+# directory, entries are also written there as JSON so every gunicorn worker
+# on the machine can reuse them.
+class FigureCache(object):
+    def __init__(self, max_entries=256, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.carried = 0
+        self._entries = OrderedDict()
+        # (function name, args, kwargs) of the memoized entries
+        self._calls = {}
+        # (version, entries, calls) carried over to a version not seen yet
+        self._staged = None
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'carried': self.carried,
+                'shared': self._flights.shared,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._calls.clear()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self._calls.clear()
+            if self._staged is not None and self._staged[0] == version:
+                self._entries.update(self._staged[1])
+                self._calls.update(self._staged[2])
+            self._staged = None
+            self.version = version
+            if self.directory:
+                self._prune_versions(version)
+
+    # Carries the entries of version old that keep(name, args, kwargs) accepts
+    # over to version new, which takes them when it is first looked up.
+    # Their files are linked into new's directory. Returns how many were kept.
+    def carry_over(self, old, new, keep):
+        with self._lock:
+            if self.version != old:
+                return 0
+            candidates = [(key, value, self._calls[key]) for key, value in self._entries.items()
+                          if key in self._calls]
+        kept = [(key, value, call) for key, value, call in candidates if keep(*call)]
+        if self.directory:
+            for key, _, _ in kept:
+                self._link(old, new, key)
+        with self._lock:
+            self._staged = (new, OrderedDict((key, value) for key, value, _ in kept),
+                            {key: call for key, _, call in kept})
+            self.carried += len(kept)
+        return len(kept)
+
+    def get(self, version, key, call=None):
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+
+        if self.directory:
+            found, value = self._read(version, key)
+            if found:
+                with self._lock:
+                    self.disk_hits += 1
+                    self.hits += 1
+                self._remember(version, key, value, call)
+                return True, value
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, version, key, value, call=None):
+        self._remember(version, key, value, call)
+        if self.directory:
+            self._write(version, key, value)
+
+    def _remember(self, version, key, value, call=None):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if call is not None:
+                self._calls[key] = call
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._calls.pop(evicted, None)
+
+    # func(*args, **kwargs) for the given data version, answered from the
+    # cache when it holds a call with equivalent arguments. observer, if
+    # given, is called with the function name and whether the lookup was a
+    # hit. Misses for a value already being computed by another thread wait
+    # for it instead of computing it again (see coalesce.SingleFlight),
+    # calling check while they wait.
+    def call(self, version, func, args, kwargs, observer=None, check=None):
+        key = (func.__name__, normalize(args), normalize(kwargs))
+        call = (func.__name__, args, kwargs)
+        found, value = self.get(version, key, call)
+        if observer is not None:
+            observer(func.__name__, found)
+        if found:
+            return value
+
+        def compute():
+            value = func(*args, **kwargs)
+            self.set(version, key, value, call)
+            return value
+        return self._flights.do((version, key), compute, check)
+
+    # Wraps a function so its calls go through call() with the version
+    # version_getter returns
+    def memoize(self, version_getter, observer=None, check=None):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.call(version_getter(), func, args, kwargs, observer, check)
+            return wrapper
+        return decorator
+
+    # On-disk backend: <directory>/<version>/<sha1 of key>.json
+    def _path(self, version, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, str(version), name + '.json')
+
+    def _read(self, version, key):
+        path = self._path(version, key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path, None)
+            return True, value
+        except (IOError, OSError, ValueError):
+            return False, None
+
+    def _write(self, version, key, value):
+        path = self._path(version, key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f, cls=plotly.utils.PlotlyJSONEncoder)
+            os.replace(tmp, path)
+            self._prune_files(os.path.dirname(path))
+        except (IOError, OSError, TypeError):
+            logger.exception('Could not write cache entry %s', path)
+
+    def _link(self, old, new, key):
+        source, target = self._path(old, key), self._path(new, key)
+        try:
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            os.link(source, target)
+        except FileExistsError:
+            pass
+        except (IOError, OSError):
+            try:
+                shutil.copyfile(source, target)
+            except (IOError, OSError):
+                pass
+
+    def _prune_files(self, directory):
+        names = [n for n in os.listdir(directory) if n.endswith('.json')]
+        if len(names) <= self.max_entries:
+            return
+        paths = [os.path.join(directory, n) for n in names]
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Other workers may still be on an older version for a while, so only
+    # directories nobody has written to recently are removed
+    def _prune_versions(self, version, stale_after=3600):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != str(version) and os.path.getmtime(path) < time.time() - stale_after:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from columns import col_name
+from datasource import freeze_array
+from figure_cache import normalize
+from semesters import semester_index
+
+# Filters shared by the charts, in the order the filter bar shows them. Chart
+# control ids end in the dimension name (status-bar-scale -> scale). window
+# is a semester range slider, the others are dropdowns.
+FILTER_DIMENSIONS = ['scale', 'status', 'teams', 'ptheme', 'window']
+
+
+# Boolean row masks of one snapshot for filter states. Every distinct state,
+# and every single-dimension mask it is made of, is evaluated once and then
+# shared by all figures filtering on it, until it drops out of the LRU.
+# Masks are read-only. An empty filter value, or a window covering every
+# semester, means no restriction. Windows select the projects active in
+# them through the snapshot's semester interval index.
+class RowMasks(object):
+    def __init__(self, snapshot, max_entries=128):
+        self.snapshot = snapshot
+        self.max_entries = max_entries
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mask(self, scale=[], status=[], teams=[], ptheme='', window=None):
+        values = {'scale': scale, 'status': status, 'teams': teams, 'ptheme': ptheme,
+                  'window': semester_index(self.snapshot).window(window)}
+        key = tuple((dim, normalize(values[dim])) for dim in FILTER_DIMENSIONS)
+        return self._memoize(key, lambda: self._combine(values))
+
+    def _combine(self, values):
+        mask = np.ones(len(self.snapshot.df), dtype=bool)
+        for dim in FILTER_DIMENSIONS:
+            if values[dim]:
+                mask &= self._memoize((dim, normalize(values[dim])), lambda: self._dimension(dim, values[dim]))
+        return mask
+
+    def _dimension(self, dim, value):
+        df = self.snapshot.df
+        if dim == 'teams':
+            return self.snapshot.tokens[col_name('teams')].rows_with_any(value)
+        if dim == 'ptheme':
+            return (df[col_name('p_theme')] == value).values
+        if dim == 'window':
+            return semester_index(self.snapshot).mask(*value)
+        return df[col_name(dim)].isin(value).values
+
+    def _memoize(self, key, builder):
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+        mask = freeze_array(np.asarray(builder(), dtype=bool))
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.max_entries:
+                self._masks.popitem(last=False)
+        return mask
+
+
+def row_masks(snapshot):
+    return snapshot.derive('row_masks', RowMasks)
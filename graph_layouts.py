@@ -0,0 +1,215 @@
+import threading
+
+import numpy as np
+
+# Layouts the graph dropdowns offer, named as cytoscape names them
+LAYOUTS = ['random', 'grid', 'circle', 'concentric', 'breadthfirst', 'cose']
+DEFAULT_LAYOUT = 'circle'
+# Layouts keeping their aspect ratio; the others are stretched to the box
+UNIFORM_LAYOUTS = ['circle', 'concentric', 'cose']
+# Layouts that only depend on the number of nodes
+COUNT_LAYOUTS = ['random', 'grid', 'circle']
+
+# Positions are placed in this box, in pixels. Zooming is disabled on the
+# graphs, so cytoscape cannot fit them to the container itself.
+WIDTH = 1000.0
+HEIGHT = 760.0
+MARGIN = 40.0
+
+# Rows of the pairwise distance matrix the force-directed layout holds at once
+BLOCK_ROWS = 256
+
+
+def circle(count):
+    angles = 2 * np.pi * np.arange(count) / max(count, 1) - np.pi / 2
+    return np.column_stack([np.cos(angles), np.sin(angles)])
+
+
+def grid(count):
+    columns = max(int(np.ceil(np.sqrt(count * WIDTH / HEIGHT))), 1)
+    cells = np.arange(count)
+    return np.column_stack([cells % columns, cells // columns]).astype(float)
+
+
+def random(count, seed=0):
+    return np.random.RandomState(seed).rand(count, 2)
+
+
+# The heaviest nodes in the centre, then rings of 6, 12, 18... nodes
+def concentric(degrees):
+    count = len(degrees)
+    ranks = np.empty(count, dtype=np.int64)
+    ranks[np.argsort(-degrees, kind='mergesort')] = np.arange(count)
+    # ring r holds ranks 1 + 3r(r - 1) up to 3r(r + 1)
+    rings = np.ceil((np.sqrt(9 + 12 * ranks) - 3) / 6 - 1e-9).astype(np.int64)
+    firsts = np.where(rings > 0, 1 + 3 * rings * (rings - 1), 0)
+    sizes = np.minimum(np.maximum(6 * rings, 1), count - firsts)
+    angles = 2 * np.pi * (ranks - firsts) / sizes - np.pi / 2
+    return np.column_stack([rings * np.cos(angles), rings * np.sin(angles)])
+
+
+# Levels of a breadth-first search from the heaviest node of each connected
+# component, top to bottom, each level spread evenly across
+def breadthfirst(weights, degrees):
+    count = len(weights)
+    adjacency = weights > 0
+    levels = np.full(count, -1, dtype=np.int64)
+    while (levels < 0).any():
+        unvisited = np.flatnonzero(levels < 0)
+        frontier = np.zeros(count, dtype=bool)
+        frontier[unvisited[np.argmax(degrees[unvisited])]] = True
+        level = 0
+        while frontier.any():
+            levels[frontier] = level
+            frontier = adjacency[frontier].any(axis=0) & (levels < 0)
+            level += 1
+    order = np.lexsort((np.arange(count), levels))
+    sorted_levels = levels[order]
+    starts = np.searchsorted(sorted_levels, sorted_levels)
+    widths = np.bincount(levels)[sorted_levels]
+    positions = np.empty((count, 2))
+    positions[order, 0] = np.arange(count) - starts - (widths - 1) / 2.0
+    positions[order, 1] = sorted_levels
+    return positions
+
+
+# Fruchterman-Reingold: every pair of nodes repels, edges attract with the log
+# of their weight, and each step moves a node at most temperature, cooling
+# linearly. A weak pull to the centre keeps disconnected nodes in view.
+def force_directed(weights, positions, iterations=100, temperature=0.1):
+    count = len(positions)
+    positions = np.array(positions, dtype=float)
+    if count < 2:
+        return positions
+    attraction = np.log1p(weights)
+    span = np.ptp(positions, axis=0).max() or 1.0
+    k = span / np.sqrt(count)
+    for step in range(iterations):
+        displacement = np.empty_like(positions)
+        squares = (positions ** 2).sum(axis=1)
+        for start in range(0, count, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, count)
+            block = positions[start:stop]
+            # the force along p_i - p_j, summed as p_i * sum(force) - force . p
+            distance = squares[start:stop, None] + squares[None, :] - 2 * block.dot(positions.T)
+            distance = np.sqrt(np.maximum(distance, (1e-3 * k) ** 2))
+            force = k * k / distance ** 2 - attraction[start:stop] * distance / k
+            force[np.arange(stop - start), np.arange(start, stop)] = 0
+            displacement[start:stop] = block * force.sum(axis=1)[:, None] - force.dot(positions)
+        displacement -= 0.05 * (positions - positions.mean(axis=0)) * np.sqrt(count) / k
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-12)
+        limit = temperature * span * (1 - step / float(iterations))
+        positions += displacement * (np.minimum(length, limit) / length)[:, None]
+    return positions
+
+
+# Node positions of one token column of a snapshot. Each layout is computed
+# once over the whole vocabulary and fitted to the box; a filtered graph
+# takes the positions of the nodes it still has, so they stay put when
+# filters change. Only cose is refined for the filtered graph's own edges,
+# starting from the full layout and moving nodes a short way.
+class GraphLayouts(object):
+    def __init__(self, index, weights=None):
+        self.index = index
+        if weights is None:
+            weights = index.cooccurrence()
+        self.weights = np.array(weights, dtype=float)
+        np.fill_diagonal(self.weights, 0)
+        self.degrees = self.weights.sum(axis=1)
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    # The layouts of a new version of the column, given those of the
+    # previous snapshot (see SheetChanges): the co-occurrence weights of the
+    # removed rows are taken out and those of the changed rows added. Layouts
+    # computed before are kept while they cannot have moved: all of them if
+    # the weights are unchanged, those depending on the node count only if
+    # the vocabulary is.
+    @classmethod
+    def update(cls, previous, index, changes, column):
+        old_index = changes.previous.tokens[column] if changes.previous is not None else None
+        if old_index is None:
+            return cls(index)
+        codes = np.array([index.lookup.get(token.lower(), -1) for token in old_index.vocab], dtype=np.int64)
+        kept = codes >= 0
+        weights = index.cooccurrence(changes.changed).astype(np.int64)
+        removed = previous.weights - old_index.cooccurrence(changes.removed)
+        np.fill_diagonal(removed, 0)
+        if removed[~kept].any() or removed[:, ~kept].any():
+            return cls(index)
+        weights[np.ix_(codes[kept], codes[kept])] += removed[np.ix_(kept, kept)].astype(np.int64)
+
+        layouts = cls(index, weights)
+        if old_index.vocab == index.vocab:
+            with previous._lock:
+                carried = dict(previous._layouts)
+            if not np.array_equal(layouts.weights, previous.weights):
+                carried = {name: layout for name, layout in carried.items() if name in COUNT_LAYOUTS}
+            layouts._layouts.update(carried)
+        return layouts
+
+    # (unscaled positions, scale, offset) of a layout over every node
+    def full(self, name):
+        with self._lock:
+            if name in self._layouts:
+                return self._layouts[name]
+        positions = self._compute(name)
+        scale, offset = fit(positions, uniform=name in UNIFORM_LAYOUTS)
+        with self._lock:
+            return self._layouts.setdefault(name, (positions, scale, offset))
+
+    def _compute(self, name):
+        count = len(self.weights)
+        if name == 'random':
+            return random(count)
+        if name == 'grid':
+            return grid(count)
+        if name == 'concentric':
+            return concentric(self.degrees)
+        if name == 'breadthfirst':
+            return breadthfirst(self.weights, self.degrees)
+        if name == 'cose':
+            return force_directed(self.weights, random(count))
+        return circle(count)
+
+    # Box positions for the nodes present (vocabulary codes); weights is the
+    # filtered co-occurrence matrix, used to refine cose
+    def positions(self, name, present, weights=None):
+        if name not in LAYOUTS:
+            name = DEFAULT_LAYOUT
+        positions, scale, offset = self.full(name)
+        positions = positions[present]
+        if name == 'cose' and weights is not None and len(present) > 1:
+            weights = np.array(weights[np.ix_(present, present)], dtype=float)
+            np.fill_diagonal(weights, 0)
+            positions = force_directed(weights, positions, iterations=20, temperature=0.004)
+        positions = positions * scale + offset
+        return np.clip(positions, [MARGIN, MARGIN], [WIDTH - MARGIN, HEIGHT - MARGIN])
+
+
+# Scale and offset placing positions in the middle of the box. An axis
+# without any spread is centred.
+def fit(positions, uniform=True):
+    box = np.array([WIDTH - 2 * MARGIN, HEIGHT - 2 * MARGIN])
+    if not len(positions):
+        return np.ones(2), MARGIN + box / 2
+    low = positions.min(axis=0)
+    extent = positions.max(axis=0) - low
+    spread = extent > 0
+    scale = np.ones(2)
+    scale[spread] = box[spread] / extent[spread]
+    if uniform and spread.any():
+        scale[:] = scale[spread].min()
+    offset = MARGIN + (box - extent * scale) / 2 - low * scale
+    return scale, offset
+
+
+def graph_layouts(snapshot, column):
+    key = ('graph_layouts', column)
+
+    def build(snapshot):
+        previous = snapshot.previous_derived(key)
+        if previous is None:
+            return GraphLayouts(snapshot.tokens[column])
+        return GraphLayouts.update(previous, snapshot.tokens[column], snapshot.changes, column)
+    return snapshot.derive(key, build)
@@ -0,0 +1,212 @@
+import bisect
+import functools
+import threading
+import time
+
+from dash.exceptions import PreventUpdate
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase(object):
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        record = getattr(self.metrics._local, 'record', None)
+        if record is not None:
+            phases = record['phases']
+            phases[self.name] = phases.get(self.name, 0.0) + time.time() - self.start
+        return False
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def sample(name, labels, value):
+    if not labels:
+        return '{0} {1}'.format(name, value)
+    return '{0}{{{1}}} {2}'.format(name, ','.join('{0}="{1}"'.format(k, escape(v)) for k, v in labels), value)
+
+
+# In-process callback metrics in the Prometheus text format. For every dash
+# callback it records the wall time, the time spent in each phase, the size
+# of the response and whether cached figures were hit:
+#
+#   data       filtering and aggregating (code inside metrics.phase('data'))
+#   figure     the rest of the callback function, building the figure
+#   serialize  dash encoding the result as JSON
+#
+# A disabled instance does not wrap anything and its phase() is a shared
+# no-op context manager, so instrumented code costs next to nothing.
+class Metrics(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.gauges = []
+        self._histograms = {}
+        self._counters = {}
+        self._help = {
+            'dash_callback_duration_seconds': 'Wall time of dash callbacks',
+            'dash_callback_phase_seconds': 'Time spent in each phase of dash callbacks',
+            'dash_callback_response_bytes': 'Size of dash callback responses before compression',
+            'dash_callback_cache_lookups_total': 'Figure cache lookups made by dash callbacks',
+            'dash_callback_errors_total': 'Dash callbacks that raised, by exception type',
+            'dash_callback_prevented_total': 'Dash callbacks that left their output unchanged (PreventUpdate)',
+        }
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    # gauge is called on every scrape and returns (name, labels, value) tuples
+    def add_gauge(self, gauge):
+        self.gauges.append(gauge)
+
+    # Called by the figure cache for every lookup made while computing a callback
+    def cache_lookup(self, name, found):
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record['cache'].append(found)
+
+    # Wraps every callback registered on the dash app. Call it after all
+    # callbacks are registered.
+    def instrument(self, dash_app):
+        if not self.enabled:
+            return
+        for output, entry in dash_app.callback_map.items():
+            entry['callback'] = self._instrumented(output, entry['callback'])
+
+    # Wraps the callback function itself (before dash adds the JSON
+    # encoding), so the figure and serialize phases can be told apart
+    def compute(self, func):
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase('compute'):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _instrumented(self, output, callback):
+        labels = (('callback', output),)
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            self._local.record = record = {'phases': {}, 'cache': []}
+            start = time.time()
+            # Callbacks that prevent their update, e.g. superseded requests,
+            # are a normal outcome: they are counted on their own and kept
+            # out of the errors and the latency histograms
+            try:
+                response = callback(*args, **kwargs)
+            except PreventUpdate:
+                self.inc('dash_callback_prevented_total', labels)
+                raise
+            except Exception as e:
+                self.inc('dash_callback_errors_total', labels + (('error', type(e).__name__),))
+                self.observe('dash_callback_duration_seconds', labels, time.time() - start)
+                raise
+            finally:
+                self._local.record = None
+            elapsed = time.time() - start
+            self.observe('dash_callback_duration_seconds', labels, elapsed)
+            self._finish(labels, record, elapsed, response)
+            return response
+        return wrapper
+
+    def _finish(self, labels, record, elapsed, response):
+        phases = record['phases']
+        compute = phases.pop('compute', elapsed)
+        data = phases.pop('data', 0.0)
+        split = {'data': data, 'figure': max(compute - data, 0.0), 'serialize': max(elapsed - compute, 0.0)}
+        split.update(phases)
+        for phase, seconds in split.items():
+            self.observe('dash_callback_phase_seconds', labels + (('phase', phase),), seconds)
+        # dash encodes ASCII-only JSON, so characters are bytes
+        self.observe('dash_callback_response_bytes', labels, len(response), SIZE_BUCKETS)
+        for found in record['cache']:
+            self.inc('dash_callback_cache_lookups_total', labels + (('result', 'hit' if found else 'miss'),))
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in histograms]
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append('# HELP {0} {1}'.format(name, self._help[name]))
+                lines.append('# TYPE {0} {1}'.format(name, kind))
+
+        for (name, labels), counts, total, count, buckets in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip([str(b) for b in buckets] + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(sample(name + '_bucket', labels + (('le', bound),), cumulative))
+            lines.append(sample(name + '_sum', labels, total))
+            lines.append(sample(name + '_count', labels, count))
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(sample(name, labels, value))
+        for gauge in self.gauges:
+            for name, labels, value in gauge():
+                header(name, 'gauge')
+                lines.append(sample(name, tuple(labels), value))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,27 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+
+# Plain copy of a figure or other callback value, ready for JSON: plotly
+# objects become dicts, NumPy and pandas values become lists and Python
+# scalars, floats are rounded to `digits` significant digits and dict keys
+# set to None are dropped. None inside lists is kept, traces use it for gaps.
+def compact(value, digits=6):
+    if isinstance(value, dict):
+        return {k: compact(v, digits) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [compact(v, digits) for v in value]
+    if isinstance(value, (np.ndarray, pd.Index, pd.Series)):
+        # datetimes would become integers, the plotly encoder formats them
+        if np.asarray(value).dtype.kind == 'M':
+            return value
+        return compact(value.tolist(), digits)
+    if hasattr(value, 'to_plotly_json'):
+        return compact(value.to_plotly_json(), digits)
+    if isinstance(value, np.generic) and not isinstance(value, np.datetime64):
+        value = value.item()
+    if isinstance(value, float) and math.isfinite(value):
+        return float('{0:.{1}g}'.format(value, digits))
+    return value
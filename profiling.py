@@ -0,0 +1,137 @@
+import cProfile
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Dash-Profile'
+
+
+# Samples the stack of one thread every interval seconds, counting each
+# distinct stack. The result is in the collapsed format flamegraph tools
+# read: frames root first, separated by semicolons, then the sample count.
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval=0.005):
+        threading.Thread.__init__(self, name='dash-it-all-sampler')
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append('{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                      code.co_firstlineno))
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join('{0} {1}\n'.format(stack, count) for stack, count in sorted(self.stacks.items()))
+
+
+# Profiles single requests on demand. A request carrying the X-Dash-Profile
+# header (cprofile, or sample for the stack sampler) from an allowed client
+# is profiled and the result written to the directory as
+# <time>-<pid>-<callback>.pstats or .collapsed. The oldest profiles are
+# removed once the directory grows past max_bytes.
+class RequestProfiler(object):
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024, interval=0.005):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    # Wraps a Flask view; allowed is called per request to decide whether
+    # the header may be honoured
+    def wrap(self, view, allowed):
+        @functools.wraps(view)
+        def profiled(*args, **kwargs):
+            mode = flask.request.headers.get(PROFILE_HEADER, '').strip().lower()
+            if not mode or not allowed():
+                return view(*args, **kwargs)
+            if mode == 'sample':
+                response, name = self._sample(view, args, kwargs)
+            else:
+                response, name = self._cprofile(view, args, kwargs)
+            if name:
+                response.headers[PROFILE_HEADER + '-File'] = name
+            return response
+        return profiled
+
+    def _cprofile(self, view, args, kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = view(*args, **kwargs)
+        finally:
+            profile.disable()
+        name = self._write('.pstats', lambda path: profile.dump_stats(path))
+        return response, name
+
+    def _sample(self, view, args, kwargs):
+        sampler = StackSampler(threading.current_thread().ident, self.interval)
+        sampler.start()
+        try:
+            response = view(*args, **kwargs)
+        finally:
+            sampler.stop()
+
+        def write(path):
+            with open(path, 'w') as f:
+                f.write(sampler.collapsed())
+        name = self._write('.collapsed', write)
+        return response, name
+
+    def _write(self, suffix, writer):
+        body = flask.request.get_json(silent=True) or {}
+        output = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(body.get('output', 'request')))[:80]
+        name = '{0}-{1:03d}-{2}-{3}{4}'.format(time.strftime('%Y%m%d-%H%M%S'), int(time.time() * 1000) % 1000,
+                                              os.getpid(), output, suffix)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            writer(os.path.join(self.directory, name))
+            self._rotate()
+        except (IOError, OSError):
+            logger.exception('Could not write profile %s', name)
+            return None
+        logger.info('Wrote profile %s', name)
+        return name
+
+    def _rotate(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+from columns import col_name
+
+# Semesters look like 2019/2020-02: academic year, then semester 01-03
+SEMESTER_PATTERN = r'^(20\d{2})/(20\d{2})-0([1-3])$'
+
+# (month, day) each semester starts and ends on, and whether it falls in
+# the first or second calendar year of the academic year
+SEMESTER_BOUNDS = {
+    '1': {'start': (9, 1), 'end': (12, 31), 'year': 0},
+    '2': {'start': (1, 1), 'end': (4, 30), 'year': 1},
+    '3': {'start': (5, 1), 'end': (8, 31), 'year': 1},
+}
+
+
+# Maps a column of semester strings to datetimes for the start or end of
+# each semester. Only the distinct strings are parsed; anything that is not
+# a valid semester becomes NaT.
+def semester_dates(series, start_end):
+    codes, uniques = pd.factorize(series)
+    parts = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.extract(SEMESTER_PATTERN, expand=True)
+
+    dates = []
+    for start_year, end_year, semester in parts.itertuples(index=False):
+        if not isinstance(semester, str):
+            dates.append(None)
+            continue
+        bounds = SEMESTER_BOUNDS[semester]
+        year = end_year if bounds['year'] else start_year
+        month, day = bounds[start_end]
+        dates.append('{0}-{1:02d}-{2:02d}'.format(year, month, day))
+
+    unique_dates = pd.to_datetime(pd.Series(dates, dtype=object), errors='coerce').values
+    # missing values have code -1, which picks the trailing NaT
+    unique_dates = np.append(unique_dates, np.datetime64('NaT', 'ns'))
+    return unique_dates[codes]
+
+
+# Every semester from the earliest to the latest valid one in the given
+# columns of semester strings, in order, with their start and end dates
+def semester_table(*columns):
+    labels = pd.concat([pd.Series(np.asarray(c, dtype=object)) for c in columns], ignore_index=True)
+    parts = labels.dropna().drop_duplicates().astype(str).str.extract(SEMESTER_PATTERN, expand=True).dropna()
+    keys = sorted((int(year), int(semester)) for year, _, semester in parts.itertuples(index=False))
+    if not keys:
+        return pd.DataFrame({'label': [], 'start': [], 'end': []}, columns=['label', 'start', 'end'])
+    (first_year, first_semester), (last_year, last_semester) = keys[0], keys[-1]
+    all_labels = ['{0}/{1}-0{2}'.format(year, year + 1, semester)
+                  for year in range(first_year, last_year + 1) for semester in [1, 2, 3]
+                  if (first_year, first_semester) <= (year, semester) <= (last_year, last_semester)]
+    series = pd.Series(all_labels)
+    return pd.DataFrame({'label': all_labels, 'start': semester_dates(series, 'start'),
+                         'end': semester_dates(series, 'end')}, columns=['label', 'start', 'end'])
+
+
+def snapshot_semesters(snapshot):
+    return snapshot.derive('semesters', lambda s: semester_table(s.df[col_name('start')], s.df[col_name('end')]))
+
+
+# Interval index over the semesters each project runs, built once per
+# snapshot. Row i runs from position starts[i] to ends[i] of the semester
+# table; both are -1 for rows without valid semesters or ending before they
+# start, which are never active. Rows are grouped by their distinct
+# (start, end) interval in CSR layout: the rows of interval j are
+# rows[indptr[j]:indptr[j + 1]] and row_intervals[i] is the interval of row
+# i. A window query only compares the distinct intervals, of which there are
+# at most semesters squared, then gathers their rows.
+class SemesterIndex(object):
+    def __init__(self, table, start_dates, end_dates):
+        self.table = table
+        count = max(len(table), 1)
+        semester_starts = table['start'].values
+        starts = np.searchsorted(semester_starts, start_dates, 'right') - 1
+        ends = np.searchsorted(semester_starts, end_dates, 'right') - 1
+        valid = ~(pd.isnull(start_dates) | pd.isnull(end_dates)) & (starts >= 0) & (ends >= starts)
+        self.starts = np.where(valid, starts, -1).astype(np.int32)
+        self.ends = np.where(valid, ends, -1).astype(np.int32)
+
+        valid_rows = np.flatnonzero(valid)
+        intervals, interval_codes = np.unique(self.starts[valid_rows].astype(np.int64) * count + self.ends[valid_rows],
+                                              return_inverse=True)
+        self.interval_starts = (intervals // count).astype(np.int32)
+        self.interval_ends = (intervals % count).astype(np.int32)
+        self.row_intervals = np.full(len(valid), -1, dtype=np.int32)
+        self.row_intervals[valid_rows] = interval_codes
+        self.rows = valid_rows[np.argsort(interval_codes, kind='mergesort')].astype(np.int32)
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(interval_codes, minlength=len(intervals)))])
+
+        arrays = [self.starts, self.ends, self.interval_starts, self.interval_ends, self.row_intervals,
+                  self.rows, self.indptr]
+        self.nbytes = sum(a.nbytes for a in arrays)
+        for array in arrays:
+            array.flags.writeable = False
+
+    # (first, last) semester positions of a range slider value, clipped to
+    # the table, or None when it does not restrict anything
+    def window(self, value):
+        last = len(self.table) - 1
+        if not value or last < 0:
+            return None
+        first, end = sorted(min(max(int(i), 0), last) for i in value)
+        if first == 0 and end == last:
+            return None
+        return first, end
+
+    # Boolean mask over the distinct intervals overlapping semesters first to last
+    def active_intervals(self, first, last):
+        return (self.interval_starts <= last) & (self.interval_ends >= first)
+
+    def rows_active(self, first, last):
+        hits = np.flatnonzero(self.active_intervals(first, last))
+        if not len(hits):
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([self.rows[self.indptr[j]:self.indptr[j + 1]] for j in hits])
+
+    def mask(self, first, last):
+        mask = np.zeros(len(self.starts), dtype=bool)
+        mask[self.rows_active(first, last)] = True
+        return mask
+
+    # Projects active in every semester, per group: a sweep adding one at
+    # each interval's start and removing it after its end. groups holds a
+    # group code per row (0 to group_count - 1) and mask selects the rows.
+    def active_counts(self, mask, groups, group_count):
+        rows = mask & (self.starts >= 0)
+        size = len(self.table) + 1
+        groups = np.asarray(groups, dtype=np.int64)[rows] * size
+        total = max(group_count, 0) * size
+        deltas = (np.bincount(groups + self.starts[rows], minlength=total)
+                  - np.bincount(groups + self.ends[rows] + 1, minlength=total))
+        return deltas.reshape(max(group_count, 0), size).cumsum(axis=1)[:, :-1]
+
+
+def semester_index(snapshot):
+    return snapshot.derive('semester_index', lambda s: SemesterIndex(snapshot_semesters(s), s.start_dates,
+                                                                      s.end_dates))
@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from columns import col_name
+from datasource import Snapshot, TokenIndexes
+from tokens import TokenIndex
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the stored layout changes. Snapshots written in another
+# format are ignored and the sheet is parsed again.
+FORMAT_VERSION = 3
+
+
+# Columnar binary copy of a snapshot so workers can start without parsing
+# the spreadsheet. Each stored snapshot is a directory of .npy arrays plus a
+# manifest.json describing the columns, named after the snapshot digest:
+#
+#   <directory>/current              digest of the snapshot to load
+#   <directory>/<digest>/manifest.json
+#   <directory>/<digest>/*.npy
+#
+# Arrays are memory-mapped read-only on load, so the token indexes, semester
+# dates and categorical codes of every worker share the OS page cache. Text
+# columns are decoded into Python strings per worker, each distinct value once.
+class SnapshotStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    # Manifest of the current stored snapshot if it was written from the same
+    # source in the same layout, otherwise None
+    def current(self, url, compact):
+        try:
+            with open(os.path.join(self.directory, 'current')) as f:
+                digest = f.read().strip()
+            with open(os.path.join(self.directory, digest, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if manifest.get('format') != FORMAT_VERSION or manifest.get('url') != url or manifest.get('compact') != compact:
+            return None
+        return manifest
+
+    def load(self, manifest, version):
+        path = os.path.join(self.directory, manifest['digest'])
+
+        def array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        columns = {}
+        for i, column in enumerate(manifest['columns']):
+            name = 'col{0}'.format(i)
+            if column['kind'] == 'array':
+                columns[column['name']] = array(name)
+            elif column['kind'] == 'category':
+                columns[column['name']] = pd.Categorical.from_codes(array(name), column['categories'])
+            elif column['kind'] == 'text':
+                columns[column['name']] = decode_text(array(name), array(name + '.codes'), column['count'])
+            else:
+                with open(os.path.join(path, name + '.json')) as f:
+                    columns[column['name']] = pd.Series(json.load(f), dtype=object)
+        df = pd.DataFrame(columns, columns=[c['name'] for c in manifest['columns']])
+
+        tokens = TokenIndexes()
+        for i, (column, vocab) in enumerate(manifest['tokens']):
+            name = 'tok{0}'.format(i)
+            tokens[column] = TokenIndex(vocab, array(name + '.indptr'), array(name + '.codes'),
+                                        array(name + '.row_cells'))
+
+        # older snapshots have no row hashes, so the next refresh rebuilds
+        hashes = array('row_hashes') if manifest.get('row_hashes') else None
+        return Snapshot(df, tokens, array('start_dates'), array('end_dates'), version,
+                        manifest['validator'], manifest['compact'], manifest['digest'], row_hashes=hashes)
+
+    def save(self, snapshot, url):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        target = os.path.join(self.directory, snapshot.digest)
+        if stored_format(target) != FORMAT_VERSION:
+            tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+            try:
+                self._write(snapshot, url, tmp)
+                # the same sheet stored in an older format is replaced
+                if os.path.isdir(target):
+                    shutil.rmtree(target, ignore_errors=True)
+                os.rename(tmp, target)
+            except OSError:
+                # another worker stored the same snapshot first
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not os.path.isdir(target):
+                    raise
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(snapshot.digest)
+        os.replace(tmp, os.path.join(self.directory, 'current'))
+        self._prune(snapshot.digest)
+
+    def _write(self, snapshot, url, path):
+        def save(name, values):
+            np.save(os.path.join(path, name + '.npy'), values)
+
+        columns = []
+        for i, name in enumerate(snapshot.df.columns):
+            series = snapshot.df[name]
+            column = {'name': name}
+            if isinstance(series.dtype, pd.api.types.CategoricalDtype):
+                column['kind'] = 'category'
+                column['categories'] = series.cat.categories.tolist()
+                save('col{0}'.format(i), series.cat.codes.values)
+            elif series.dtype != object:
+                column['kind'] = 'array'
+                save('col{0}'.format(i), series.values)
+            elif all(isinstance(v, str) and TEXT_SEPARATOR not in v for v in series.dropna()):
+                column['kind'] = 'text'
+                data, codes, column['count'] = encode_text(series)
+                save('col{0}'.format(i), data)
+                save('col{0}.codes'.format(i), codes)
+            else:
+                # mixed values (e.g. numeric ids in a text column) keep their types
+                column['kind'] = 'json'
+                with open(os.path.join(path, 'col{0}.json'.format(i)), 'w') as f:
+                    json.dump([None if pd.isnull(v) else v for v in series.tolist()], f)
+            columns.append(column)
+
+        tokens = []
+        for i, column in enumerate(col_name(c) for c in ['teams', 'external', 's_themes', 'all_themes']):
+            index = snapshot.tokens[column]
+            tokens.append([column, index.vocab])
+            for part in ['indptr', 'codes', 'row_cells']:
+                save('tok{0}.{1}'.format(i, part), getattr(index, part))
+
+        save('start_dates', snapshot.start_dates)
+        save('end_dates', snapshot.end_dates)
+        if snapshot.row_hashes is not None:
+            save('row_hashes', snapshot.row_hashes)
+
+        manifest = {
+            'format': FORMAT_VERSION,
+            'url': url,
+            'compact': snapshot.compact,
+            'digest': snapshot.digest,
+            'validator': snapshot.validator,
+            'rows': len(snapshot.df),
+            'written_at': time.time(),
+            'columns': columns,
+            'tokens': tokens,
+            'row_hashes': snapshot.row_hashes is not None,
+        }
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+    # Workers that mapped an older snapshot keep their mapping after the
+    # files are removed, so everything but the current snapshot can go
+    def _prune(self, digest):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != digest and os.path.isdir(path) and not name.startswith('.tmp-'):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+# Format of the snapshot stored in path, or None if there is none
+def stored_format(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f).get('format')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+# Text columns are stored as their distinct values, joined into one UTF-8
+# buffer, plus an int32 code per row (-1 for missing). Most columns repeat a
+# handful of values, so decoding only touches those and every row refers to
+# the same string object.
+TEXT_SEPARATOR = '\x00'
+
+
+def encode_text(series):
+    codes, uniques = pd.factorize(series)
+    data = TEXT_SEPARATOR.join(uniques).encode('utf-8')
+    return np.frombuffer(data, dtype=np.uint8), codes.astype(np.int32), len(uniques)
+
+
+def decode_text(data, codes, count):
+    uniques = data.tobytes().decode('utf-8').split(TEXT_SEPARATOR) if count else []
+    # missing values have code -1, which picks the trailing NaN
+    uniques = np.array(uniques + [np.nan], dtype=object)
+    return uniques.take(codes)
@@ -0,0 +1,183 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from columns import col_name
+from datasource import freeze_array
+from figure_cache import normalize
+from semesters import semester_dates
+
+# Columns of the project table, by short name. Their short names are the
+# DataTable column ids, so filter strings read "teams" eq Archive.
+TABLE_COLUMNS = ['pid', 'project', 'desc', 'grouping', 'scale', 'status', 'p_theme', 's_themes', 'teams',
+                 'external', 'start', 'end']
+TOKEN_COLUMNS = ['s_themes', 'teams', 'external']
+SEMESTER_COLUMNS = {'start': 'start_dates', 'end': 'end_dates'}
+
+# One fragment of the DataTable's basic filter string, e.g. "status" eq Committed
+FILTER_FRAGMENT = re.compile(r'^"((?:[^"\\]|\\.)+)"\s+(>=|<=|!=|>|<|=|ge|le|gt|lt|eq|ne)\s+(.+)$', re.IGNORECASE)
+OPERATORS = {'=': 'eq', '!=': 'ne', '>': 'gt', '>=': 'ge', '<': 'lt', '<=': 'le'}
+
+
+# A filter value as the table writes it: quoted, num(...)/str(...) or bare
+def filter_value(text):
+    text = text.strip()
+    if len(text) > 1 and text[0] == text[-1] and text[0] in '\'"`':
+        return re.sub(r'\\(.)', r'\1', text[1:-1])
+    match = re.match(r'^(num|str)\((.*)\)$', text)
+    if match:
+        return match.group(2)
+    return text
+
+
+# (column, operator, value) triples of a filter string. Fragments on unknown
+# columns or with operators other than comparisons are ignored.
+def parse_filter(expression):
+    clauses = []
+    for fragment in (expression or '').split(' && '):
+        match = FILTER_FRAGMENT.match(fragment.strip())
+        if match is None or match.group(1) not in TABLE_COLUMNS:
+            continue
+        operator = match.group(2).lower()
+        clauses.append((match.group(1), OPERATORS.get(operator, operator), filter_value(match.group(3))))
+    return clauses
+
+
+def compare(left, operator, right):
+    if operator == 'eq':
+        return left == right
+    if operator == 'ne':
+        return left != right
+    if operator == 'gt':
+        return left > right
+    if operator == 'ge':
+        return left >= right
+    if operator == 'lt':
+        return left < right
+    return left <= right
+
+
+# The project table of one snapshot, answered a page at a time. Every column
+# is factorized once into sorted codes: sort orders are stable argsorts of
+# the codes (computed once per column and direction) and a filter clause is
+# evaluated on the distinct values, then mapped to rows through the codes.
+# Team and theme clauses match whole tokens through the token indexes and
+# semester clauses compare semester dates. The rows of a (filter, sort)
+# state are kept in a small LRU, so paging through them only slices.
+class ProjectTable(object):
+    def __init__(self, snapshot, max_entries=32):
+        self.snapshot = snapshot
+        self.max_entries = max_entries
+        self._codes = {}
+        self._orders = {}
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Display text of a column: the sheet's cells, or for compact snapshots
+    # (which drop multi-value text) the tokens of each distinct cell
+    def _text(self, short):
+        df = self.snapshot.df
+        if col_name(short) in df.columns:
+            return df[col_name(short)].astype(object)
+        index = self.snapshot.tokens[col_name(short)]
+        text = np.array([', '.join(index.row_tokens(row)) or None for row in index.cell_rows], dtype=object)
+        return pd.Series(text[index.row_cells], index=df.index)
+
+    # (codes, uniques): codes index the sorted distinct values, missing values are -1
+    def codes(self, short):
+        with self._lock:
+            if short in self._codes:
+                return self._codes[short]
+        text = self._text(short)
+        codes, uniques = pd.factorize(text.where(text.isnull(), text.astype(str).str.strip()), sort=True)
+        result = (freeze_array(codes.astype(np.int32)), np.asarray(uniques, dtype=object))
+        with self._lock:
+            return self._codes.setdefault(short, result)
+
+    # Sort keys of a column: equal values share a key, missing values sort last
+    def sort_keys(self, short, direction='asc'):
+        if short in SEMESTER_COLUMNS:
+            # chronological rather than by label
+            dates = pd.Series(getattr(self.snapshot, SEMESTER_COLUMNS[short]))
+            keys = dates.rank(method='dense').fillna(0).values.astype(np.int64) - 1
+        else:
+            keys = self.codes(short)[0].astype(np.int64)
+        missing = keys < 0
+        if direction == 'desc':
+            return np.where(missing, 1, -keys)
+        return np.where(missing, keys.max(initial=0) + 1, keys)
+
+    # Stable row order for a column and direction
+    def order(self, short, direction='asc'):
+        key = (short, direction)
+        with self._lock:
+            if key in self._orders:
+                return self._orders[key]
+        order = freeze_array(np.argsort(self.sort_keys(short, direction), kind='mergesort').astype(np.int32))
+        with self._lock:
+            return self._orders.setdefault(key, order)
+
+    def _clause_mask(self, short, operator, value):
+        if short in TOKEN_COLUMNS and operator in ('eq', 'ne'):
+            mask = self.snapshot.tokens[col_name(short)].rows_with_any([value])
+            return mask if operator == 'eq' else ~mask
+        if short in SEMESTER_COLUMNS and operator not in ('eq', 'ne'):
+            bound = semester_dates(pd.Series([value]), 'start' if operator in ('gt', 'ge') else 'end')[0]
+            if pd.isnull(bound):
+                return np.zeros(len(self.snapshot.df), dtype=bool)
+            dates = getattr(self.snapshot, SEMESTER_COLUMNS[short])
+            return compare(dates, operator, bound) & ~pd.isnull(dates)
+        codes, uniques = self.codes(short)
+        values = np.array([str(u).lower() for u in uniques], dtype=object)
+        hits = np.append(compare(values, operator, value.lower()), operator == 'ne')
+        return hits[codes]
+
+    # Row positions of a filter and sort state, in display order
+    def rows(self, filtering='', sorting=[]):
+        clauses = parse_filter(filtering)
+        sorts = [(s.get('column_id'), s.get('direction', 'asc')) for s in sorting or []
+                 if s.get('column_id') in TABLE_COLUMNS]
+        key = (normalize(clauses), tuple(sorts))
+        with self._lock:
+            if key in self._states:
+                self._states.move_to_end(key)
+                return self._states[key]
+
+        if not sorts:
+            rows = np.arange(len(self.snapshot.df), dtype=np.int32)
+        elif len(sorts) == 1:
+            rows = self.order(*sorts[0])
+        else:
+            # later columns break ties of earlier ones; lexsort takes the primary key last
+            rows = np.lexsort([self.sort_keys(*sort) for sort in reversed(sorts)]).astype(np.int32)
+        if clauses:
+            mask = np.ones(len(self.snapshot.df), dtype=bool)
+            for clause in clauses:
+                mask &= self._clause_mask(*clause)
+            rows = rows[mask[rows]]
+        rows = freeze_array(rows)
+
+        with self._lock:
+            self._states[key] = rows
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+        return rows
+
+    # Records for one page of the table
+    def page(self, current_page=0, page_size=25, filtering='', sorting=[]):
+        rows = self.rows(filtering, sorting)
+        start = max(int(current_page or 0), 0) * page_size
+        rows = rows[start:start + page_size]
+        columns = {}
+        for short in TABLE_COLUMNS:
+            codes, uniques = self.codes(short)
+            values = np.append(uniques, '')[codes[rows]]
+            columns[short] = [str(v) for v in values]
+        return [{short: columns[short][i] for short in TABLE_COLUMNS} for i in range(len(rows))]
+
+
+def project_table(snapshot):
+    return snapshot.derive('project_table', ProjectTable)
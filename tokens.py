@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+
+
+# Splits a comma-separated cell into its capitalized, non-empty values.
+# Repeated values are kept so counts match the old per-row loops.
+def split_tokens(value):
+    tokens = [x.strip().capitalize() for x in str(value).split(',')]
+    return [x for x in tokens if x]
+
+
+# Inverted index for a comma-separated multi-value column, built once per
+# snapshot. The sorted token vocabulary is held once and each row is stored
+# as a run of integer codes into it (CSR layout): the codes of row i are
+# codes[indptr[i]:indptr[i + 1]] and rows[j] is the row that codes[j] belongs to.
+# Rows with the same cell text share a cell: row_cells maps rows to cells and
+# cell_rows holds the first row of each cell, whose codes stand for the cell.
+# cell_codes are those codes for every cell in turn and code_cells the cell
+# each belongs to, so team filters on the cubes only look at distinct cells.
+class TokenIndex(object):
+    def __init__(self, vocab, indptr, codes, row_cells):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.codes = codes
+        self.row_cells = row_cells.astype(np.int32, copy=False)
+        self.rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+        cells, first_rows = np.unique(self.row_cells, return_index=True)
+        self.cell_rows = np.zeros(cells[-1] + 1 if len(cells) else 0, dtype=np.int32)
+        self.cell_rows[cells] = first_rows
+        lengths = np.diff(indptr)[self.cell_rows]
+        self.code_cells = np.repeat(np.arange(len(self.cell_rows), dtype=np.int32), lengths)
+        self.cell_codes = self.codes[np.repeat(indptr[self.cell_rows], lengths) + np.arange(lengths.sum())
+                                     - np.repeat(np.cumsum(lengths) - lengths, lengths)]
+        self.lookup = {token.lower(): code for code, token in enumerate(vocab)}
+        # indexes are shared by every request on a snapshot
+        for array in [self.indptr, self.codes, self.rows, self.row_cells, self.cell_rows, self.code_cells,
+                      self.cell_codes]:
+            array.flags.writeable = False
+
+    # Each distinct cell is only split once, rows then just copy the codes
+    # of their cell.
+    @classmethod
+    def from_series(cls, series):
+        cell_codes, cells = pd.factorize(series.fillna(''))
+        cell_tokens = [split_tokens(cell) for cell in cells]
+        vocab = sorted(set(token for tokens in cell_tokens for token in tokens))
+        lookup = {token: code for code, token in enumerate(vocab)}
+
+        cell_lengths = np.array([len(tokens) for tokens in cell_tokens], dtype=np.int64)
+        cell_flat = np.array([lookup[t] for tokens in cell_tokens for t in tokens], dtype=np.int32)
+        return cls.from_cells(vocab, cell_flat, cell_lengths, cell_codes)
+
+    # The index of a new version of the column. source_rows maps each new
+    # row to the old row it is an unchanged copy of, or -1; only the cells
+    # of the other rows are split. Old cells still in use keep their token
+    # sequences (taken from one of their rows) and are renumbered in order,
+    # new cells follow them. Returns the index and the old -> new cell map
+    # (-1 for cells no longer used).
+    def update(self, source_rows, series):
+        carried = source_rows >= 0
+        old_cells = np.zeros(len(self.cell_rows), dtype=bool)
+        old_cells[self.row_cells[source_rows[carried]]] = True
+        cell_map = np.full(len(self.cell_rows), -1, dtype=np.int64)
+        cell_map[old_cells] = np.arange(old_cells.sum())
+
+        new_codes, new_cells = pd.factorize(series[~carried].fillna(''))
+        new_tokens = [split_tokens(cell) for cell in new_cells]
+        used = self.counts(old_cells[self.row_cells]) > 0
+        vocab = sorted(set(t for t, u in zip(self.vocab, used) if u) | set(t for ts in new_tokens for t in ts))
+        lookup = {token: code for code, token in enumerate(vocab)}
+        remap = np.array([lookup.get(t, -1) for t in self.vocab], dtype=np.int32)
+
+        # token sequences of the old cells, from the first row holding each
+        rows = self.cell_rows[old_cells]
+        lengths = np.diff(self.indptr)[rows]
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        old_flat = remap[self.codes[np.repeat(self.indptr[rows], lengths) + offsets]]
+
+        cell_lengths = np.concatenate([lengths, [len(tokens) for tokens in new_tokens]]).astype(np.int64)
+        cell_flat = np.concatenate([old_flat, np.array([lookup[t] for ts in new_tokens for t in ts],
+                                                       dtype=np.int32)]).astype(np.int32)
+        row_cells = np.empty(len(source_rows), dtype=np.int64)
+        row_cells[carried] = cell_map[self.row_cells[source_rows[carried]]]
+        row_cells[~carried] = len(rows) + new_codes
+        return self.from_cells(vocab, cell_flat, cell_lengths, row_cells), cell_map
+
+    # Builds the index from its distinct cells: cell_flat holds the token
+    # codes of every cell in turn, cell_lengths how many each has, and
+    # row_cells the cell of every row
+    @classmethod
+    def from_cells(cls, vocab, cell_flat, cell_lengths, row_cells):
+        cell_starts = np.concatenate([[0], np.cumsum(cell_lengths)[:-1]]).astype(np.int64)
+        lengths = cell_lengths[row_cells]
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        offsets = np.arange(indptr[-1]) - np.repeat(indptr[:-1], lengths)
+        codes = cell_flat[np.repeat(cell_starts[row_cells], lengths) + offsets]
+        return cls(vocab, indptr, codes, row_cells)
+
+    # Row-wise concatenation of two indexes over the same rows, e.g. the
+    # primary and secondary themes giving all_themes without building the
+    # joined strings. Each row holds first's tokens followed by second's.
+    @classmethod
+    def concat(cls, first, second):
+        vocab = sorted(set(first.vocab) | set(second.vocab))
+        lookup = {token: code for code, token in enumerate(vocab)}
+        first_codes = np.array([lookup[t] for t in first.vocab], dtype=np.int32)
+        second_codes = np.array([lookup[t] for t in second.vocab], dtype=np.int32)
+
+        first_lengths = np.diff(first.indptr)
+        lengths = first_lengths + np.diff(second.indptr)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        codes = np.zeros(indptr[-1], dtype=np.int32)
+        first_pos = indptr[first.rows] + np.arange(len(first.codes)) - first.indptr[first.rows]
+        second_pos = (indptr[second.rows] + first_lengths[second.rows]
+                      + np.arange(len(second.codes)) - second.indptr[second.rows])
+        codes[first_pos] = first_codes[first.codes]
+        codes[second_pos] = second_codes[second.codes]
+
+        # a combined cell is a distinct (first cell, second cell) pair
+        pairs = first.row_cells.astype(np.int64) * len(second.cell_rows) + second.row_cells
+        row_cells = np.unique(pairs, return_inverse=True)[1]
+        return cls(vocab, indptr, codes, row_cells)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.indptr, self.codes, self.rows, self.row_cells, self.cell_rows,
+                                      self.code_cells, self.cell_codes])
+
+    def row_tokens(self, row):
+        return [self.vocab[c] for c in self.codes[self.indptr[row]:self.indptr[row + 1]]]
+
+    # Codes for the given values, matched case-insensitively; unknown
+    # values are ignored
+    def codes_for(self, values):
+        return [self.lookup[v.lower()] for v in values if v.lower() in self.lookup]
+
+    # Occurrences of each token, optionally restricted to a row mask
+    def counts(self, mask=None):
+        codes = self.codes if mask is None else self.codes[mask[self.rows]]
+        return np.bincount(codes, minlength=len(self.vocab))
+
+    # Same shape as Series.value_counts: token -> count, largest first, ties by label
+    def value_counts(self, mask=None):
+        counts = self.counts(mask)
+        present = sorted(np.flatnonzero(counts), key=lambda c: (-counts[c], self.vocab[c]))
+        return pd.Series(counts[present], index=[self.vocab[c] for c in present])
+
+    # Boolean row mask of rows holding at least one of the values, compared
+    # as whole tokens rather than substrings
+    def rows_with_any(self, values):
+        mask = np.zeros(len(self), dtype=bool)
+        codes = self.codes_for(values)
+        if codes:
+            mask[self.rows[np.in1d(self.codes, codes)]] = True
+        return mask
+
+    # Boolean cell mask (see row_cells) of the cells holding at least one of
+    # the values
+    def cells_with_any(self, values):
+        mask = np.zeros(len(self.cell_rows), dtype=bool)
+        codes = self.codes_for(values)
+        if codes:
+            mask[self.code_cells[np.in1d(self.cell_codes, codes)]] = True
+        return mask
+
+    # Weighted co-occurrence matrix X^T.X for the rows in mask, where X is the
+    # row x token count matrix. Rows are folded into their distinct cells
+    # first; every ordered pair of codes within a cell (a code with itself
+    # included) then adds the cell's row count, so the work grows with the
+    # pairs rather than with cells x vocabulary.
+    def cooccurrence(self, mask=None):
+        cells = self.row_cells if mask is None else self.row_cells[mask]
+        weights = np.bincount(cells, minlength=len(self.cell_rows))
+        cells = np.flatnonzero(weights)
+        starts = self.indptr[self.cell_rows[cells]]
+        lengths = np.diff(self.indptr)[self.cell_rows[cells]].astype(np.int64)
+
+        sizes = lengths ** 2
+        pair_cells = np.repeat(np.arange(len(cells)), sizes)
+        offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        first = self.codes[starts[pair_cells] + offsets // lengths[pair_cells]].astype(np.int64)
+        second = self.codes[starts[pair_cells] + offsets % lengths[pair_cells]]
+        vocab = len(self.vocab)
+        counts = np.bincount(first * vocab + second, weights=weights[cells][pair_cells], minlength=vocab * vocab)
+        return counts.astype(np.int64).reshape(vocab, vocab)
+
+
+# Upper-triangle edges (sources, targets, weights) of a co-occurrence matrix.
+# Edges lighter than min_weight are dropped and, with top_k, an edge is only
+# kept when it is among the top_k heaviest edges of one of its two nodes.
+def cooccurrence_edges(matrix, min_weight=1, top_k=None):
+    weights = np.array(matrix, dtype=np.int64)
+    np.fill_diagonal(weights, 0)
+    weights[weights < max(min_weight, 1)] = 0
+
+    if top_k and len(weights) > top_k:
+        order = np.argsort(-weights, axis=1, kind='mergesort')
+        ranks = np.empty_like(order)
+        ranks[np.arange(len(weights))[:, None], order] = np.arange(len(weights))
+        weights[(ranks >= top_k) & (ranks.T >= top_k)] = 0
+
+    sources, targets = np.nonzero(np.triu(weights, 1))
+    return sources, targets, weights[sources, targets]
@@ -0,0 +1,185 @@
+# Benchmarks of the chart helpers and every dash callback on synthetic sheets
+# of several sizes. Each size runs in a fresh process with the figure cache
+# disabled, so every call computes its result. Per-snapshot structures
+# (token indexes, aggregate cubes, row masks) are built up front and reused,
+# as they are in production.
+#
+# Results are written as JSON. Given a baseline from an earlier run, the
+# benchmark exits non-zero when a median is more than --threshold slower.
+#
+#   python -m tools.bench --out bench.json
+#   python -m tools.bench --baseline bench.json --threshold 0.25
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tools.synthetic import synthetic_sheet
+
+
+def filter_states(snapshot, count, seed=0):
+    from tools.traffic import input_choices
+    choices = input_choices(snapshot)
+    rand = random.Random(seed)
+    return [{dim: rand.choice(choices[dim]) for dim in ['scale', 'status', 'teams', 'ptheme', 'window']}
+            for _ in range(count)]
+
+
+# Calls every function in calls repeat times, returning seconds per call
+def time_calls(calls, repeat):
+    times = []
+    for call in calls:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        'calls': len(times),
+        'median_ms': 1000 * times[len(times) // 2],
+        'p95_ms': 1000 * times[min(len(times) - 1, int(len(times) * 0.95))],
+        'max_ms': 1000 * times[-1],
+    }
+
+
+def benchmark_calls(app, states):
+    from columns import col_name
+    from filters import row_masks
+    from tools.traffic import sample_calls, run_call
+
+    snapshot = app.current_snapshot()
+    masks = row_masks(snapshot)
+    calls = {}
+
+    def add(name, func, *args):
+        calls.setdefault(name, []).append(lambda: func(*args))
+
+    for state in states:
+        mask = masks.mask(state['scale'], state['status'], state['teams'], state['ptheme'], state['window'])
+        for short, split in app.bar_columns:
+            add('column_bar_data', app.column_bar_data, col_name(short), state['scale'], state['status'],
+                state['teams'], state['ptheme'], split, state['window'])
+        for short in ['teams', 'external', 's_themes', 'all_themes']:
+            add('value_counts', snapshot.tokens[col_name(short)].value_counts, mask)
+        for short in ['teams', 'all_themes']:
+            add('graph_data', app.graph_data, snapshot.tokens[col_name(short)], mask,
+                app.graph_min_weight, app.graph_top_k)
+            for layout in ['circle', 'cose']:
+                add('graph_elements ' + layout, app.graph_elements, col_name(short), state['scale'],
+                    state['status'], state['ptheme'], layout, state['window'])
+        add('gantt_data', app.gantt_data, state['scale'], state['status'], 'Project Gantt Chart',
+            state['teams'], state['ptheme'], state['window'])
+        add('active_timeline', app.active_timeline, state['scale'], state['status'], 'Projects active per semester',
+            state['teams'], state['ptheme'], state['window'])
+
+    for output, inputs in sample_calls(app.app, snapshot, len(states)):
+        add('callback ' + output, run_call, app.app, (output, inputs))
+    return calls
+
+
+def child(args):
+    import app
+    app.current_dataset().figure_cache.max_entries = 0
+    snapshot = app.current_snapshot()
+    calls = benchmark_calls(app, filter_states(snapshot, args.states))
+    results = {}
+    for name, funcs in sorted(calls.items()):
+        # one untimed pass builds anything derived lazily
+        time_calls(funcs, 1)
+        results[name] = summarize(time_calls(funcs, args.repeat))
+    print(json.dumps(results))
+
+
+def run_size(rows, args, workdir):
+    path = os.path.join(workdir, 'synthetic-{0}.csv'.format(rows))
+    synthetic_sheet(rows, args.teams, args.themes, fanout=args.fanout).to_csv(path, index=False)
+    env = dict(os.environ, **{'dash-it-all-url': path, 'dash-it-all-refresh': '0'})
+    for name in ['dash-it-all-cache-dir', 'dash-it-all-snapshot-dir']:
+        env.pop(name, None)
+    command = [sys.executable, '-m', 'tools.bench', '--child', '--states', str(args.states),
+               '--repeat', str(args.repeat)]
+    output = subprocess.check_output(command, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+# Benchmarks whose median got slower than the baseline by more than
+# threshold (a fraction) and by more than min_ms milliseconds
+def regressions(results, baseline, threshold, min_ms):
+    found = []
+    for size, benchmarks in sorted(results['sizes'].items()):
+        for name, result in sorted(benchmarks.items()):
+            before = baseline.get('sizes', {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            slower = result['median_ms'] - before['median_ms']
+            if slower > min_ms and slower > threshold * before['median_ms']:
+                found.append((size, name, before['median_ms'], result['median_ms']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chart helpers and callbacks on synthetic sheets')
+    parser.add_argument('--sizes', default='100,10000,100000', help='comma-separated row counts')
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--themes', type=int, default=8)
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--states', type=int, default=10, help='filter combinations per benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, as a fraction')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='ignore slowdowns smaller than this')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'teams': args.teams, 'themes': args.themes, 'fanout': args.fanout,
+            'states': args.states, 'repeat': args.repeat,
+        },
+        'sizes': {},
+    }
+    workdir = tempfile.mkdtemp()
+    try:
+        for rows in [int(r) for r in args.sizes.split(',')]:
+            results['sizes'][str(rows)] = run_size(rows, args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for size, benchmarks in sorted(results['sizes'].items(), key=lambda item: int(item[0])):
+        print('{0} rows'.format(size))
+        for name, result in sorted(benchmarks.items()):
+            print('  {0:<45}{1:>10.2f} ms median{2:>10.2f} ms p95'.format(name, result['median_ms'], result['p95_ms']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.threshold, args.min_ms)
+        for size, name, before, after in found:
+            print('REGRESSION {0} rows, {1}: {2:.2f} ms -> {3:.2f} ms'.format(size, name, before, after))
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+# Writes the binary snapshots of the configured sheets ahead of time (e.g. in
+# a release phase), so even the first workers start from them. Uses the same
+# environment variables as the app; dash-it-all-snapshot-dir must be set.
+#
+#   dash-it-all-snapshot-dir=/var/tmp/dash-it-all python -m tools.build_snapshot
+import os
+import sys
+
+
+def main():
+    if 'dash-it-all-snapshot-dir' not in os.environ:
+        sys.exit('dash-it-all-snapshot-dir is not set')
+    os.environ['dash-it-all-refresh'] = '0'
+    # every sheet is written, whatever the memory budget
+    os.environ.pop('dash-it-all-memory-mb', None)
+    import app
+    for name, url in app.datasets.urls.items():
+        snapshot = app.datasets.get(name).source.snapshot
+        print('{0}: snapshot {1} ({2} rows) in {3}'.format(
+            url, snapshot.digest, len(snapshot.df), app.dataset_directory(os.environ['dash-it-all-snapshot-dir'], name)))
+
+
+if __name__ == '__main__':
+    main()
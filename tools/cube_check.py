@@ -0,0 +1,131 @@
+# Checks that bar chart data answered from the aggregate cubes matches a
+# scan over the rows. A synthetic sheet is loaded, and for every bar chart
+# column (split or not) and every combination of the status, teams, primary
+# theme and semester window choices the callbacks offer (see
+# tools.traffic.input_choices), column_bar_data's counts per resource level
+# are compared with counts taken row by row from the sheet's cleaned text,
+# as column_bar_data computed them before the cubes and token indexes.
+#
+#   python -m tools.cube_check --rows 5000
+#   dash-it-all-compact=1 python -m tools.cube_check
+import argparse
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+# The values of a comma-separated cell, as col_value_counts(split=True) did
+def cell_values(cell):
+    return [x for x in (x.strip().capitalize() for x in cell.split(',')) if x]
+
+
+# {value: count} per resource level for the rows of the sheet in mask
+def scan_counts(sheet, column, split, scale, mask):
+    from columns import col_name
+    scale_mask = mask & (sheet[col_name('scale')] == scale).values
+    if split:
+        counts = Counter(value for cell in sheet[column].values[scale_mask] for value in cell_values(cell))
+    else:
+        counts = sheet[column][scale_mask].value_counts()
+    return {label: int(count) for label, count in counts.items() if count > 0}
+
+
+# Position of every row's start and end among the semester labels the
+# window slider offers, -1 if the row has no valid semesters or ends before
+# it starts
+def semester_positions(sheet, labels):
+    from columns import col_name
+    positions = {label: i for i, label in enumerate(labels)}
+    starts = np.array([positions.get(v, -1) for v in sheet[col_name('start')]])
+    ends = np.array([positions.get(v, -1) for v in sheet[col_name('end')]])
+    valid = (starts >= 0) & (ends >= starts)
+    return np.where(valid, starts, -1), np.where(valid, ends, -1)
+
+
+def scan_mask(sheet, semesters, statuses, teams, ptheme, window):
+    from columns import col_name
+    mask = np.ones(len(sheet), dtype=bool)
+    if len(statuses) > 0:
+        mask &= sheet[col_name('status')].isin(statuses).values
+    if len(teams) > 0:
+        wanted = set(t.lower() for t in teams)
+        mask &= np.array([any(v.lower() in wanted for v in cell_values(cell)) for cell in sheet[col_name('teams')]],
+                         dtype=bool)
+    if ptheme:
+        mask &= (sheet[col_name('p_theme')] == ptheme).values
+    labels, starts, ends = semesters
+    last = len(labels) - 1
+    if window and last >= 0:
+        first, end = sorted(min(max(int(i), 0), last) for i in window)
+        # the whole range does not filter, so rows without semesters stay
+        if (first, end) != (0, last):
+            mask &= (starts >= 0) & (starts <= end) & (ends >= first)
+    return mask
+
+
+def bar_counts(app, column, split, scale, statuses, teams, ptheme, window):
+    data = app.column_bar_data(column, [scale], statuses, teams, ptheme, split, window)
+    return {label: count for trace in data for label, count in zip(trace['x'], trace['y'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare aggregate cube answers with a row scan')
+    parser.add_argument('--rows', type=int, default=3000)
+    args = parser.parse_args()
+
+    from tools.synthetic import synthetic_sheet
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'sheet.csv')
+        synthetic_sheet(args.rows).to_csv(path, index=False)
+        os.environ.update({'dash-it-all-url': path, 'dash-it-all-refresh': '0'})
+        for name in ['dash-it-all-datasets', 'dash-it-all-cache-dir', 'dash-it-all-snapshot-dir']:
+            os.environ.pop(name, None)
+
+        import app
+        from columns import col_name
+        from datasource import clean_frame
+        from semesters import snapshot_semesters
+        from tools.traffic import input_choices
+        snapshot = app.current_snapshot()
+        # compact snapshots drop the comma-separated text, so the cells are
+        # taken from the sheet itself, cleaned the way a full snapshot is
+        sheet = clean_frame(pd.read_csv(path))
+        if len(sheet) != len(snapshot.df):
+            print('sheet has {0} rows, snapshot {1}'.format(len(sheet), len(snapshot.df)))
+            return 1
+        labels = list(snapshot_semesters(snapshot)['label'])
+        semesters = (labels,) + semester_positions(sheet, labels)
+        choices = input_choices(snapshot)
+        states = list(itertools.product(choices['status'], choices['teams'], choices['ptheme'], choices['window']))
+
+        checks, problems = 0, []
+        for statuses, teams, ptheme, window in states:
+            mask = scan_mask(sheet, semesters, statuses, teams, ptheme, window)
+            for short, split in app.bar_columns:
+                column = col_name(short)
+                for scale in snapshot.valid_scales:
+                    checks += 1
+                    got = bar_counts(app, column, split, scale, statuses, teams, ptheme, window)
+                    want = scan_counts(sheet, column, split, scale, mask)
+                    if got != want:
+                        problems.append('{0} {1}: status={2} teams={3} ptheme={4} window={5}'.format(
+                            short, scale, statuses, teams, ptheme, window))
+
+        print('{0} rows, {1} filter states, {2} checks; {3} mismatches'.format(
+            len(snapshot.df), len(states), checks, len(problems)))
+        for problem in problems[:20]:
+            print('  ' + problem)
+        return 1 if problems else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+# Checks how DataSource fetches and refreshes the sheet, against a stand-in
+# HTTP server on localhost. Each case starts a fresh DataSource and asserts
+# on the snapshot version and data it ends up serving:
+#
+#   etag           an unchanged sheet is answered 304 to If-None-Match
+#   last-modified  the same with If-Modified-Since, for servers without ETags
+#   no-validators  an unchanged body without validators keeps the snapshot
+#   replace        a 200 with a new sheet publishes the next version
+#   error          a 500 keeps serving the last good snapshot
+#   timeout        so does a response slower than the fetch timeout
+#   first-load     a first load that fails raises instead of serving nothing
+#   store          a new worker uses the stored snapshot after a 304, parses
+#                  the sheet when it changed, and when the store is unusable
+#   local          a local CSV is only re-read when its mtime or size changes
+#
+#   python -m tools.datasource_check
+#   python -m tools.datasource_check --compact
+import argparse
+import hashlib
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+
+import pandas as pd
+
+from tools.loadtest import ThreadingHTTPServer
+from tools.synthetic import synthetic_sheet
+
+
+# A published sheet whose content, validators and failures the cases
+# control. Every request is recorded with its conditional headers and the
+# status it was answered with.
+class StandIn(object):
+    def __init__(self):
+        self.content = b''
+        self.revision = 0
+        self.etag = True
+        self.last_modified = True
+        self.status = 200
+        self.delay = 0
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), stand_in_handler(self))
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{0}/sheet.csv'.format(self.httpd.server_address[1])
+
+    def publish(self, content):
+        self.content = content
+        self.revision += 1
+
+    def headers(self):
+        headers = {}
+        if self.etag:
+            headers['ETag'] = '"{0}"'.format(hashlib.md5(self.content).hexdigest())
+        if self.last_modified:
+            headers['Last-Modified'] = formatdate(1500000000 + self.revision * 3600, usegmt=True)
+        return headers
+
+    # Statuses answered since the last call
+    def statuses(self):
+        statuses = [status for _, _, status in self.requests]
+        del self.requests[:]
+        return statuses
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def stand_in_handler(stand_in):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if_none_match = self.headers.get('If-None-Match')
+            if_modified_since = self.headers.get('If-Modified-Since')
+            headers = stand_in.headers()
+            if stand_in.status != 200:
+                status = stand_in.status
+            elif 'ETag' in headers and if_none_match is not None:
+                status = 304 if if_none_match == headers['ETag'] else 200
+            elif 'Last-Modified' in headers and if_modified_since == headers['Last-Modified']:
+                status = 304
+            else:
+                status = 200
+            stand_in.requests.append((if_none_match, if_modified_since, status))
+            time.sleep(stand_in.delay)
+            try:
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                body = stand_in.content if status == 200 else b''
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client gave up waiting
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    return StandInHandler
+
+
+# Messages DataSource logs, so failures can be asserted on without their
+# tracebacks cluttering the output
+class Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def take(self):
+        messages = list(self.messages)
+        del self.messages[:]
+        return messages
+
+
+def sheet_bytes(df):
+    return df.to_csv(index=False).encode('utf-8')
+
+
+# Project ids and statuses of a snapshot or sheet, which is enough to tell
+# the sheets used here apart
+def summary(df):
+    from columns import col_name
+    return list(df[col_name('pid')].astype(str)), list(df[col_name('status')].astype(str))
+
+
+def expected(content):
+    from datasource import clean_frame
+    return summary(clean_frame(pd.read_csv(io.BytesIO(content))))
+
+
+class Case(object):
+    def __init__(self, name, problems):
+        self.name = name
+        self.problems = problems
+
+    def check(self, condition, message, *args):
+        if not condition:
+            self.problems.append('{0}: {1}'.format(self.name, message.format(*args)))
+
+    # The source serves version and the given sheet
+    def serves(self, source, version, content):
+        snapshot = source.snapshot
+        self.check(snapshot.version == version, 'serving version {0}, expected {1}', snapshot.version, version)
+        self.check(summary(snapshot.df) == expected(content), 'version {0} does not hold the expected sheet',
+                   snapshot.version)
+
+
+def check_validators(case, stand_in, sheets, compact, etag, last_modified):
+    from datasource import DataSource
+    stand_in.etag, stand_in.last_modified = etag, last_modified
+    stand_in.publish(sheets[0])
+    source = DataSource(stand_in.url, compact=compact)
+    case.serves(source, 1, sheets[0])
+    first = source.snapshot
+    case.check(stand_in.statuses() == [200], 'first load was not a single 200')
+
+    case.check(not source.refresh(), 'unchanged sheet published a new version')
+    case.check(source.snapshot is first, 'unchanged sheet replaced the snapshot')
+    sent = stand_in.requests[-1][:2]
+    statuses = stand_in.statuses()
+    if etag or last_modified:
+        case.check(statuses == [304], 'unchanged sheet was answered {0}, expected 304', statuses)
+        if etag:
+            case.check(sent[0] is not None, 'no If-None-Match sent')
+        if last_modified:
+            case.check(sent[1] is not None, 'no If-Modified-Since sent')
+    else:
+        case.check(statuses == [200], 'unchanged sheet was answered {0}, expected 200', statuses)
+    case.serves(source, 1, sheets[0])
+
+
+def check_replace(case, stand_in, sheets, compact):
+    from datasource import DataSource
+    stand_in.publish(sheets[0])
+    source = DataSource(stand_in.url, compact=compact)
+    case.serves(source, 1, sheets[0])
+    stand_in.statuses()
+    stand_in.publish(sheets[1])
+    case.check(source.refresh(), 'changed sheet did not publish a new version')
+    case.check(stand_in.statuses() == [200], 'changed sheet was not answered 200')
+    case.serves(source, 2, sheets[1])
+    case.check(not source.refresh(), 'refresh after the change published again')
+    case.serves(source, 2, sheets[1])
+
+
+def check_failure(case, stand_in, sheets, compact, records, timeout):
+    from datasource import DataSource
+    stand_in.publish(sheets[0])
+    source = DataSource(stand_in.url, compact=compact, timeout=0.5)
+    case.serves(source, 1, sheets[0])
+    first = source.snapshot
+    stand_in.publish(sheets[1])
+    if timeout:
+        stand_in.delay = 1.5
+    else:
+        stand_in.status = 500
+    try:
+        records.take()
+        case.check(not source.refresh(), 'failed fetch published a new version')
+        case.check(source.snapshot is first, 'failed fetch replaced the snapshot')
+        case.check(source.last_error is not None, 'failed fetch left no last_error')
+        case.check(any('still serving version 1' in m for m in records.take()), 'failed fetch was not logged')
+        case.serves(source, 1, sheets[0])
+    finally:
+        stand_in.status, stand_in.delay = 200, 0
+
+    # the next good fetch recovers
+    case.check(source.refresh(), 'refresh after the failure did not publish')
+    case.check(source.last_error is None, 'last_error kept after recovering')
+    case.serves(source, 2, sheets[1])
+
+
+def check_first_load(case, stand_in, sheets, compact):
+    from datasource import DataSource
+    stand_in.publish(sheets[0])
+    stand_in.status = 500
+    source = DataSource(stand_in.url, compact=compact)
+    try:
+        try:
+            source.snapshot
+            case.check(False, 'failed first load did not raise')
+        except Exception:
+            case.check(not source.loaded, 'failed first load published a snapshot')
+    finally:
+        stand_in.status = 200
+    case.serves(source, 1, sheets[0])
+
+
+def check_store(case, stand_in, sheets, compact, workdir):
+    from datasource import DataSource
+    from snapshot_store import SnapshotStore
+    store_dir = os.path.join(workdir, 'store')
+    stand_in.publish(sheets[0])
+    writer = DataSource(stand_in.url, compact=compact, store=SnapshotStore(store_dir))
+    case.serves(writer, 1, sheets[0])
+    stand_in.statuses()
+
+    # a worker starting on the unchanged sheet asks with the stored
+    # validator and loads the stored snapshot on 304
+    reader = DataSource(stand_in.url, compact=compact, store=SnapshotStore(store_dir))
+    case.serves(reader, 1, sheets[0])
+    statuses = stand_in.statuses()
+    case.check(statuses == [304], 'start on the stored snapshot was answered {0}, expected 304', statuses)
+    case.check(not reader.refresh(), 'refresh after the stored snapshot published again')
+    case.check(stand_in.statuses() == [304], 'refresh after the stored snapshot was not answered 304')
+
+    # the sheet changed since the snapshot was stored: it is parsed
+    stand_in.publish(sheets[1])
+    changed = DataSource(stand_in.url, compact=compact, store=SnapshotStore(store_dir))
+    case.serves(changed, 1, sheets[1])
+    statuses = stand_in.statuses()
+    case.check(statuses == [200], 'changed sheet was answered {0}, expected 200', statuses)
+
+    # an unusable stored snapshot falls back to fetching the sheet
+    store = SnapshotStore(store_dir)
+    manifest = store.current(stand_in.url, compact)
+    path = os.path.join(store_dir, manifest['digest'])
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            os.remove(os.path.join(path, name))
+    broken = DataSource(stand_in.url, compact=compact, store=store)
+    case.serves(broken, 1, sheets[1])
+    statuses = stand_in.statuses()
+    case.check(statuses == [304, 200], 'unusable store was answered {0}, expected 304 then 200', statuses)
+
+
+def check_local(case, sheets, compact, workdir):
+    from datasource import DataSource
+    path = os.path.join(workdir, 'sheet.csv')
+    with open(path, 'wb') as f:
+        f.write(sheets[0])
+    source = DataSource(path, compact=compact)
+    case.serves(source, 1, sheets[0])
+    case.check(not source.refresh(), 'unchanged file published a new version')
+    with open(path, 'wb') as f:
+        f.write(sheets[1])
+    # sheets[1] has fewer rows, so the size changes even within one mtime tick
+    case.check(source.refresh(), 'changed file did not publish a new version')
+    case.serves(source, 2, sheets[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check DataSource fetches against a stand-in HTTP server')
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--compact', action='store_true')
+    args = parser.parse_args()
+
+    records = Records()
+    logger = logging.getLogger('datasource')
+    logger.addHandler(records)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    from columns import col_name
+    first = synthetic_sheet(args.rows)
+    second = first.iloc[:-10].copy()
+    second[col_name('status')] = 'Completed'
+    sheets = [sheet_bytes(first), sheet_bytes(second)]
+
+    workdir = tempfile.mkdtemp()
+    stand_in = StandIn()
+    problems = []
+    cases = [
+        ('etag', lambda c: check_validators(c, stand_in, sheets, args.compact, True, False)),
+        ('last-modified', lambda c: check_validators(c, stand_in, sheets, args.compact, False, True)),
+        ('no-validators', lambda c: check_validators(c, stand_in, sheets, args.compact, False, False)),
+        ('replace', lambda c: check_replace(c, stand_in, sheets, args.compact)),
+        ('error', lambda c: check_failure(c, stand_in, sheets, args.compact, records, False)),
+        ('timeout', lambda c: check_failure(c, stand_in, sheets, args.compact, records, True)),
+        ('first-load', lambda c: check_first_load(c, stand_in, sheets, args.compact)),
+        ('store', lambda c: check_store(c, stand_in, sheets, args.compact, workdir)),
+        ('local', lambda c: check_local(c, sheets, args.compact, workdir)),
+    ]
+    try:
+        for name, run in cases:
+            stand_in.etag = stand_in.last_modified = True
+            stand_in.statuses()
+            case = Case(name, problems)
+            try:
+                run(case)
+            except Exception as e:
+                case.check(False, 'raised {0!r}', e)
+            print('{0:<15} {1}'.format(name, 'ok' if not any(p.startswith(name + ':') for p in problems)
+                                       else 'FAILED'))
+    finally:
+        stand_in.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print('{0} cases; {1} problems'.format(len(cases), len(problems)))
+    for problem in problems:
+        print('  ' + problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# Checks that the relationship graphs built from the token indexes match the
+# nested-loop graph_data they replaced. A synthetic sheet is loaded, and for
+# both graph columns and every combination of the resource level, status,
+# primary theme and semester window choices the callbacks offer (see
+# tools.traffic.input_choices), graph_elements' nodes and edge weights are
+# compared with ones counted pair by pair from the comma-separated cells of
+# the filtered rows, as graph_data did before the token indexes.
+#
+#   python -m tools.graph_check --rows 3000
+#   dash-it-all-compact=1 python -m tools.graph_check
+import argparse
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+# The cells of a comma-separated column split into capitalized values
+def col_groups(col_series):
+    return [[x.strip().capitalize() for x in row.split(',')] for row in col_series]
+
+
+# (node labels, {frozenset((label, label)): weight}) counted the way the
+# nested-loop graph_data did: every value of a cell is linked to every other
+# value of the same cell. Empty values, which that version drew as a node
+# with no label, are left out.
+def reference_graph(groups):
+    nodes = set()
+    pairs = {}
+    for group in groups:
+        group = [val for val in group if val]
+        nodes.update(group)
+        for val in group:
+            for other_val in group:
+                if other_val != val:
+                    pairs[(val, other_val)] = pairs.get((val, other_val), 0) + 1
+    edges = {}
+    for (val, other_val), weight in pairs.items():
+        edges.setdefault(frozenset((val, other_val)), weight)
+    return nodes, edges
+
+
+def app_graph(elements):
+    labels = {}
+    edges = {}
+    for element in elements:
+        data = element['data']
+        if 'source' in data:
+            edges[frozenset((data['source'], data['target']))] = data['weight']
+        else:
+            labels[data['id']] = data['label']
+    return set(labels.values()), {frozenset(labels[i] for i in pair): weight for pair, weight in edges.items()}
+
+
+def scan_mask(snapshot, scales, statuses, ptheme, window):
+    from columns import col_name
+    from semesters import semester_index
+    df = snapshot.df
+    mask = np.ones(len(df), dtype=bool)
+    if len(statuses) > 0:
+        mask &= df[col_name('status')].isin(statuses).values
+    if len(scales) > 0:
+        mask &= df[col_name('scale')].isin(scales).values
+    if ptheme:
+        mask &= (df[col_name('p_theme')] == ptheme).values
+    index = semester_index(snapshot)
+    bounds = index.window(window)
+    if bounds is not None:
+        first, last = bounds
+        mask &= (index.starts >= 0) & (index.starts <= last) & (index.ends >= first)
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare graph elements with the nested-loop graph_data')
+    parser.add_argument('--rows', type=int, default=3000)
+    args = parser.parse_args()
+
+    from tools.synthetic import synthetic_sheet
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'sheet.csv')
+        synthetic_sheet(args.rows).to_csv(path, index=False)
+        os.environ.update({'dash-it-all-url': path, 'dash-it-all-refresh': '0'})
+        for name in ['dash-it-all-datasets', 'dash-it-all-cache-dir', 'dash-it-all-snapshot-dir',
+                     'dash-it-all-graph-min-weight', 'dash-it-all-graph-top-k']:
+            os.environ.pop(name, None)
+
+        import app
+        from datasource import clean_frame
+        from tools.traffic import input_choices
+        snapshot = app.current_snapshot()
+        # compact snapshots drop the comma-separated text, so the cells are
+        # taken from the sheet itself, cleaned the way a full snapshot is
+        sheet = clean_frame(pd.read_csv(path))
+        if len(sheet) != len(snapshot.df):
+            print('sheet has {0} rows, snapshot {1}'.format(len(sheet), len(snapshot.df)))
+            return 1
+        choices = input_choices(snapshot)
+        states = list(itertools.product(choices['scale'], choices['status'], choices['ptheme'], choices['window']))
+
+        checks, problems = 0, []
+        for scales, statuses, ptheme, window in states:
+            mask = scan_mask(snapshot, scales, statuses, ptheme, window)
+            for column in app.graph_columns:
+                checks += 1
+                got = app_graph(app.graph_elements(column, scales, statuses, ptheme, window=window))
+                want = reference_graph(col_groups(sheet[column].values[mask]))
+                if got != want:
+                    problems.append('{0}: scale={1} status={2} ptheme={3} window={4}'.format(
+                        column, scales, statuses, ptheme, window))
+
+        print('{0} rows, {1} filter states, {2} checks; {3} mismatches'.format(
+            len(snapshot.df), len(states), checks, len(problems)))
+        for problem in problems[:20]:
+            print('  ' + problem)
+        return 1 if problems else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
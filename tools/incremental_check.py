@@ -0,0 +1,180 @@
+# Checks that refreshing a snapshot incrementally gives the same result as
+# building it from scratch. A synthetic sheet is loaded and every callback
+# is run once to fill the figure cache; then a few projects are edited,
+# added and deleted and the sheet is refreshed. The refreshed snapshot's
+# frame, token indexes, semester dates, bar chart cubes and graph weights
+# are compared with a full rebuild, and every callback's response (cached
+# figures carried over included) with one computed without the cache.
+#
+#   python -m tools.incremental_check --rows 10000 --edits 20
+#   dash-it-all-compact=1 python -m tools.incremental_check
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def edit_sheet(df, edits, seed=0):
+    from columns import col_name
+    rand = random.Random(seed)
+    df = df.copy()
+    rows = rand.sample(range(len(df)), min(3 * edits, len(df)))
+    edited, deleted, copied = rows[:edits], rows[edits:2 * edits], rows[2 * edits:]
+    teams = sorted(set(t.strip() for cell in df[col_name('teams')].dropna() for t in cell.split(',') if t.strip()))
+    for i, row in enumerate(edited):
+        column = ['teams', 'status', 'start', 'desc', 's_themes'][i % 5]
+        if column == 'teams':
+            value = ', '.join(rand.sample(teams, 2) + (['Team New'] if i % 2 else []))
+        elif column == 'status':
+            value = rand.choice(['Committed', 'Completed', 'Potential', 'In progress'])
+        elif column == 'start':
+            value = rand.choice(['2017/2018-02', '2019/2020-03', 'unknown'])
+        elif column == 's_themes':
+            value = 'T1, T9'
+        else:
+            value = 'Edited description'
+        df.iat[row, df.columns.get_loc(col_name(column))] = value
+    added = df.iloc[copied].copy()
+    added[col_name('pid')] = ['N{0:06d}'.format(i) for i in range(len(added))]
+    return pd.concat([df.drop(df.index[deleted]), added], ignore_index=True)
+
+
+# Whether every row holds the same codes as the first row of its cell, which
+# stands for the cell in co-occurrence counts and table text
+def same_cell_tokens(index):
+    lengths = np.diff(index.indptr)
+    first_rows = index.cell_rows[index.row_cells]
+    if not np.array_equal(lengths, lengths[first_rows]):
+        return False
+    positions = index.indptr[first_rows[index.rows]] + np.arange(len(index.codes)) - index.indptr[index.rows]
+    return np.array_equal(index.codes, index.codes[positions])
+
+
+def compare_tokens(name, incremental, full):
+    problems = []
+    if incremental.vocab != full.vocab:
+        problems.append('{0}: vocabularies differ'.format(name))
+        return problems
+    for part in ['indptr', 'codes', 'rows']:
+        if not np.array_equal(getattr(incremental, part), getattr(full, part)):
+            problems.append('{0}: {1} differ'.format(name, part))
+    if not (same_cell_tokens(incremental) and same_cell_tokens(full)):
+        problems.append('{0}: rows sharing a cell hold different tokens'.format(name))
+    if not np.array_equal(incremental.cooccurrence(), full.cooccurrence()):
+        problems.append('{0}: co-occurrence differs'.format(name))
+    return problems
+
+
+def compare_snapshots(app, incremental, full, states):
+    from columns import col_name
+    from cube import AggregateCube
+    from graph_layouts import GraphLayouts, graph_layouts
+    from semesters import semester_index
+
+    problems = []
+    if not incremental.df.equals(full.df):
+        problems.append('frames differ')
+    for column in full.tokens:
+        problems += compare_tokens(column, incremental.tokens[column], full.tokens[column])
+    for name in ['start_dates', 'end_dates']:
+        if not np.array_equal(getattr(incremental, name).view('i8'), getattr(full, name).view('i8')):
+            problems.append('{0} differ'.format(name))
+
+    for short, split in app.bar_columns:
+        column = col_name(short)
+        cube = app.bar_cube(incremental, column, split)
+        fresh = AggregateCube.build(full, column, split)
+        for state in states:
+            window = semester_index(full).window(state['window'])
+            for scale in full.valid_scales:
+                got = cube.value_counts(scale, cube.cell_mask(state['status'], state['teams'], state['ptheme'],
+                                                              window))
+                want = fresh.value_counts(scale, fresh.cell_mask(state['status'], state['teams'], state['ptheme'],
+                                                                 window))
+                if not got.equals(want):
+                    problems.append('cube {0}: value counts differ for {1} {2}'.format(short, scale, state))
+                    break
+
+    for column in app.graph_columns:
+        layouts, fresh = graph_layouts(incremental, column), GraphLayouts(full.tokens[column])
+        if not np.array_equal(layouts.weights, fresh.weights):
+            problems.append('graph {0}: weights differ'.format(column))
+        for name in list(layouts._layouts):
+            if not np.array_equal(layouts.full(name)[0], fresh.full(name)[0]):
+                problems.append('graph {0}: carried {1} layout differs'.format(column, name))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare an incremental refresh with a full rebuild')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--edits', type=int, default=20,
+                        help='projects edited, and as many added and deleted; capped so the refresh stays incremental')
+    parser.add_argument('--per-callback', type=int, default=20)
+    args = parser.parse_args()
+
+    # an edit counts twice (old and new row), additions and deletions once,
+    # so 4 * edits changed rows; past MAX_CHANGED_FRACTION the refresh
+    # rebuilds the snapshot and there is nothing to compare
+    from changes import MAX_CHANGED_FRACTION
+    limit = max(int(MAX_CHANGED_FRACTION * args.rows / 4) - 1, 1)
+    if args.edits > limit:
+        print('{0} edits would rebuild a {1}-row sheet from scratch, using {2}'.format(args.edits, args.rows, limit))
+        args.edits = limit
+
+    from tools.synthetic import synthetic_sheet
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'sheet.csv')
+        sheet = synthetic_sheet(args.rows)
+        sheet.to_csv(path, index=False)
+        os.environ.update({'dash-it-all-url': path, 'dash-it-all-refresh': '0'})
+        for name in ['dash-it-all-cache-dir', 'dash-it-all-snapshot-dir']:
+            os.environ.pop(name, None)
+
+        import app
+        from tools.bench import filter_states
+        from datasource import Snapshot, clean_frame, read_sheet
+        from tools.traffic import sample_calls, run_call
+
+        dataset = app.current_dataset()
+        calls = sample_calls(app.app, app.current_snapshot(), args.per_callback)
+        for call in calls:
+            run_call(app.app, call)
+
+        edit_sheet(sheet, args.edits).to_csv(path, index=False)
+        os.utime(path, None)
+        dataset.source.refresh()
+        incremental = app.current_snapshot()
+        if incremental.changes is None:
+            print('The refresh rebuilt the snapshot instead of updating it')
+            return 1
+        full = Snapshot.build(clean_frame(read_sheet(path, path, 'Projects'), incremental.compact),
+                              incremental.version, compact=incremental.compact)
+        problems = compare_snapshots(app, incremental, full, filter_states(full, 20))
+
+        carried = dataset.figure_cache.stats()['carried']
+        responses = [run_call(app.app, call) for call in calls]
+        dataset.figure_cache.clear()
+        dataset.figure_cache.max_entries = 0
+        for call, response in zip(calls, responses):
+            if run_call(app.app, call) != response:
+                problems.append('callback {0}: response differs for {1}'.format(
+                    call[0], [i['value'] for i in call[1]]))
+
+        print('{0} rows, {1} changed; {2} cached figures of {3} carried over; {4} problems'.format(
+            len(full.df), len(incremental.changes), carried, len(calls), len(problems)))
+        for problem in problems[:20]:
+            print('  ' + problem)
+        return 1 if problems else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# Load test: replays dash callback requests against app:server running under
+# gunicorn and reports throughput and p50/p95/p99 latency per callback. The
+# sheet is a synthetic one served by a stand-in HTTP server on localhost, so
+# the run works offline.
+#
+# Requests are synthesized from the registered callbacks (see
+# tools.traffic), or replayed from a file written by --record. Each worker
+# class gets a freshly started server: the first pass over the requests
+# meets empty figure caches (cold), the passes after it filled ones (warm).
+# With more than one worker process, a warm request can still land on a
+# worker that has not seen it.
+#
+#   python -m tools.loadtest --rows 10000 --concurrency 8 --worker-classes sync,gthread
+#   python -m tools.loadtest --record calls.json
+#   python -m tools.loadtest --replay calls.json --out loadtest.json
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from tools.synthetic import synthetic_sheet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Settings of the calling environment the servers under test must not inherit
+UNSET = ['dash-it-all-pass', 'dash-it-all-cache-dir', 'dash-it-all-snapshot-dir', 'dash-it-all-profile-dir']
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# Serves one CSV the way the published sheet is served, answering
+# conditional requests with 304 Not Modified
+def sheet_handler(content):
+    etag = '"{0}"'.format(hashlib.md5(content).hexdigest())
+
+    class SheetHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return SheetHandler
+
+
+def serve_sheet(content):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), sheet_handler(content))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, 'http://127.0.0.1:{0}/sheet.csv'.format(httpd.server_address[1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def app_env(sheet_url):
+    env = dict(os.environ, **{'dash-it-all-url': sheet_url, 'dash-it-all-refresh': '0'})
+    for name in UNSET:
+        env.pop(name, None)
+    return env
+
+
+# The sync worker handles one request at a time per process; gunicorn would
+# turn it into gthread if it were given --threads
+def start_app(worker_class, args, sheet_url, port):
+    command = [sys.executable, '-m', 'gunicorn', 'app:server', '--worker-class', worker_class,
+               '--workers', str(args.processes), '--bind', '127.0.0.1:{0}'.format(port), '--timeout', '300']
+    if worker_class != 'sync':
+        command += ['--threads', str(args.threads)]
+    return subprocess.Popen(command, cwd=ROOT, env=app_env(sheet_url),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(base, process, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with {0}'.format(process.returncode))
+        try:
+            if requests.get(base + '/_dash-layout', timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('{0} did not start within {1}s'.format(base, timeout))
+
+
+# Request bodies for _dash-update-component, sampled from the callbacks
+# registered on the app (loaded here from the stand-in sheet)
+def synthesize_calls(sheet_url, per_callback):
+    os.environ.update(app_env(sheet_url))
+    for name in UNSET:
+        os.environ.pop(name, None)
+    import app
+    from tools.traffic import sample_calls
+    calls = sample_calls(app.app, app.current_snapshot(), per_callback)
+    return [{'output': output, 'inputs': inputs, 'state': []} for output, inputs in calls]
+
+
+# Posts every call passes times from concurrency threads. Returns
+# (output, pass, seconds, ok) per request and the wall time of each pass.
+def replay(base, calls, concurrency, passes, seed=0):
+    local = threading.local()
+    url = base + '/_dash-update-component'
+
+    def post(job):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        body = calls[job]
+        start = time.perf_counter()
+        try:
+            ok = session.post(url, json=body, timeout=300).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return body['output'], time.perf_counter() - start, ok
+
+    rand = random.Random(seed)
+    results, walls = [], []
+    with ThreadPoolExecutor(concurrency) as pool:
+        for number in range(passes):
+            jobs = list(range(len(calls)))
+            rand.shuffle(jobs)
+            start = time.perf_counter()
+            done = list(pool.map(post, jobs))
+            walls.append(time.perf_counter() - start)
+            results.extend((output, number, seconds, ok) for output, seconds, ok in done)
+    return results, walls
+
+
+def percentile(times, fraction):
+    return 1000 * times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def summarize(times, errors, wall=None):
+    times = sorted(times)
+    summary = {'calls': len(times), 'errors': errors}
+    if times:
+        summary.update(p50_ms=percentile(times, 0.5), p95_ms=percentile(times, 0.95), p99_ms=percentile(times, 0.99))
+    if wall:
+        summary['throughput'] = len(times) / wall
+    return summary
+
+
+# {'cold': {...}, 'warm': {...}}, each holding a summary of every callback
+# and of all requests together
+def report(results, walls):
+    phases = {'cold': ([r for r in results if r[1] == 0], walls[:1]),
+              'warm': ([r for r in results if r[1] > 0], walls[1:])}
+    summaries = {}
+    for phase, (rows, phase_walls) in phases.items():
+        if not rows:
+            continue
+        by_callback = {}
+        for output, _, seconds, ok in rows:
+            by_callback.setdefault(output, []).append((seconds, ok))
+        summary = {output: summarize([s for s, _ in timings], sum(1 for _, ok in timings if not ok))
+                   for output, timings in by_callback.items()}
+        summary['all'] = summarize([r[2] for r in rows], sum(1 for r in rows if not r[3]), sum(phase_walls))
+        summaries[phase] = summary
+    return summaries
+
+
+def print_report(worker_class, summaries):
+    for phase in ['cold', 'warm']:
+        if phase not in summaries:
+            continue
+        summary = summaries[phase]
+        print('{0}, {1} caches: {2:.1f} requests/s, {3} errors'.format(
+            worker_class, phase, summary['all']['throughput'], summary['all']['errors']))
+        for output in sorted(summary, key=lambda o: (o == 'all', o)):
+            result = summary[output]
+            name = output if len(output) <= 45 else output[:42] + '...'
+            print('  {0:<45}{1:>6} calls{2:>10.1f} p50{3:>10.1f} p95{4:>10.1f} p99 ms'.format(
+                name, result['calls'], result['p50_ms'], result['p95_ms'], result['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay dash callback traffic against gunicorn')
+    parser.add_argument('--rows', type=int, default=10000, help='rows of the synthetic sheet')
+    parser.add_argument('--worker-classes', default='sync,gthread', help='comma-separated gunicorn worker classes')
+    parser.add_argument('--processes', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight')
+    parser.add_argument('--per-callback', type=int, default=10, help='distinct requests per callback')
+    parser.add_argument('--passes', type=int, default=3, help='passes over the requests; the first is cold')
+    parser.add_argument('--record', help='write the synthesized requests to this file and exit')
+    parser.add_argument('--replay', help='replay the requests in this file instead of synthesizing them')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    content = synthetic_sheet(args.rows).to_csv(index=False).encode('utf-8')
+    httpd, sheet_url = serve_sheet(content)
+    try:
+        if args.replay:
+            with open(args.replay) as f:
+                calls = json.load(f)
+        else:
+            calls = synthesize_calls(sheet_url, args.per_callback)
+        if args.record:
+            with open(args.record, 'w') as f:
+                json.dump(calls, f)
+            print('Recorded {0} requests to {1}'.format(len(calls), args.record))
+            return 0
+
+        results = {'meta': {'rows': args.rows, 'processes': args.processes, 'threads': args.threads,
+                            'concurrency': args.concurrency, 'requests': len(calls), 'passes': args.passes,
+                            'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                   'worker_classes': {}}
+        failed = False
+        for worker_class in args.worker_classes.split(','):
+            port = free_port()
+            process = start_app(worker_class, args, sheet_url, port)
+            try:
+                base = 'http://127.0.0.1:{0}'.format(port)
+                wait_ready(base, process)
+                summaries = report(*replay(base, calls, args.concurrency, args.passes))
+            finally:
+                process.terminate()
+                process.wait()
+            results['worker_classes'][worker_class] = summaries
+            print_report(worker_class, summaries)
+            failed = failed or any(s['all']['errors'] for s in summaries.values())
+    finally:
+        httpd.shutdown()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
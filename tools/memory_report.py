@@ -0,0 +1,63 @@
+# Per-worker memory of a loaded snapshot in the default and the compact
+# layout (dash-it-all-compact), measured on a synthetic sheet. Each layout is
+# loaded in a fresh process that imports the app like a gunicorn worker.
+#
+#   python -m tools.memory_report --rows 100000
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from tools.synthetic import synthetic_sheet
+
+
+def rss_bytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def child():
+    # load the libraries first so only the data counts towards the difference
+    import dash, dash_core_components, dash_html_components, dash_cytoscape, dash_table, plotly.graph_objs, pandas
+    before = rss_bytes()
+    import gc
+    import app
+    snapshot = app.current_snapshot()
+    gc.collect()
+    after = rss_bytes()
+    print('{0}\t{1}\t{2}'.format(after - before, snapshot.nbytes(), snapshot.df.memory_usage(deep=True).sum()))
+
+
+def measure(path, compact):
+    env = dict(os.environ, **{'dash-it-all-url': path, 'dash-it-all-refresh': '0'})
+    env.pop('dash-it-all-compact', None)
+    if compact:
+        env['dash-it-all-compact'] = '1'
+    output = subprocess.check_output([sys.executable, '-m', 'tools.memory_report', '--child'], env=env)
+    return [int(v) for v in output.decode().strip().splitlines()[-1].split('\t')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare snapshot memory in the default and compact layouts')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    path = os.path.join(tempfile.mkdtemp(), 'synthetic.csv')
+    synthetic_sheet(args.rows).to_csv(path, index=False)
+    print('{0} rows'.format(args.rows))
+    print('{0:<10}{1:>14}{2:>14}{3:>14}'.format('layout', 'worker RSS', 'snapshot', 'frame'))
+    for name, compact in [('default', False), ('compact', True)]:
+        rss, snapshot, frame = measure(path, compact)
+        print('{0:<10}{1:>11.1f} MB{2:>11.1f} MB{3:>11.1f} MB'.format(name, rss / 1e6, snapshot / 1e6, frame / 1e6))
+
+
+if __name__ == '__main__':
+    main()
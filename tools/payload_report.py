@@ -0,0 +1,52 @@
+# Bytes on the wire per callback: the JSON each callback returns for a sample
+# of realistic inputs, raw and compressed the way the server compresses it
+# (gzip, and brotli if the brotli package is installed).
+#
+#   dash-it-all-url=sheet.csv python -m tools.payload_report --per-callback 20
+import argparse
+import gzip
+import json
+import sys
+
+import app
+from compression import brotli
+from tools.traffic import sample_calls, run_call
+
+
+def sizes(payload):
+    data = payload.encode('utf-8')
+    result = {'raw': len(data), 'gzip': len(gzip.compress(data, app.gzip_level))}
+    if brotli is not None:
+        result['brotli'] = len(brotli.compress(data, quality=app.brotli_quality))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure response sizes of every dash callback')
+    parser.add_argument('--per-callback', type=int, default=20)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for output, inputs in sample_calls(app.app, app.current_snapshot(), args.per_callback):
+        measured = sizes(run_call(app.app, (output, inputs)))
+        totals = results.setdefault(output, {'calls': 0})
+        totals['calls'] += 1
+        for encoding, size in measured.items():
+            totals[encoding] = totals.get(encoding, 0) + size
+
+    encodings = ['raw', 'gzip'] + (['brotli'] if brotli is not None else [])
+    print(('{:<40}' + '{:>12}' * len(encodings)).format('mean bytes per call', *encodings))
+    for output in sorted(results):
+        totals = results[output]
+        name = output if len(output) <= 38 else output[:35] + '...'
+        print(('{:<40}' + '{:>12.0f}' * len(encodings)).format(
+            name, *[totals[e] / float(totals['calls']) for e in encodings]))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
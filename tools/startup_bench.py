@@ -0,0 +1,126 @@
+# Cold-start time and RSS of a worker, loading a synthetic sheet either by
+# parsing the spreadsheet or from a stored binary snapshot. Every run is a
+# fresh process importing the app the way a gunicorn worker does, and the
+# time is broken into phases:
+#
+#   libraries  importing dash, its component suites, pandas and plotly
+#   data       loading the first snapshot, warmers included
+#   layout     building the page layout for that snapshot
+#   app        everything else in the app import (callbacks, routes)
+#
+#   python -m tools.startup_bench --rows 100000
+#
+# --format xlsx times a workbook instead of a CSV. Writing the synthetic
+# workbook needs openpyxl or xlsxwriter, which are not in requirements.txt.
+import argparse
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tools.synthetic import synthetic_sheet
+
+PHASES = ['libraries', 'data', 'layout', 'app', 'total']
+
+
+def child():
+    start = time.time()
+    import dash
+    import dash_auth
+    import dash_core_components
+    import dash_cytoscape
+    import dash_html_components
+    import numpy
+    import pandas
+    import plotly.graph_objs
+    libraries = time.time() - start
+    import app
+    total = time.time() - start
+    # the layout built during the import is memoized, so it is rebuilt once
+    # on its own to time it
+    snapshot = app.current_snapshot()
+    layout_start = time.time()
+    app.build_layout(snapshot)
+    layout = time.time() - layout_start
+    data = app.current_dataset().source.last_duration
+    from tools.memory_report import rss_bytes
+    print(json.dumps({
+        'libraries': libraries,
+        'data': data,
+        'layout': layout,
+        'app': total - libraries - data - layout,
+        'total': total,
+        'rss': rss_bytes(),
+    }))
+
+
+def run(path, store, compact):
+    env = dict(os.environ, **{'dash-it-all-url': path, 'dash-it-all-refresh': '0'})
+    for name in ['dash-it-all-snapshot-dir', 'dash-it-all-compact']:
+        env.pop(name, None)
+    if store:
+        env['dash-it-all-snapshot-dir'] = store
+    if compact:
+        env['dash-it-all-compact'] = '1'
+    output = subprocess.check_output([sys.executable, '-m', 'tools.startup_bench', '--child'], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+# Name of an installed module pandas can write .xlsx files with, or None
+def excel_writer():
+    for name in ['openpyxl', 'xlsxwriter']:
+        try:
+            importlib.import_module(name)
+            return name
+        except ImportError:
+            pass
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the phases of a worker cold start, from the sheet and from a binary snapshot')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+    if args.format == 'xlsx' and not excel_writer():
+        parser.error('--format xlsx needs openpyxl or xlsxwriter to write the synthetic workbook '
+                     '(pip install openpyxl), or use --format csv')
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'synthetic.' + args.format)
+        sheet = synthetic_sheet(args.rows)
+        if args.format == 'csv':
+            sheet.to_csv(path, index=False)
+        else:
+            sheet.to_excel(path, 'Projects', index=False, engine=excel_writer())
+        store = os.path.join(workdir, 'snapshot')
+        # the first run parses the sheet and writes the snapshot
+        run(path, store, args.compact)
+
+        print('{0} rows from {1}, seconds per phase (median of {2} runs)'.format(args.rows, args.format, args.runs))
+        print(('{:<10}' + '{:>10}' * len(PHASES) + '{:>10}').format('source', *(PHASES + ['RSS MB'])))
+        for name, store_dir in [('sheet', None), ('snapshot', store)]:
+            results = [run(path, store_dir, args.compact) for _ in range(args.runs)]
+            medians = [median([r[key] for r in results]) for key in PHASES + ['rss']]
+            medians[-1] /= 1e6
+            print(('{:<10}' + '{:>10.2f}' * len(PHASES) + '{:>10.1f}').format(name, *medians))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
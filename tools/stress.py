@@ -0,0 +1,63 @@
+# Concurrency stress test: runs every dash callback from many threads at once
+# and checks each response is identical to a single-threaded run. With
+# --refresh, new snapshots of the same sheet are published while requests
+# are in flight.
+#
+#   python -m tools.stress --threads 16 --rounds 10 --refresh
+import argparse
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+from tools.traffic import sample_calls, run_call
+
+
+def refresher(stop, interval):
+    source = app.current_dataset().source
+    while not stop.wait(interval):
+        # forget the validator so the unchanged sheet is loaded again
+        source._validator = None
+        source.refresh()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--per-callback', type=int, default=20)
+    parser.add_argument('--no-cache', action='store_true', help='compute every figure from scratch')
+    parser.add_argument('--refresh', action='store_true', help='publish new snapshots during the run')
+    args = parser.parse_args()
+
+    if args.no_cache:
+        app.current_dataset().figure_cache.max_entries = 0
+
+    calls = sample_calls(app.app, app.current_snapshot(), args.per_callback)
+    expected = [run_call(app.app, call) for call in calls]
+
+    jobs = list(range(len(calls))) * args.rounds
+    random.shuffle(jobs)
+
+    stop = threading.Event()
+    if args.refresh:
+        threading.Thread(target=refresher, args=(stop, 0.2), daemon=True).start()
+
+    start = time.time()
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = list(pool.map(lambda i: run_call(app.app, calls[i]), jobs))
+    elapsed = time.time() - start
+    stop.set()
+
+    mismatches = [i for i, result in zip(jobs, results) if result != expected[i]]
+    print('{0} calls on {1} threads in {2:.2f}s, {3} snapshot versions, {4} mismatches'.format(
+        len(jobs), args.threads, elapsed, app.current_dataset().source.version, len(mismatches)))
+    for i in sorted(set(mismatches))[:10]:
+        print('  mismatch: {0} {1}'.format(calls[i][0], [c['value'] for c in calls[i][1]]))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# Synthetic planning sheets with the same columns as the real one, for
+# benchmarks and memory measurements. The size of the team, theme, grouping
+# and external party vocabularies and the most values per multi-value cell
+# (fanout) are configurable.
+#
+#   python -m tools.synthetic --rows 100000 --out synthetic.csv
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from columns import col_name
+
+STATUSES = ['Committed', 'In progress', 'Completed', 'Potential', 'rejected ', ' Duplicate']
+SCALES = ['Low', 'Medium', 'High ']
+WORDS = ['catalogue', 'digital', 'archive', 'service', 'review', 'migration', 'research',
+         'collection', 'space', 'training', 'data', 'open', 'access', 'system', 'support']
+
+
+def semester_labels(first_year=2016, years=8):
+    return ['{0}/{1}-0{2}'.format(y, y + 1, s) for y in range(first_year, first_year + years) for s in [1, 2, 3]]
+
+
+# Comma-joined cells of between low and fanout distinct values each
+def multi_values(rng, vocab, rows, fanout, low=0):
+    sizes = rng.randint(low, fanout + 1, size=rows)
+    return [', '.join(rng.choice(vocab, size, replace=False)) for size in sizes]
+
+
+def synthetic_sheet(rows, teams=20, themes=8, groupings=12, externals=15, fanout=3, seed=0):
+    rng = np.random.RandomState(seed)
+    team_names = ['Team {0}'.format(i) for i in range(teams)]
+    theme_names = ['T{0}'.format(i) for i in range(1, themes + 1)]
+    external_names = ['Partner {0}'.format(i) for i in range(externals)]
+    semesters = semester_labels()
+
+    starts = rng.randint(0, len(semesters), size=rows)
+    ends = np.minimum(starts + rng.randint(0, 6, size=rows), len(semesters) - 1)
+    start_labels = np.array(semesters, dtype=object)[starts]
+    end_labels = np.array(semesters, dtype=object)[ends]
+    # a few projects without usable semesters, as in the real sheet
+    start_labels[rng.rand(rows) < 0.02] = np.nan
+    end_labels[rng.rand(rows) < 0.02] = 'TBC'
+
+    words = np.array(WORDS, dtype=object)
+    return pd.DataFrame({
+        col_name('pid'): ['P{0:06d}'.format(i) for i in range(rows)],
+        col_name('project'): [' '.join(words[rng.randint(0, len(words), 3 + n)]).capitalize()
+                              for n in rng.randint(0, 6, size=rows)],
+        col_name('desc'): [' '.join(words[rng.randint(0, len(words), 12)]) for _ in range(rows)],
+        col_name('grouping'): rng.choice(['Grouping {0}'.format(i) for i in range(groupings)], rows),
+        col_name('scale'): rng.choice(SCALES, rows),
+        col_name('status'): rng.choice(STATUSES, rows),
+        col_name('p_theme'): rng.choice(theme_names, rows),
+        col_name('s_themes'): multi_values(rng, theme_names, rows, min(fanout, themes)),
+        col_name('teams'): multi_values(rng, team_names, rows, min(fanout, teams), low=1),
+        col_name('external'): multi_values(rng, external_names, rows, min(fanout, externals)),
+        col_name('start'): start_labels,
+        col_name('end'): end_labels,
+    }, columns=[col_name(c) for c in ['pid', 'project', 'desc', 'grouping', 'scale', 'status',
+                                      'p_theme', 's_themes', 'teams', 'external', 'start', 'end']])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic planning sheet as CSV')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--themes', type=int, default=8)
+    parser.add_argument('--groupings', type=int, default=12)
+    parser.add_argument('--externals', type=int, default=15)
+    parser.add_argument('--fanout', type=int, default=3, help='most values in a multi-value cell')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='synthetic.csv')
+    args = parser.parse_args()
+    sheet = synthetic_sheet(args.rows, args.teams, args.themes, args.groupings, args.externals, args.fanout, args.seed)
+    sheet.to_csv(args.out, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import itertools
+import random
+
+from columns import col_name
+from semesters import snapshot_semesters
+
+# Realistic values for each kind of callback input, keyed by the suffix of
+# the component id (status-bar-scale -> scale)
+def input_choices(snapshot):
+    teams = [t.lower() for t in snapshot.tokens[col_name('teams')].vocab]
+    last = max(len(snapshot_semesters(snapshot)) - 1, 0)
+    return {
+        'scale': [[], list(snapshot.valid_scales)] + [[s] for s in snapshot.valid_scales],
+        'status': [[], ['Committed', 'In progress', 'Completed']] + [[s] for s in snapshot.valid_status],
+        'teams': [[], teams[:1], teams[:2]],
+        'ptheme': [None] + list(snapshot.valid_pthemes),
+        'barmode': ['stack', 'group'],
+        'themes': ['p_theme', 's_themes', 'all_themes'],
+        'layout': ['circle', 'cose'],
+        'window': [[0, last], [0, last // 2], [last // 2, last], [last, last]],
+        'detail': ['auto', 'projects', 'grouping', 'p_theme'],
+        'page': [1, 2, None],
+        'pagination_settings': [{'current_page': 0, 'page_size': 25}, {'current_page': 3, 'page_size': 25}],
+        'sorting_settings': [[], [{'column_id': 'project', 'direction': 'asc'}],
+                             [{'column_id': 'start', 'direction': 'desc'}, {'column_id': 'pid', 'direction': 'asc'}]],
+        'filtering_settings': ['', '"status" eq Committed', '"teams" eq "{0}" && "start" ge 2019/2020-01'.format(
+            teams[0] if teams else '')],
+    }
+
+def choices_for(choices, component_id, component_property):
+    if component_property == 'tapNode':
+        return [None]
+    if component_property in choices:
+        return choices[component_property]
+    return choices[component_id.rsplit('-', 1)[-1]]
+
+# Samples up to per_callback distinct input combinations for every callback
+# registered on the dash app. Returns (output, inputs) pairs where inputs is
+# the list of {'id', 'property', 'value'} dicts dash posts to
+# _dash-update-component.
+def sample_calls(dash_app, snapshot, per_callback=20, seed=0):
+    rand = random.Random(seed)
+    choices = input_choices(snapshot)
+    calls = []
+    for output in sorted(dash_app.callback_map):
+        inputs = dash_app.callback_map[output]['inputs']
+        options = [choices_for(choices, i['id'], i['property']) for i in inputs]
+        for combo in sample_combinations(rand, [len(o) for o in options], per_callback):
+            values = [dict(i, value=o[c]) for i, o, c in zip(inputs, options, combo)]
+            calls.append((output, values))
+    return calls
+
+# Up to count distinct index combinations; callbacks with many inputs (the
+# filter bar's batched callback) have too many to enumerate
+def sample_combinations(rand, sizes, count):
+    total = 1
+    for size in sizes:
+        total *= size
+    if total <= 100000:
+        combos = list(itertools.product(*[range(size) for size in sizes]))
+        rand.shuffle(combos)
+        return combos[:count]
+    combos = []
+    while len(combos) < count:
+        combo = tuple(rand.randrange(size) for size in sizes)
+        if combo not in combos:
+            combos.append(combo)
+    return combos
+
+# Runs a sampled call directly against the app, returning the JSON response
+def run_call(dash_app, call):
+    output, inputs = call
+    return dash_app.callback_map[output]['callback'](*[i['value'] for i in inputs])